@@ -1,5 +1,5 @@
 # COMPLETE SOLUTION - Run Project WITHOUT MongoDB
-# This script starts both backend (mock) and frontend
+# This script starts both backend (in-memory storage) and frontend
 
 Write-Host "========================================" -ForegroundColor Cyan
 Write-Host "  ClothPOS - Quick Start (No MongoDB)" -ForegroundColor Cyan
@@ -8,7 +8,7 @@ Write-Host ""
 
 $projectDir = Split-Path -Parent $MyInvocation.MyCommand.Path
 
-Write-Host "✅ This version uses a MOCK backend" -ForegroundColor Green
+Write-Host "✅ This version runs the real API on in-memory storage" -ForegroundColor Green
 Write-Host "✅ NO MongoDB installation required!" -ForegroundColor Green
 Write-Host "✅ Perfect for testing the frontend" -ForegroundColor Green
 Write-Host ""
@@ -42,20 +42,21 @@ if ($port3000) {
 Write-Host "✅ Ports are ready!" -ForegroundColor Green
 Write-Host ""
 
-# Start Mock Backend
+# Start Backend (in-memory storage)
 Write-Host "========================================" -ForegroundColor Cyan
-Write-Host "  Starting Mock Backend Server..." -ForegroundColor Cyan
+Write-Host "  Starting Backend Server (In-Memory)..." -ForegroundColor Cyan
 Write-Host "========================================" -ForegroundColor Cyan
 
 $backendCmd = @"
 `$Host.UI.RawUI.WindowTitle = 'ClothPOS - Backend Server'
 Write-Host '========================================' -ForegroundColor Green
-Write-Host '  BACKEND SERVER (Mock - No MongoDB)' -ForegroundColor Green
+Write-Host '  BACKEND SERVER (In-Memory - No MongoDB)' -ForegroundColor Green
 Write-Host '========================================' -ForegroundColor Green
 Write-Host ''
 cd '$projectDir\backend'
 .\venv\Scripts\Activate.ps1
-python mock_server.py
+`$env:STORAGE_BACKEND = 'memory'
+python -m uvicorn server:app --host 0.0.0.0 --port 8000
 "@
 
 Start-Process powershell -ArgumentList "-NoExit", "-Command", $backendCmd
@@ -145,11 +146,11 @@ Write-Host "💡 Important:" -ForegroundColor Yellow
 Write-Host "   - Two PowerShell windows are now running" -ForegroundColor White
 Write-Host "   - Keep both windows open while using the app" -ForegroundColor White
 Write-Host "   - Close them to stop the servers" -ForegroundColor White
-Write-Host "   - This uses MOCK data (no real database)" -ForegroundColor White
+Write-Host "   - Data lives in memory and resets when the backend stops" -ForegroundColor White
 Write-Host ""
 Write-Host "📝 Note:" -ForegroundColor Gray
-Write-Host "   This is a mock backend for testing." -ForegroundColor Gray
-Write-Host "   For full functionality, install MongoDB later." -ForegroundColor Gray
+Write-Host "   Demo data is loaded on startup (john / jane, password demo123)." -ForegroundColor Gray
+Write-Host "   Install MongoDB and run server.py normally for persistent data." -ForegroundColor Gray
 Write-Host ""
 Write-Host "========================================" -ForegroundColor Green
 Write-Host ""
@@ -0,0 +1,249 @@
+"""Priority-aware admission control for API requests.
+
+Every ``/api`` request is put in a route class by method and path. Each
+class has its own concurrency limit, a bounded queue and a longest queue
+wait. The worker as a whole runs at most ``capacity`` requests at once.
+When a slot frees up, it goes to the highest-priority class that has
+waiters and room under its own limit, so checkout and barcode scans get
+ahead of listings, reports and exports.
+
+A running request cannot be preempted, and a report that holds the event
+loop for a few hundred milliseconds delays every checkout awaiting a
+database reply. Lower classes therefore also wait while more than
+``defer_above`` requests of more urgent classes are running or queued.
+
+A request that finds its class queue full, or that waits longer than the
+class allows, is shed at once with 503 and ``Retry-After``. Low-priority
+classes have short queues and waits, so they fail fast under load instead
+of piling up behind the event loop.
+"""
+import asyncio
+import os
+import re
+import time
+from collections import deque
+from typing import Deque, Dict, FrozenSet, List, Optional, Tuple
+
+from starlette.responses import JSONResponse
+
+import metrics
+
+# name: (priority, limit, queue, wait seconds, defer above, retry-after seconds); lower priority runs first
+DEFAULT_CLASSES = {
+    "checkout": (0, 64, 512, 10.0, None, 1),
+    "standard": (1, 32, 128, 5.0, None, 1),
+    "listing": (2, 16, 32, 2.0, 16, 2),
+    "report": (3, 2, 8, 1.0, 4, 5),
+    "export": (4, 1, 2, 0.5, 2, 30),
+}
+
+# (class, methods or None for any, path); the first match wins, other /api requests are "standard"
+DEFAULT_RULES: Tuple[Tuple[str, Optional[FrozenSet[str]], str], ...] = (
+    ("checkout", frozenset({"POST"}), r"/api/billing(/return)?"),
+    ("checkout", frozenset({"GET"}), r"/api/products/search/barcode/[^/]+"),
+    ("checkout", frozenset({"GET"}), r"/api/products/scan/[^/]+"),
+    ("checkout", frozenset({"GET"}), r"/api/customers/search/[^/]+"),
+    ("checkout", frozenset({"POST"}), r"/api/payments/create-intent"),
+    ("checkout", frozenset({"POST"}), r"/api/auth/login"),
+    ("export", frozenset({"POST", "DELETE"}), r"/api/admin/(archive|analytics|customers|inventory)/.+"),
+    ("report", None, r"/api/(reports|analytics|dashboard)/.+"),
+    ("report", frozenset({"GET"}), r"/api/inventory/movements/net"),
+    ("listing", frozenset({"GET"}), r"/api/(products|products/changes|billing|branches|employees|customers/[^/]+/bills"
+                                    r"|commissions/(my|all)|inventory/(low-stock|movements|transfers))"),
+)
+
+
+class RouteClass:
+    def __init__(self, name: str, priority: int, limit: int, queue: int, wait_seconds: float,
+                 defer_above: Optional[int], retry_after: int):
+        self.name = name
+        self.priority = priority
+        self.limit = limit
+        self.queue = queue
+        self.wait_seconds = wait_seconds
+        self.defer_above = defer_above
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.shed = 0
+
+    def status(self) -> dict:
+        return {
+            "priority": self.priority,
+            "limit": self.limit,
+            "queue": self.queue,
+            "waitSeconds": self.wait_seconds,
+            "deferAbove": self.defer_above,
+            "inFlight": self.in_flight,
+            "queued": len(self.waiters),
+            "admitted": self.admitted,
+            "shed": self.shed,
+        }
+
+
+class AdmissionController:
+    def __init__(self, capacity: int, classes: Dict[str, RouteClass], rules=DEFAULT_RULES):
+        self.capacity = capacity
+        self.classes = classes
+        self.in_flight = 0
+        self._by_priority = sorted(classes.values(), key=lambda route_class: route_class.priority)
+        self._rules = [(classes[name], methods, re.compile(path + "$")) for name, methods, path in rules]
+        self._default = classes["standard"]
+        CONTROLLERS.append(self)
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        """Limits from ADMISSION_MAX_CONCURRENCY and ADMISSION_<CLASS>_{LIMIT,QUEUE,WAIT_SECONDS,DEFER_ABOVE}"""
+        classes = {}
+        for name, (priority, limit, queue, wait_seconds, defer_above, retry_after) in DEFAULT_CLASSES.items():
+            prefix = f"ADMISSION_{name.upper()}_"
+            defer_above = os.environ.get(prefix + "DEFER_ABOVE", defer_above)
+            classes[name] = RouteClass(
+                name,
+                priority,
+                int(os.environ.get(prefix + "LIMIT", limit)),
+                int(os.environ.get(prefix + "QUEUE", queue)),
+                float(os.environ.get(prefix + "WAIT_SECONDS", wait_seconds)),
+                int(defer_above) if defer_above not in (None, "") else None,
+                retry_after
+            )
+        return cls(int(os.environ.get("ADMISSION_MAX_CONCURRENCY", "64")), classes)
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def classify(self, method: str, path: str) -> RouteClass:
+        for route_class, methods, pattern in self._rules:
+            if (methods is None or method in methods) and pattern.match(path):
+                return route_class
+        return self._default
+
+    def _has_room(self, route_class: RouteClass) -> bool:
+        if route_class.in_flight >= route_class.limit or self.in_flight >= self.capacity:
+            return False
+        if route_class.defer_above is None:
+            return True
+        urgent = sum(other.in_flight + len(other.waiters) for other in self._by_priority if other.priority < route_class.priority)
+        return urgent <= route_class.defer_above
+
+    def _admit(self, route_class: RouteClass) -> None:
+        route_class.in_flight += 1
+        route_class.admitted += 1
+        self.in_flight += 1
+
+    def _can_start(self, route_class: RouteClass) -> bool:
+        """Room now, and no more urgent class is queued for a worker-wide slot"""
+        if route_class.waiters or not self._has_room(route_class):
+            return False
+        for other in self._by_priority:
+            if other is route_class:
+                return True
+            if other.waiters and other.in_flight < other.limit:
+                return False
+        return True
+
+    async def acquire(self, route_class: RouteClass) -> Optional[str]:
+        """Take a slot for the request; returns why it was shed, or None once admitted"""
+        if self._can_start(route_class):
+            self._admit(route_class)
+            return None
+        if len(route_class.waiters) >= route_class.queue:
+            return self._shed(route_class, "queue_full")
+        waiter = asyncio.get_running_loop().create_future()
+        route_class.waiters.append(waiter)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), route_class.wait_seconds)
+        except asyncio.TimeoutError:
+            if not waiter.done():
+                route_class.waiters.remove(waiter)
+                waiter.cancel()
+                return self._shed(route_class, "timeout")
+        except asyncio.CancelledError:
+            # The client went away while queued
+            if waiter.done() and not waiter.cancelled():
+                self.release(route_class)
+            else:
+                route_class.waiters.remove(waiter)
+                waiter.cancel()
+            raise
+        finally:
+            queue_wait.observe(time.perf_counter() - started, route_class.name)
+        return None
+
+    def release(self, route_class: RouteClass) -> None:
+        route_class.in_flight -= 1
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        for route_class in self._by_priority:
+            while route_class.waiters and self._has_room(route_class):
+                waiter = route_class.waiters.popleft()
+                if waiter.done():
+                    continue
+                self._admit(route_class)
+                waiter.set_result(None)
+            if self.in_flight >= self.capacity:
+                return
+
+    def _shed(self, route_class: RouteClass, reason: str) -> str:
+        route_class.shed += 1
+        shed_requests.inc(route_class.name, reason)
+        return reason
+
+    def status(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "inFlight": self.in_flight,
+            "classes": {route_class.name: route_class.status() for route_class in self._by_priority},
+        }
+
+
+class AdmissionMiddleware:
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        # Metrics and health checks are never queued
+        if scope["type"] != "http" or not self.controller.enabled or not scope["path"].startswith("/api/"):
+            await self.app(scope, receive, send)
+            return
+        route_class = self.controller.classify(scope["method"], scope["path"])
+        shed = await self.controller.acquire(route_class)
+        if shed is not None:
+            response = JSONResponse(
+                {"detail": "Server is busy, please retry shortly"},
+                status_code=503,
+                headers={"Retry-After": str(route_class.retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(route_class)
+
+
+CONTROLLERS: List[AdmissionController] = []
+
+
+def _class_values(field: str) -> Dict[tuple, int]:
+    return {
+        (route_class.name,): len(route_class.waiters) if field == "queued" else route_class.in_flight
+        for controller in CONTROLLERS
+        for route_class in controller.classes.values()
+    }
+
+
+in_flight = metrics.register(metrics.Gauge(
+    "admission_in_flight", "Requests running per route class", ("class",), lambda: _class_values("in_flight")))
+queue_depth = metrics.register(metrics.Gauge(
+    "admission_queue_depth", "Requests waiting for a slot per route class", ("class",), lambda: _class_values("queued")))
+queue_wait = metrics.register(metrics.Histogram(
+    "admission_queue_wait_seconds", "Time requests spent queued before admission or shedding", ("class",)))
+shed_requests = metrics.register(metrics.Counter(
+    "admission_shed_total", "Requests rejected with 503 by route class and reason", ("class", "reason")))
@@ -0,0 +1,325 @@
+"""Hot/cold tiering for bills.
+
+Bills older than the horizon move from ``bills`` into one collection per
+month (``bills_archive_YYYY_MM``), so the hot collection and its indexes
+only hold recent activity. Two small collections keep archived bills
+reachable without scanning the archive:
+
+* ``bill_archive_index`` maps a bill id to its month, with the customer,
+  branch and employee it belongs to.
+* ``bill_rollups`` holds per-day sales totals by branch and employee, used
+  by the sales report and dashboard for archived days.
+
+Every step of a run is idempotent (copies are upserts and rollups are
+recomputed per month rather than incremented), so an interrupted run is
+completed by the next one.
+"""
+import asyncio
+import copy
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from pymongo import ReplaceOne
+
+logger = logging.getLogger(__name__)
+
+COLLECTION_PREFIX = "bills_archive_"
+BATCH_SIZE = 500
+REPORT_STATUS_EXCLUDED = "returned"
+
+
+def month_of(created_at: str) -> str:
+    return created_at[:7]
+
+
+def collection_name(month: str) -> str:
+    return COLLECTION_PREFIX + month.replace("-", "_")
+
+
+def empty_totals() -> dict:
+    return {"count": 0, "totalSales": 0, "totalDiscount": 0, "paymentMethods": {}}
+
+
+def add_bill(totals: dict, bill: dict) -> None:
+    totals["count"] += 1
+    totals["totalSales"] += bill["totalAmount"]
+    totals["totalDiscount"] += bill["discountAmount"]
+    method = totals["paymentMethods"].setdefault(bill["paymentMethod"], {"count": 0, "total": 0})
+    method["count"] += 1
+    method["total"] += bill["totalAmount"]
+
+
+def merge_totals(totals: dict, other: dict) -> None:
+    totals["count"] += other["count"]
+    totals["totalSales"] += other["totalSales"]
+    totals["totalDiscount"] += other["totalDiscount"]
+    for name, method in other["paymentMethods"].items():
+        target = totals["paymentMethods"].setdefault(name, {"count": 0, "total": 0})
+        target["count"] += method["count"]
+        target["total"] += method["total"]
+
+
+class BillArchive:
+    def __init__(
+        self,
+        db,
+        horizon_days: int,
+        interval_hours: float = 0,
+        read_db=None,
+        on_archived: Optional[Callable[[], Awaitable[None]]] = None
+    ):
+        self.db = db
+        # Report reads (rollups, archived bill listings) may go to a secondary
+        self.read_db = read_db if read_db is not None else db
+        self.horizon_days = horizon_days
+        self.interval_hours = interval_hours
+        self.last_run: Optional[dict] = None
+        self._indexed_months = set()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        # Told after a run moved bills; reports read while they were in flight may be wrong
+        self.on_archived = on_archived
+
+    def reading_from(self, read_db) -> "BillArchive":
+        """This archive with its report reads sent to `read_db`, e.g. the primary"""
+        view = copy.copy(self)
+        view.read_db = read_db
+        return view
+
+    async def ensure_indexes(self) -> None:
+        await self.db.bill_archive_index.create_index("id", unique=True)
+        await self.db.bill_archive_index.create_index([("customerId", 1), ("createdAt", 1)])
+        await self.db.bill_archive_index.create_index("branchId")
+        await self.db.bill_rollups.create_index("id", unique=True)
+        await self.db.bill_rollups.create_index([("month", 1), ("day", 1)])
+        await self.db.bill_rollups.create_index([("branchId", 1), ("day", 1)])
+        await self.db.bill_rollups.create_index([("employeeId", 1), ("day", 1)])
+
+    async def _collection(self, month: str):
+        collection = self.db[collection_name(month)]
+        if month not in self._indexed_months:
+            await collection.create_index("id", unique=True)
+            await collection.create_index("customerId")
+            await collection.create_index("createdAt")
+            self._indexed_months.add(month)
+        return collection
+
+    async def months(self) -> List[str]:
+        """Archived months, oldest first"""
+        names = await self.db.list_collection_names()
+        return sorted(name[len(COLLECTION_PREFIX):].replace("_", "-") for name in names if name.startswith(COLLECTION_PREFIX))
+
+    # Archiving
+
+    async def run(self, horizon_days: Optional[int] = None, batch_size: int = BATCH_SIZE) -> dict:
+        """Move bills older than the horizon out of the hot collection"""
+        horizon = self.horizon_days if horizon_days is None else horizon_days
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=horizon)).isoformat()
+        async with self._lock:
+            started = datetime.now(timezone.utc)
+            state = await self.db.archive_state.find_one({"id": "bills"}, {"_id": 0}) or {}
+            dirty = set(state.get("dirtyMonths", []))
+            moved = 0
+            while True:
+                # Bills still waiting for commission accrual or the sales counters stay hot until the workers catch up
+                batch = await self.db.bills.find(
+                    {"createdAt": {"$lt": cutoff}, "commissionAccrued": {"$ne": False}, "countersRecorded": {"$ne": False}}, {"_id": 0}
+                ).sort("createdAt", 1).limit(batch_size).to_list(None)
+                if not batch:
+                    break
+                by_month: Dict[str, List[dict]] = {}
+                for bill in batch:
+                    by_month.setdefault(month_of(bill["createdAt"]), []).append(bill)
+                # Record the months first so an interrupted run still refreshes their rollups
+                await self.db.archive_state.update_one(
+                    {"id": "bills"}, {"$addToSet": {"dirtyMonths": {"$each": list(by_month)}}}, upsert=True
+                )
+                dirty.update(by_month)
+                for month, bills in by_month.items():
+                    collection = await self._collection(month)
+                    await collection.bulk_write([ReplaceOne({"id": bill["id"]}, bill, upsert=True) for bill in bills], ordered=False)
+                await self.db.bill_archive_index.bulk_write([
+                    ReplaceOne({"id": bill["id"]}, {
+                        "id": bill["id"],
+                        "month": month_of(bill["createdAt"]),
+                        "billNumber": bill["billNumber"],
+                        "customerId": bill["customerId"],
+                        "branchId": bill["branchId"],
+                        "employeeId": bill["employeeId"],
+                        "createdAt": bill["createdAt"]
+                    }, upsert=True)
+                    for bill in batch
+                ], ordered=False)
+                await self.db.bills.delete_many({"id": {"$in": [bill["id"] for bill in batch]}})
+                moved += len(batch)
+
+            for month in sorted(dirty):
+                await self.refresh_rollups(month)
+            if dirty:
+                await self.db.archive_state.update_one({"id": "bills"}, {"$pullAll": {"dirtyMonths": sorted(dirty)}})
+            if moved and self.on_archived is not None:
+                await self.on_archived()
+            self.last_run = {
+                "startedAt": started.isoformat(),
+                "cutoff": cutoff,
+                "moved": moved,
+                "months": sorted(dirty),
+                "seconds": (datetime.now(timezone.utc) - started).total_seconds()
+            }
+        if moved:
+            logger.info("Archived %d bills older than %s into %d months", moved, cutoff, len(dirty))
+        return self.last_run
+
+    async def refresh_rollups(self, month: str) -> None:
+        """Recompute the per-day rollups of one archived month"""
+        collection = await self._collection(month)
+        groups = await collection.aggregate([
+            {"$match": {"status": {"$ne": REPORT_STATUS_EXCLUDED}}},
+            {"$group": {
+                "_id": {
+                    "day": {"$substr": ["$createdAt", 0, 10]},
+                    "branchId": "$branchId",
+                    "employeeId": "$employeeId",
+                    "paymentMethod": "$paymentMethod"
+                },
+                "count": {"$sum": 1},
+                "total": {"$sum": "$totalAmount"},
+                "discount": {"$sum": "$discountAmount"}
+            }}
+        ]).to_list(None)
+        rollups: Dict[str, dict] = {}
+        for group in groups:
+            key = group["_id"]
+            rollup_id = f"{key['day']}:{key['branchId']}:{key['employeeId']}"
+            rollup = rollups.setdefault(rollup_id, {
+                "id": rollup_id,
+                "month": month,
+                "day": key["day"],
+                "branchId": key["branchId"],
+                "employeeId": key["employeeId"],
+                **empty_totals()
+            })
+            rollup["count"] += group["count"]
+            rollup["totalSales"] += group["total"]
+            rollup["totalDiscount"] += group["discount"]
+            rollup["paymentMethods"][key["paymentMethod"]] = {"count": group["count"], "total": group["total"]}
+        await self.db.bill_rollups.delete_many({"month": month})
+        if rollups:
+            await self.db.bill_rollups.insert_many(list(rollups.values()))
+
+    def start(self) -> None:
+        if self.interval_hours > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run_periodically(), name="bill-archive")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval_hours * 3600)
+            try:
+                await self.run()
+            except Exception:
+                logger.exception("Bill archive run failed")
+
+    # Reads
+
+    async def locate(self, bill_id: str) -> Optional[str]:
+        entry = await self.db.bill_archive_index.find_one({"id": bill_id}, {"_id": 0, "month": 1})
+        return entry["month"] if entry else None
+
+    async def get_bill(self, bill_id: str) -> Optional[dict]:
+        month = await self.locate(bill_id)
+        if month is None:
+            return None
+        return await self.db[collection_name(month)].find_one({"id": bill_id}, {"_id": 0})
+
+    async def update_bill(self, bill_id: str, update: dict, condition: Optional[dict] = None) -> bool:
+        """Apply an update to an archived bill matching `condition` and refresh its month's rollups; False if none matched"""
+        month = await self.locate(bill_id)
+        if month is None:
+            return False
+        result = await self.db[collection_name(month)].update_one({"id": bill_id, **(condition or {})}, update)
+        if not result.matched_count:
+            return False
+        await self.refresh_rollups(month)
+        return True
+
+    async def customer_bills(self, query: dict, limit: int, projection: Optional[dict] = None) -> List[dict]:
+        """Newest archived bills whose index entries match `query` (customerId, createdAt and id)"""
+        entries = await self.db.bill_archive_index.find(
+            query, {"_id": 0, "id": 1, "month": 1}
+        ).sort([("createdAt", -1), ("id", -1)]).limit(limit).to_list(None)
+        by_month: Dict[str, List[str]] = {}
+        for entry in entries:
+            by_month.setdefault(entry["month"], []).append(entry["id"])
+        bills = []
+        for month, ids in sorted(by_month.items()):
+            bills.extend(await self.db[collection_name(month)].find({"id": {"$in": ids}}, projection or {"_id": 0}).to_list(None))
+        bills.sort(key=lambda bill: (bill["createdAt"], bill["id"]), reverse=True)
+        return bills
+
+    async def count_branch_bills(self, branch_id: str) -> int:
+        return await self.db.bill_archive_index.count_documents({"branchId": branch_id})
+
+    async def find_bills(self, query: dict, start_date: Optional[str], end_date: Optional[str], limit: int) -> List[dict]:
+        """Newest archived bills matching `query`, reading only the months in range"""
+        bills = []
+        for month in reversed(await self.months()):
+            if len(bills) >= limit:
+                break
+            if (start_date and month < start_date[:7]) or (end_date and month > end_date[:7]):
+                continue
+            bills.extend(await self.read_db[collection_name(month)].find(query, {"_id": 0})
+                         .sort("createdAt", -1).limit(limit - len(bills)).to_list(None))
+        return bills
+
+    async def sales_totals(
+        self,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        branch_id: Optional[str] = None,
+        employee_id: Optional[str] = None
+    ) -> dict:
+        """Sales totals of archived, non-returned bills with createdAt in [start_date, end_date].
+
+        Days strictly between the first and last day of the range come from
+        the rollups; the boundary days, where only part of the day may be in
+        range, are summed from the archived bills themselves.
+        """
+        filters = {}
+        if branch_id:
+            filters["branchId"] = branch_id
+        if employee_id:
+            filters["employeeId"] = employee_id
+        start_day = start_date[:10] if start_date else None
+        end_day = end_date[:10] if end_date else None
+
+        totals = empty_totals()
+        interior = {}
+        if start_day:
+            interior["$gt"] = start_day
+        if end_day:
+            interior["$lt"] = end_day
+        rollup_query = {**filters, "day": interior} if interior else filters
+        async for rollup in self.read_db.bill_rollups.find(rollup_query, {"_id": 0}):
+            merge_totals(totals, rollup)
+
+        created_at = {}
+        if start_date:
+            created_at["$gte"] = start_date
+        if end_date:
+            created_at["$lte"] = end_date
+        for day in sorted({day for day in (start_day, end_day) if day}):
+            collection = self.read_db[collection_name(month_of(day))]
+            query = {**filters, "status": {"$ne": REPORT_STATUS_EXCLUDED}, "createdAt": {**created_at, "$regex": f"^{day}"}}
+            async for bill in collection.find(query, {"_id": 0, "totalAmount": 1, "discountAmount": 1, "paymentMethod": 1}):
+                add_bill(totals, bill)
+        return totals
@@ -0,0 +1,80 @@
+"""In-memory barcode index for the scan endpoint.
+
+Each worker keeps every variant barcode mapped to the fields a till needs
+(product id and name, SKU, size, color, price), so a scan never reads the
+product document. The map is rebuilt when the ``catalog`` stamp moves.
+Product creates and edits bump that stamp. Stock changes do not: stock is
+read per scan, for the caller's branch only.
+
+Until the invalidation bus is live, lookups go to the database.
+"""
+import asyncio
+from typing import Dict, List, Optional
+
+import metrics
+from coordination import InvalidationBus
+
+COLLECTION = "catalog"
+
+PROJECTION = {"_id": 0, "id": 1, "name": 1, "category": 1, "variants.sku": 1, "variants.barcode": 1,
+              "variants.size": 1, "variants.color": 1, "variants.price": 1}
+
+
+def _entries(product: dict) -> Dict[str, dict]:
+    return {
+        variant["barcode"]: {
+            "productId": product["id"],
+            "name": product["name"],
+            "category": product.get("category"),
+            "sku": variant["sku"],
+            "barcode": variant["barcode"],
+            "size": variant.get("size"),
+            "color": variant.get("color"),
+            "price": variant["price"],
+        }
+        for variant in product.get("variants", [])
+        if variant.get("barcode")
+    }
+
+
+class BarcodeIndex:
+    def __init__(self, db, bus: InvalidationBus):
+        self.db = db
+        self.bus = bus
+        self._entries: Dict[str, dict] = {}
+        self._version: Optional[int] = None
+        self._lock = asyncio.Lock()
+        self.loads = 0
+        INDEXES.append(self)
+
+    async def lookup(self, barcode: str) -> Optional[dict]:
+        """Variant scanned as `barcode`; treat the result as read-only"""
+        if not self.bus.live:
+            product = await self.db.products.find_one({"variants.barcode": barcode}, PROJECTION)
+            return _entries(product).get(barcode) if product else None
+        if self._version != self.bus.version(COLLECTION):
+            await self._load()
+        return self._entries.get(barcode)
+
+    async def _load(self) -> None:
+        async with self._lock:
+            version = self.bus.version(COLLECTION)
+            if self._version == version:
+                return
+            entries: Dict[str, dict] = {}
+            async for product in self.db.products.find({}, PROJECTION):
+                for barcode, entry in _entries(product).items():
+                    entries.setdefault(barcode, entry)
+            self._entries = entries
+            self._version = version
+            self.loads += 1
+
+    def size(self) -> int:
+        return len(self._entries)
+
+
+INDEXES: List[BarcodeIndex] = []
+
+entries = metrics.register(metrics.Gauge(
+    "barcode_index_entries", "Barcodes held in the in-memory scan index", (),
+    lambda: {(): sum(index.size() for index in INDEXES)}))
@@ -0,0 +1,6 @@
+"""In-process benchmark suite for the ClothPOS API.
+
+Run from the backend directory:
+
+    python -m benchmarks.run --bills 10000
+"""
@@ -0,0 +1,164 @@
+"""Synthetic catalog, customer and bill history generation"""
+import random
+import uuid
+from datetime import datetime, timezone, timedelta
+
+CATEGORIES = ["Clothing", "Footwear", "Accessories", "Outerwear", "Sportswear"]
+COLORS = ["Red", "Blue", "Black", "White", "Green", "Grey"]
+SIZES = ["XS", "S", "M", "L", "XL"]
+PAYMENT_METHODS = ["cash", "card", "upi"]
+
+
+class Dataset:
+    """Identifiers of the generated data that scenarios draw from"""
+
+    def __init__(self):
+        self.branch_ids = []
+        self.employees = []
+        self.customer_phones = []
+        self.skus = []
+        self.barcodes = []
+        self.bill_ids = []
+        self.bill_skus = {}
+
+
+async def generate(db, hash_password, *, branches: int = 5, products: int = 500, customers: int = 5000,
+                   bills: int = 1000, employees_per_branch: int = 4, seed: int = 42, batch_size: int = 5000) -> Dataset:
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    data = Dataset()
+
+    branch_docs = []
+    for b in range(branches):
+        branch_docs.append({
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "name": f"Branch {b + 1}",
+            "address": f"{b + 1} Bench Street",
+            "contactNumber": f"+1555000{b:04d}",
+            "isActive": True,
+            "createdAt": now.isoformat()
+        })
+    await db.branches.insert_many(branch_docs)
+    data.branch_ids = [b["id"] for b in branch_docs]
+
+    # Hashing is deliberately slow, so every benchmark employee shares one password hash
+    password_hash = hash_password("bench")
+    employee_docs = []
+    for branch_id in data.branch_ids:
+        for e in range(employees_per_branch):
+            username = f"bench-{branch_id[:8]}-{e}"
+            employee_docs.append({
+                "id": str(uuid.UUID(int=rng.getrandbits(128))),
+                "fullName": f"Bench Employee {e}",
+                "username": username,
+                "password": password_hash,
+                "role": "manager" if e == 0 else "cashier",
+                "branchId": branch_id,
+                "commissionRate": 0.05,
+                "isActive": True,
+                "createdAt": now.isoformat()
+            })
+    await db.employees.insert_many(employee_docs)
+    data.employees = [(e["username"], "bench", e["id"], e["branchId"]) for e in employee_docs]
+
+    product_docs = []
+    inventory_docs = []
+    prices = {}
+    names = {}
+    for p in range(products):
+        product_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        variants = []
+        for color in rng.sample(COLORS, 2):
+            for size in rng.sample(SIZES, 3):
+                sku = f"P{p:06d}-{color.upper()}-{size}"
+                barcode = f"{880000000000 + len(data.skus):012d}"
+                price = round(rng.uniform(5, 150), 2)
+                variants.append({
+                    "sku": sku,
+                    "barcode": barcode,
+                    "size": size,
+                    "color": color,
+                    "price": price
+                })
+                inventory_docs.extend(
+                    {"sku": sku, "branchId": branch_id, "productId": product_id, "quantity": 1_000_000,
+                     "rev": 0, "updatedAt": now.isoformat()}
+                    for branch_id in data.branch_ids
+                )
+                data.skus.append(sku)
+                data.barcodes.append(barcode)
+                prices[sku] = price
+                names[sku] = (product_id, f"Product {p} ({color}, {size})")
+        product_docs.append({
+            "id": product_id,
+            "name": f"Product {p}",
+            "description": "Synthetic benchmark product",
+            "category": rng.choice(CATEGORIES),
+            "brand": f"Brand {p % 20}",
+            "variants": variants,
+            "createdAt": now.isoformat()
+        })
+    for start in range(0, len(product_docs), batch_size):
+        await db.products.insert_many(product_docs[start:start + batch_size])
+    for start in range(0, len(inventory_docs), batch_size):
+        await db.inventory.insert_many(inventory_docs[start:start + batch_size])
+
+    customer_ids = []
+    batch = []
+    for c in range(customers):
+        phone = f"+1415{c:07d}"
+        customer_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        batch.append({"id": customer_id, "phoneNumber": phone, "name": None, "loyaltyPoints": 0, "createdAt": now.isoformat()})
+        data.customer_phones.append(phone)
+        customer_ids.append(customer_id)
+        if len(batch) >= batch_size:
+            await db.customers.insert_many(batch)
+            batch = []
+    if batch:
+        await db.customers.insert_many(batch)
+
+    # Bill history spread over the last year
+    batch = []
+    for n in range(bills):
+        _, _, employee_id, branch_id = rng.choice(data.employees)
+        items = []
+        subtotal = 0
+        for sku in rng.sample(data.skus, rng.randint(1, 4)):
+            quantity = rng.randint(1, 3)
+            line_total = prices[sku] * quantity
+            subtotal += line_total
+            product_id, product_name = names[sku]
+            items.append({
+                "productId": product_id,
+                "variantSku": sku,
+                "productName": product_name,
+                "quantity": quantity,
+                "unitPrice": prices[sku],
+                "lineTotal": line_total
+            })
+        discount = round(subtotal * rng.choice([0, 0, 0, 0.05, 0.1]), 2)
+        bill_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        created_at = now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600))
+        batch.append({
+            "id": bill_id,
+            "billNumber": f"BR-{branch_id[:4]}-{n + 1:05d}",
+            "branchId": branch_id,
+            "employeeId": employee_id,
+            "customerId": rng.choice(customer_ids),
+            "items": items,
+            "subtotal": subtotal,
+            "discountAmount": discount,
+            "totalAmount": subtotal - discount,
+            "paymentMethod": rng.choice(PAYMENT_METHODS),
+            "status": "completed",
+            "createdAt": created_at.isoformat()
+        })
+        data.bill_ids.append(bill_id)
+        data.bill_skus[bill_id] = items[0]["variantSku"]
+        if len(batch) >= batch_size:
+            await db.bills.insert_many(batch)
+            batch = []
+    if batch:
+        await db.bills.insert_many(batch)
+
+    return data
@@ -0,0 +1,56 @@
+"""Stand-ins for MongoDB, Twilio and Stripe so benchmarks run fully in-process"""
+import itertools
+import os
+import types
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "clothpos_bench")
+
+
+class FakeTwilioMessages:
+    def __init__(self):
+        self.sent = 0
+
+    def create(self, body: str, from_: str, to: str):
+        self.sent += 1
+        return type("Message", (), {"sid": f"SM{self.sent:032d}"})()
+
+
+class FakeTwilioClient:
+    def __init__(self):
+        self.messages = FakeTwilioMessages()
+
+
+class FakePaymentIntent:
+    _ids = itertools.count(1)
+
+    @classmethod
+    def create(cls, amount: int, currency: str, metadata: dict):
+        intent_id = f"pi_{next(cls._ids):024d}"
+        return type("PaymentIntent", (), {"id": intent_id, "client_secret": f"{intent_id}_secret"})()
+
+
+def install(server, storage_backend: str = "memory") -> None:
+    """Point the server module at in-process storage and fake providers.
+
+    ``memory`` uses the indexed engine from storage.py; ``mongomock`` uses
+    mongomock-motor, which is slower but independently implements MongoDB semantics.
+    The memory client gets the listeners production clients get, so slow
+    request logs and /metrics count its operations; mongomock emits no
+    monitoring events.
+    """
+    if storage_backend == "mongomock":
+        from mongomock_motor import AsyncMongoMockClient
+        client = AsyncMongoMockClient()
+    else:
+        client = server.storage.create_client(
+            storage_backend,
+            event_listeners=[server.metrics.CommandListener(), server.metrics.PoolListener("transactional")]
+        )
+    # Every component reads the database through server.db, which follows the registry
+    server.provider_registry.override("database", client)
+    server.provider_registry.override("analytics_database", client)
+    server.cache_bus.mode = "local"  # one process owns the in-process database
+    server.provider_registry.override("twilio", FakeTwilioClient())
+    server.twilio_phone_number = "+15005550006"
+    server.provider_registry.override("stripe", types.SimpleNamespace(PaymentIntent=FakePaymentIntent))
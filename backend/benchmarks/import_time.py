@@ -0,0 +1,125 @@
+"""Measure how long a fresh worker takes to import the API.
+
+Each run imports ``server`` in a new interpreter with ``-X importtime`` and
+reports the median wall time, the slowest modules it imports directly, and any
+provider SDK that was imported eagerly although it should wait for first use.
+
+Examples (from the backend directory):
+
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --runs 10 --update-baseline
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+BASELINE_FILE = Path(__file__).parent / "import_baseline.json"
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Modules the server must not import until a request or the lifespan needs them
+DEFERRED_MODULES = ("stripe", "twilio", "phonenumbers", "pyarrow", "passlib", "jose", "motor")
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import server
+elapsed = time.perf_counter() - started
+print(json.dumps({{"import_ms": elapsed * 1000, "eager": [m for m in {deferred!r} if m in sys.modules]}}))
+"""
+
+
+def parse_importtime(stderr: str, root: str = "server") -> dict:
+    """Cumulative milliseconds of each module `root` imports directly, from `-X importtime` output"""
+    modules = {}
+    children = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, field = line[len("import time:"):].split("|")
+        # Nested imports are indented two spaces per level and listed before their importer
+        depth = (len(field) - len(field.lstrip()) - 1) // 2
+        name = field.strip()
+        if depth == 1:
+            children[name] = int(cumulative) / 1000
+        elif depth == 0:
+            if name == root:
+                modules = children
+            children = {}
+    return modules
+
+
+def run_once(storage: str) -> dict:
+    env = dict(os.environ, STORAGE_BACKEND=storage, PYTHONDONTWRITEBYTECODE="1")
+    env.setdefault("DB_NAME", "clothpos_bench")
+    env.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE.format(deferred=DEFERRED_MODULES)],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result["modules"] = parse_importtime(completed.stderr)
+    return result
+
+
+def main(args) -> int:
+    runs = [run_once(args.storage) for _ in range(args.runs)]
+    import_ms = round(statistics.median(run["import_ms"] for run in runs), 1)
+    samples = defaultdict(list)
+    for run in runs:
+        for name, ms in run["modules"].items():
+            samples[name].append(ms)
+    modules = {name: round(statistics.median(values), 1) for name, values in samples.items()}
+    slowest = sorted(modules.items(), key=lambda item: -item[1])[:args.top]
+    eager = sorted({name for run in runs for name in run["eager"]})
+
+    print(f"import server: {import_ms} ms (median of {args.runs}, {args.storage} storage)\n")
+    print(f"{'module':<32}{'cumulative ms':>14}")
+    for name, ms in slowest:
+        print(f"{name:<32}{ms:>14}")
+
+    report = {"config": {"runs": args.runs, "storage": args.storage}, "import_ms": import_ms, "modules": dict(slowest)}
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+    failed = False
+    if eager:
+        print(f"\nImported eagerly, expected on first use: {', '.join(eager)}")
+        failed = True
+
+    baseline_path = Path(args.baseline)
+    if args.update_baseline:
+        baseline_path.write_text(json.dumps(report, indent=2) + "\n")
+        print(f"\nBaseline written to {baseline_path}")
+        return 1 if failed else 0
+
+    if baseline_path.exists():
+        baseline = json.loads(baseline_path.read_text())
+        if baseline.get("config", {}).get("storage") != args.storage:
+            print(f"\nBaseline was recorded on {baseline.get('config', {}).get('storage')} storage, skipping comparison")
+        elif import_ms > baseline["import_ms"] * (1 + args.tolerance):
+            print(f"\nRegression: import {import_ms}ms > baseline {baseline['import_ms']}ms")
+            failed = True
+        else:
+            print("\nNo regressions against baseline")
+    return 1 if failed else 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="ClothPOS API import-time benchmark")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to time")
+    parser.add_argument("--top", type=int, default=15, help="slowest direct imports to list")
+    parser.add_argument("--storage", choices=["memory", "mongo"], default="mongo")
+    parser.add_argument("--baseline", default=str(BASELINE_FILE))
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed fractional regression")
+    parser.add_argument("--output", help="write the JSON report to this path")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))
@@ -0,0 +1,108 @@
+"""Throughput and accuracy benchmark of the stock reconciliation job.
+
+Generates a catalog and bill history, checkpoints every (sku, branch) at a
+known quantity from before the first bill, and lets a repairing run bring
+inventory in line with the history. It then moves some levels off by hand,
+puts the checkpoints back and replays again in report mode. The second run
+is timed and must find exactly the levels that were moved.
+
+``--storage mongo`` runs against the server in MONGO_URL (database DB_NAME,
+default clothpos_bench, which is dropped first) with the SKU ranges replayed
+in ``--processes`` worker processes; the in-process backends replay in this
+process.
+
+Examples (from the backend directory):
+
+    python -m benchmarks.reconcile
+    python -m benchmarks.reconcile --bills 200000 --products 2000 --drifts 50
+    python -m benchmarks.reconcile --storage mongo --bills 1000000 --processes 8
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+from benchmarks import fakes
+
+CHECKPOINT_QUANTITY = 1000000
+BEFORE_HISTORY = "2000-01-01T00:00:00+00:00"
+
+
+async def reset_checkpoints(db) -> None:
+    await db.stock_checkpoints.update_many({}, {"$set": {"quantity": CHECKPOINT_QUANTITY, "asOf": BEFORE_HISTORY}})
+
+
+async def main(args) -> int:
+    import server
+    import reconciliation
+    from benchmarks import datagen
+
+    if args.storage == "mongo":
+        for name in ("branches", "employees", "products", "inventory", "customers", "bills",
+                     "stock_checkpoints", "stock_movements", "stock_transfers"):
+            await server.db[name].drop()
+    else:
+        fakes.install(server, args.storage)
+    started = time.perf_counter()
+    data = await datagen.generate(
+        server.db, server.hash_password, branches=args.branches, products=args.products, customers=1000,
+        bills=args.bills, seed=args.seed
+    )
+    print(f"Generated {args.bills} bills, {len(data.skus)} SKUs x {args.branches} branches "
+          f"in {time.perf_counter() - started:.1f}s\n")
+
+    reconciler = reconciliation.Reconciler(
+        server.db,
+        server.bill_archive,
+        server.movement_ledger,
+        processes=args.processes if args.storage == "mongo" else 0,
+        shards=args.shards,
+        settle_seconds=0,
+        mongo_url=os.environ.get("MONGO_URL"),
+        db_name=os.environ["DB_NAME"],
+    )
+    await server.ensure_indexes()
+    # Baseline every pair, then pretend the history started from a known level
+    await reconciler.run(repair=False)
+    await reset_checkpoints(server.db)
+    aligned = await reconciler.run(repair=True)
+
+    drifted = random.Random(args.seed).sample(
+        [(sku, branch_id) for sku in data.skus for branch_id in data.branch_ids], args.drifts
+    )
+    for sku, branch_id in drifted:
+        await server.db.inventory.update_one({"sku": sku, "branchId": branch_id}, {"$inc": {"quantity": -1}})
+    await reset_checkpoints(server.db)
+    report = await reconciler.run(repair=False)
+
+    found = {(row["sku"], row["branchId"]) for row in report["mismatches"]}
+    print(f"{'run':<10}{'records':>12}{'seconds':>10}{'records/s':>12}  pairs")
+    for name, run in (("repair", aligned), ("report", report)):
+        print(f"{name:<10}{sum(run['records'].values()):>12}{run['seconds']:>10}{run['recordsPerSecond']:>12}  {run['pairs']}")
+    print(f"\n{report['shards']} shards, {report['processes']} worker processes, {args.storage} storage")
+
+    expected = min(args.drifts, reconciliation.REPORTED_MISMATCHES)
+    if report["pairs"]["mismatch"] != args.drifts or len(found & set(drifted)) != expected:
+        print(f"Detected {report['pairs']['mismatch']} mismatches for {args.drifts} drifted levels")
+        return 1
+    print(f"Detected {args.drifts}/{args.drifts} drifted levels")
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="ClothPOS stock reconciliation benchmark")
+    parser.add_argument("--bills", type=int, default=50000)
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--branches", type=int, default=5)
+    parser.add_argument("--drifts", type=int, default=20, help="inventory levels moved off their history")
+    parser.add_argument("--shards", type=int, default=0, help="SKU ranges; 0 for four per worker process, or one without workers")
+    parser.add_argument("--processes", type=int, default=4, help="worker processes with --storage mongo")
+    parser.add_argument("--storage", choices=["memory", "mongomock", "mongo"], default="memory")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
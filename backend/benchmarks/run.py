@@ -0,0 +1,291 @@
+"""Drive the FastAPI app in-process and report per-endpoint throughput and latency.
+
+Examples (from the backend directory):
+
+    python -m benchmarks.run --bills 10000
+    python -m benchmarks.run --bills 1000 --update-baseline
+    python -m benchmarks.run --scenarios checkout,barcode_scan,scan --requests 500
+    python -m benchmarks.run --scenarios checkout --background sales_report:8 --db-latency-ms 1
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from benchmarks import fakes
+
+BASELINE_FILE = Path(__file__).parent / "baseline.json"
+
+
+def percentile(samples, pct: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+# Scenarios return (method, url, json_body, role) for one request
+def checkout(data, rng):
+    items = [{"sku": sku, "quantity": rng.randint(1, 2)} for sku in rng.sample(data.skus, rng.randint(1, 4))]
+    body = {"customerPhoneNumber": rng.choice(data.customer_phones), "items": items, "discount": 0, "paymentMethod": "card"}
+    return "POST", "/api/billing", body, "cashier"
+
+
+def barcode_scan(data, rng):
+    return "GET", f"/api/products/search/barcode/{rng.choice(data.barcodes)}", None, "cashier"
+
+
+def scan(data, rng):
+    return "GET", f"/api/products/scan/{rng.choice(data.barcodes)}", None, "cashier"
+
+
+def product_list(data, rng):
+    return "GET", "/api/products", None, "cashier"
+
+
+def product_summary(data, rng):
+    return "GET", "/api/products?view=summary", None, "cashier"
+
+
+def bill_list(data, rng):
+    return "GET", "/api/billing", None, "admin"
+
+
+def bill_list_summary(data, rng):
+    return "GET", "/api/billing?view=summary", None, "admin"
+
+
+def sales_report(data, rng):
+    return "GET", "/api/reports/sales", None, "admin"
+
+
+def dashboard_stats(data, rng):
+    return "GET", "/api/dashboard/stats", None, "admin"
+
+
+def bill_lookup(data, rng):
+    return "GET", f"/api/billing/{rng.choice(data.bill_ids)}", None, "cashier"
+
+
+def customer_search(data, rng):
+    return "GET", f"/api/customers/search/{rng.choice(data.customer_phones)}", None, "cashier"
+
+
+def bill_return(data, rng):
+    # Bills are drawn without replacement so each return is valid against its original
+    bill_id, sku = data.bill_skus.popitem()
+    return "POST", "/api/billing/return", {"originalBillId": bill_id, "items": [{"sku": sku, "quantity": 1}]}, "cashier"
+
+
+def payment_intent(data, rng):
+    return "POST", "/api/payments/create-intent", {"amount": round(rng.uniform(5, 500), 2)}, "cashier"
+
+
+SCENARIOS = {
+    "checkout": checkout,
+    "barcode_scan": barcode_scan,
+    "scan": scan,
+    "product_list": product_list,
+    "product_summary": product_summary,
+    "bill_list": bill_list,
+    "bill_list_summary": bill_list_summary,
+    "sales_report": sales_report,
+    "dashboard_stats": dashboard_stats,
+    "bill_lookup": bill_lookup,
+    "customer_search": customer_search,
+    "payment_intent": payment_intent,
+    "bill_return": bill_return,
+}
+
+
+async def login(client, username: str, password: str) -> dict:
+    response = await client.post("/api/auth/login", json={"username": username, "password": password})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def run_scenario(client, name, data, headers, requests: int, concurrency: int, seed: int) -> dict:
+    rng = random.Random(f"{seed}-{name}")
+    planned = [SCENARIOS[name](data, rng) for _ in range(requests)]
+    latencies = []
+    errors = 0
+    position = 0
+    received = 0
+
+    async def worker():
+        nonlocal position, errors, received
+        while position < len(planned):
+            method, url, body, role = planned[position]
+            position += 1
+            started = time.perf_counter()
+            response = await client.request(method, url, json=body, headers=headers[role])
+            latencies.append((time.perf_counter() - started) * 1000)
+            received += len(response.content)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(requests / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "mean_ms": round(statistics.fmean(latencies), 3) if latencies else 0.0,
+        "mean_kb": round(received / requests / 1024, 1),
+    }
+
+
+async def run_background(client, name, data, headers, concurrency: int, seed: int, stop: asyncio.Event) -> dict:
+    """Keep `concurrency` requests of a scenario in flight until `stop` is set"""
+    rng = random.Random(f"{seed}-background-{name}")
+    statuses = {}
+
+    async def worker():
+        while not stop.is_set():
+            method, url, body, role = SCENARIOS[name](data, rng)
+            response = await client.request(method, url, json=body, headers=headers[role])
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            if response.status_code == 503:
+                # Back off briefly rather than re-queueing at once
+                await asyncio.sleep(min(float(response.headers.get("Retry-After", 1)), 0.05))
+            else:
+                # In-process storage may never suspend; let the measured requests run
+                await asyncio.sleep(0)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return {"requests": sum(statuses.values()), "shed": statuses.get(503, 0),
+            "errors": sum(count for status, count in statuses.items() if status >= 400 and status != 503)}
+
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float) -> list:
+    """Return human-readable regressions against the baseline file"""
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get("scenarios", {}).get(name)
+        if not reference:
+            continue
+        if result["p95_ms"] > reference["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {result['p95_ms']}ms > baseline {reference['p95_ms']}ms")
+        if result["throughput_rps"] < reference["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {result['throughput_rps']}/s < baseline {reference['throughput_rps']}/s")
+        if result["errors"] > reference.get("errors", 0):
+            regressions.append(f"{name}: {result['errors']} errors (baseline {reference.get('errors', 0)})")
+    return regressions
+
+
+async def main(args) -> int:
+    import httpx
+    import server
+    from benchmarks import datagen
+
+    if args.db_latency_ms:
+        os.environ["STORAGE_MEMORY_LATENCY_MS"] = str(args.db_latency_ms)
+    fakes.install(server, args.storage)
+
+    load_started = time.perf_counter()
+    data = await datagen.generate(
+        server.db, server.hash_password,
+        branches=args.branches, products=args.products, customers=args.customers, bills=args.bills, seed=args.seed
+    )
+    print(f"Generated {args.bills} bills, {args.products} products, {args.customers} customers "
+          f"in {time.perf_counter() - load_started:.1f}s")
+
+    async with server.app.router.lifespan_context(server.app):
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            cashier = next(e for e in data.employees if not e[0].endswith("-0"))
+            headers = {
+                "cashier": await login(client, cashier[0], cashier[1]),
+                "admin": await login(client, "admin", "admin123"),
+            }
+            names = args.scenarios.split(",") if args.scenarios else list(SCENARIOS)
+            results = {}
+            background = [(entry.split(":")[0], int(entry.split(":")[1]) if ":" in entry else 4)
+                          for entry in args.background.split(",")] if args.background else []
+            for name in names:
+                requests = max(1, args.requests // 10) if name == "sales_report" else args.requests
+                await run_scenario(client, name, data, headers, min(args.warmup, requests), args.concurrency, args.seed + 1)
+                stop = asyncio.Event()
+                load = [asyncio.create_task(run_background(client, other, data, headers, concurrency, args.seed, stop))
+                        for other, concurrency in background]
+                results[name] = await run_scenario(client, name, data, headers, requests, args.concurrency, args.seed)
+                stop.set()
+                if load:
+                    results[name]["background"] = dict(zip((other for other, _ in background), await asyncio.gather(*load)))
+
+    print(f"\n{'scenario':<18}{'req':>7}{'err':>6}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'kb':>9}")
+    for name, r in results.items():
+        print(f"{name:<18}{r['requests']:>7}{r['errors']:>6}{r['throughput_rps']:>10}"
+              f"{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}{r['mean_kb']:>9}")
+        for other, load in r.get("background", {}).items():
+            print(f"  + {other}: {load['requests']} requests, {load['shed']} shed (503), {load['errors']} errors")
+
+    report = {
+        "config": {"bills": args.bills, "products": args.products, "customers": args.customers,
+                   "branches": args.branches, "concurrency": args.concurrency, "storage": args.storage,
+                   "background": args.background, "db_latency_ms": args.db_latency_ms},
+        "scenarios": results,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+    baseline_path = Path(args.baseline)
+    if args.update_baseline:
+        baseline_path.write_text(json.dumps(report, indent=2) + "\n")
+        print(f"\nBaseline written to {baseline_path}")
+        return 0
+
+    if baseline_path.exists():
+        baseline = json.loads(baseline_path.read_text())
+        recorded = baseline.get("config", {})
+        if (recorded.get("background"), recorded.get("db_latency_ms", 0)) != (args.background, args.db_latency_ms):
+            print("\nBaseline was recorded with different background load or latency, skipping comparison")
+            return 0
+        if (recorded.get("bills"), recorded.get("storage", "mongomock")) != (args.bills, args.storage):
+            print(f"\nBaseline was recorded with {recorded.get('bills')} bills on {recorded.get('storage', 'mongomock')} "
+                  f"storage, skipping comparison")
+            return 0
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\nNo regressions against baseline")
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="ClothPOS API benchmarks")
+    parser.add_argument("--bills", type=int, default=1000, help="bill history size (1k to 1M)")
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--customers", type=int, default=5000)
+    parser.add_argument("--branches", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per scenario")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--scenarios", help="comma-separated subset of: " + ", ".join(SCENARIOS))
+    parser.add_argument("--background", help="scenario:concurrency pairs kept running while each scenario is measured")
+    parser.add_argument("--db-latency-ms", type=float, default=0, help="simulated round trip per memory-storage operation")
+    parser.add_argument("--storage", choices=["memory", "mongomock"], default="memory")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--baseline", default=str(BASELINE_FILE))
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed fractional regression")
+    parser.add_argument("--output", help="write the JSON report to this path")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
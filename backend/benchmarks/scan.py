@@ -0,0 +1,96 @@
+"""Micro-benchmark of the till's barcode scan.
+
+Times the scan endpoint handler called directly (the hot path: barcode index
+lookup plus one stock read) against the full-product barcode search, then
+both again through the ASGI stack with auth and middleware. Fails when the
+handler's p99 misses the target.
+
+Examples (from the backend directory):
+
+    python -m benchmarks.scan
+    python -m benchmarks.scan --products 5000 --iterations 20000 --target-ms 0.5
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import time
+
+from benchmarks import fakes
+
+
+def summarize(samples) -> dict:
+    ordered = sorted(samples)
+    return {
+        "p50_us": round(ordered[len(ordered) // 2] * 1e6, 1),
+        "p99_us": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1e6, 1),
+        "mean_us": round(statistics.fmean(ordered) * 1e6, 1),
+    }
+
+
+async def time_calls(call, codes, iterations: int) -> dict:
+    samples = []
+    for i in range(iterations):
+        code = codes[i % len(codes)]
+        started = time.perf_counter()
+        await call(code)
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+
+async def main(args) -> int:
+    import httpx
+    import server
+    from benchmarks import datagen
+
+    fakes.install(server, args.storage)
+    data = await datagen.generate(
+        server.db, server.hash_password, branches=args.branches, products=args.products, customers=100, bills=0, seed=args.seed
+    )
+    codes = list(data.barcodes)
+    random.Random(args.seed).shuffle(codes)
+
+    async with server.app.router.lifespan_context(server.app):
+        cashier = next(e for e in data.employees if not e[0].endswith("-0"))
+        user = await server.db.employees.find_one({"username": cashier[0]}, {"_id": 0})
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://bench") as client:
+            response = await client.post("/api/auth/login", json={"username": cashier[0], "password": cashier[1]})
+            headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+            # The first scan builds the index
+            await server.scan_barcode(codes[0], user, None)
+
+            results = {
+                "scan handler": await time_calls(lambda code: server.scan_barcode(code, user, None), codes, args.iterations),
+                "search handler": await time_calls(lambda code: server.search_by_barcode(code, user, None), codes, args.iterations),
+                "scan http": await time_calls(
+                    lambda code: client.get(f"/api/products/scan/{code}", headers=headers), codes, args.iterations // 10),
+                "search http": await time_calls(
+                    lambda code: client.get(f"/api/products/search/barcode/{code}", headers=headers), codes, args.iterations // 10),
+            }
+
+    print(f"{len(codes)} barcodes, {args.branches} branches, {args.storage} storage\n")
+    print(f"{'path':<16}{'p50 us':>10}{'p99 us':>10}{'mean us':>10}")
+    for name, result in results.items():
+        print(f"{name:<16}{result['p50_us']:>10}{result['p99_us']:>10}{result['mean_us']:>10}")
+
+    if results["scan handler"]["p99_us"] > args.target_ms * 1000:
+        print(f"\nScan handler p99 {results['scan handler']['p99_us']}us misses the {args.target_ms}ms target")
+        return 1
+    print(f"\nScan handler p99 within the {args.target_ms}ms target")
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="ClothPOS barcode scan micro-benchmark")
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--branches", type=int, default=5)
+    parser.add_argument("--iterations", type=int, default=5000, help="handler calls per path; HTTP paths run a tenth")
+    parser.add_argument("--target-ms", type=float, default=1.0, help="largest acceptable scan handler p99")
+    parser.add_argument("--storage", choices=["memory", "mongomock"], default="memory")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
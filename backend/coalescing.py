@@ -0,0 +1,62 @@
+"""Single-flight coalescing of identical concurrent reads.
+
+When many terminals ask for the same thing at once (the catalog when the
+store opens, the dashboard after a sale), the first request runs the
+computation and the others arriving while it is still running await the
+same result instead of issuing their own scans. The entry is dropped the
+moment the computation finishes, so nothing is served from it afterwards;
+this is not a cache.
+
+Keys must capture everything the result depends on (route, normalized
+parameters, caller scope, and a version stamp where one exists).
+The computation runs in its own task: a leader whose client disconnects
+does not cancel it for the followers. A profiled caller adopts the task,
+so its samples land in the caller's profile.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+import metrics
+import profiling
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: Dict[Tuple[str, Hashable], asyncio.Future] = {}
+
+    async def run(self, route: str, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """Result of `compute`, shared with every concurrent caller passing the same route and key"""
+        call_key = (route, key)
+        task = self._calls.get(call_key)
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            self._calls[call_key] = task
+            task.add_done_callback(lambda done: self._finish(call_key, done))
+            coalesced_requests.inc(route, "leader")
+        else:
+            coalesced_requests.inc(route, "follower")
+        profiling.profiler.adopt(task)
+        return await asyncio.shield(task)
+
+    def _finish(self, call_key, task: asyncio.Future) -> None:
+        if self._calls.get(call_key) is task:
+            del self._calls[call_key]
+        # Mark the error as seen even when every caller went away first
+        if not task.cancelled():
+            task.exception()
+
+    def in_flight(self) -> Dict[tuple, int]:
+        counts: Dict[tuple, int] = {}
+        for route, _ in self._calls:
+            counts[(route,)] = counts.get((route,), 0) + 1
+        return counts
+
+
+flights = SingleFlight()
+
+coalesced_requests = metrics.register(metrics.Counter(
+    "coalesced_requests_total", "Coalesced reads that ran the computation (leader) or joined one (follower)",
+    ("route", "role")))
+in_flight_reads = metrics.register(metrics.Gauge(
+    "coalesced_reads_in_flight", "Distinct coalesced computations currently running", ("route",),
+    lambda: flights.in_flight()))
@@ -0,0 +1,320 @@
+"""Append-only Parquet export of bills and bill line items for analytics.
+
+Each run exports bills created after the stored watermark and at least
+``settle_seconds`` ago (so bills still being written are not skipped),
+then advances the watermark. Files are laid out as Hive partitions::
+
+    <root>/bills/date=YYYY-MM-DD/branch=<branchId>/part-<run>.parquet
+    <root>/bill_items/date=YYYY-MM-DD/branch=<branchId>/part-<run>.parquet
+
+Return bills are exported as rows with negative quantity and revenue, so
+summing any column yields net figures without rewriting earlier files.
+Queries run on the files with pyarrow compute and never touch MongoDB.
+
+pyarrow is imported on the first export or query rather than with the
+module, so workers that never touch analytics do not load it.
+"""
+import asyncio
+import functools
+import logging
+import os
+import shutil
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+import archive
+
+if TYPE_CHECKING:
+    import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 5000
+SETTLE_SECONDS = 60
+
+GROUP_KEYS = {"category": ["category"], "product": ["productId", "product"], "sku": ["sku", "productName"]}
+
+
+@functools.lru_cache(maxsize=None)
+def _arrow() -> SimpleNamespace:
+    """pyarrow modules and the export layouts, loaded on first use"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    bill_schema = pa.schema([
+        ("billId", pa.string()),
+        ("billNumber", pa.string()),
+        ("createdAt", pa.timestamp("us", tz="UTC")),
+        ("employeeId", pa.string()),
+        ("customerId", pa.string()),
+        ("paymentMethod", pa.string()),
+        ("isReturn", pa.bool_()),
+        ("itemCount", pa.int64()),
+        ("subtotal", pa.float64()),
+        ("discount", pa.float64()),
+        ("total", pa.float64()),
+    ])
+    item_schema = pa.schema([
+        ("billId", pa.string()),
+        ("createdAt", pa.timestamp("us", tz="UTC")),
+        ("employeeId", pa.string()),
+        ("productId", pa.string()),
+        ("sku", pa.string()),
+        ("product", pa.string()),
+        ("productName", pa.string()),
+        ("category", pa.string()),
+        ("quantity", pa.int64()),
+        ("unitPrice", pa.float64()),
+        ("revenue", pa.float64()),
+    ])
+    partitioning = ds.partitioning(pa.schema([("date", pa.string()), ("branch", pa.string())]), flavor="hive")
+    return SimpleNamespace(pa=pa, pc=pc, ds=ds, pq=pq, bill_schema=bill_schema, item_schema=item_schema, partitioning=partitioning)
+
+
+class ColumnarExport:
+    def __init__(self, db, bill_archive, root: Path, interval_minutes: float = 0, settle_seconds: int = SETTLE_SECONDS):
+        self.db = db
+        self.bill_archive = bill_archive
+        self.root = Path(root)
+        self.interval_minutes = interval_minutes
+        self.settle_seconds = settle_seconds
+        self.last_run: Optional[dict] = None
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    # Export
+
+    async def run(self, batch_size: int = BATCH_SIZE) -> dict:
+        async with self._lock:
+            started = datetime.now(timezone.utc)
+            until = (started - timedelta(seconds=self.settle_seconds)).isoformat()
+            state = await self.db.export_state.find_one({"id": "bills"}, {"_id": 0}) or {}
+            # Files from a run that never committed its watermark would duplicate rows
+            for path in state.get("pendingFiles", []):
+                Path(path).unlink(missing_ok=True)
+            watermark = state.get("watermark", "")
+            exported = 0
+            batch = 0
+            while True:
+                bills = await self._fetch(watermark, until, batch_size)
+                if not bills:
+                    break
+                if len(bills) == batch_size and bills[0]["createdAt"] != bills[-1]["createdAt"]:
+                    # Leave bills sharing the last timestamp for the next batch so none are skipped
+                    bills = [bill for bill in bills if bill["createdAt"] != bills[-1]["createdAt"]]
+                files = await self._write(bills, f"part-{started.strftime('%Y%m%dT%H%M%S%f')}-{batch:04d}.parquet")
+                batch += 1
+                watermark = bills[-1]["createdAt"]
+                await self.db.export_state.update_one(
+                    {"id": "bills"},
+                    {"$set": {"watermark": watermark, "updatedAt": datetime.now(timezone.utc).isoformat()},
+                     "$unset": {"pendingFiles": ""}},
+                    upsert=True
+                )
+                exported += len(bills)
+                logger.debug("Exported %d bills into %d files", len(bills), len(files))
+            self.last_run = {
+                "startedAt": started.isoformat(),
+                "watermark": watermark,
+                "exported": exported,
+                "seconds": (datetime.now(timezone.utc) - started).total_seconds()
+            }
+        return self.last_run
+
+    async def _fetch(self, after: str, until: str, limit: int) -> List[dict]:
+        """Oldest bills in (after, until] across the hot collection and archived months"""
+        query = {"createdAt": {"$gt": after, "$lte": until}}
+        bills = await self.db.bills.find(query, {"_id": 0}).sort("createdAt", 1).limit(limit).to_list(None)
+        for month in await self.bill_archive.months():
+            if month < after[:7]:
+                continue
+            bills += await self.db[archive.collection_name(month)].find(query, {"_id": 0}).sort("createdAt", 1).limit(limit).to_list(None)
+        # An archive run copies a bill before deleting its hot copy; export it once
+        bills = sorted({bill["id"]: bill for bill in bills}.values(), key=lambda bill: (bill["createdAt"], bill["id"]))
+        return bills[:limit]
+
+    async def _write(self, bills: List[dict], part: str) -> List[str]:
+        # Older return bills carry only the SKU, so products are matched by either key
+        product_ids = {item["productId"] for bill in bills for item in bill["items"] if item.get("productId")}
+        orphan_skus = {item["variantSku"] for bill in bills for item in bill["items"] if not item.get("productId")}
+        products = await self.db.products.find(
+            {"$or": [{"id": {"$in": list(product_ids)}}, {"variants.sku": {"$in": list(orphan_skus)}}]},
+            {"_id": 0, "id": 1, "name": 1, "category": 1, "variants.sku": 1}
+        ).to_list(None)
+        catalog = {product["id"]: product for product in products}
+        sku_products = {variant["sku"]: product["id"] for product in products for variant in product["variants"]}
+        bill_rows: Dict[Tuple[str, str], List[dict]] = {}
+        item_rows: Dict[Tuple[str, str], List[dict]] = {}
+        for bill in bills:
+            created_at = datetime.fromisoformat(bill["createdAt"])
+            partition = (bill["createdAt"][:10], bill["branchId"])
+            is_return = bool(bill.get("relatedBillId"))
+            sign = -1 if is_return else 1
+            bill_rows.setdefault(partition, []).append({
+                "billId": bill["id"],
+                "billNumber": bill["billNumber"],
+                "createdAt": created_at,
+                "employeeId": bill["employeeId"],
+                "customerId": bill["customerId"],
+                "paymentMethod": bill["paymentMethod"],
+                "isReturn": is_return,
+                "itemCount": len(bill["items"]),
+                "subtotal": bill["subtotal"],
+                "discount": bill["discountAmount"],
+                "total": bill["totalAmount"],
+            })
+            for item in bill["items"]:
+                product_id = item.get("productId") or sku_products.get(item["variantSku"])
+                product = catalog.get(product_id, {})
+                item_rows.setdefault(partition, []).append({
+                    "billId": bill["id"],
+                    "createdAt": created_at,
+                    "employeeId": bill["employeeId"],
+                    "productId": product_id,
+                    "sku": item["variantSku"],
+                    "product": product.get("name") or item["productName"].split(" (")[0],
+                    "productName": item["productName"],
+                    "category": item.get("category") or product.get("category"),
+                    "quantity": sign * item["quantity"],
+                    "unitPrice": item["unitPrice"],
+                    "revenue": sign * item["lineTotal"],
+                })
+
+        arrow = _arrow()
+        targets = []
+        for table_name, rows_by_partition, schema in (("bills", bill_rows, arrow.bill_schema), ("bill_items", item_rows, arrow.item_schema)):
+            for (day, branch_id), rows in rows_by_partition.items():
+                path = self.root / table_name / f"date={day}" / f"branch={branch_id}" / part
+                targets.append((path, arrow.pa.Table.from_pylist(rows, schema=schema)))
+        files = [str(path) for path, _ in targets]
+        await self.db.export_state.update_one({"id": "bills"}, {"$set": {"pendingFiles": files}}, upsert=True)
+        await asyncio.to_thread(_write_tables, targets)
+        return files
+
+    def start(self) -> None:
+        if self.interval_minutes > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run_periodically(), name="columnar-export")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval_minutes * 60)
+            try:
+                await self.run()
+            except Exception:
+                logger.exception("Columnar export failed")
+
+    async def reset(self) -> None:
+        """Delete the exported files and watermark so the next run re-exports everything"""
+        async with self._lock:
+            await asyncio.to_thread(shutil.rmtree, self.root, True)
+            await self.db.export_state.delete_one({"id": "bills"})
+
+    # Queries
+
+    async def sales_by(
+        self,
+        group_by: str,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        branch_id: Optional[str] = None,
+        top: Optional[int] = None
+    ) -> List[dict]:
+        """Net quantity and revenue per category, product or SKU, highest revenue first"""
+        return await asyncio.to_thread(self._sales_by, GROUP_KEYS[group_by], start_date, end_date, branch_id, top)
+
+    def _sales_by(self, keys: List[str], start_date, end_date, branch_id, top) -> List[dict]:
+        table = self._scan("bill_items", keys + ["quantity", "revenue", "billId"], start_date, end_date, branch_id)
+        if table.num_rows == 0:
+            return []
+        grouped = table.group_by(keys).aggregate([
+            ("quantity", "sum"), ("revenue", "sum"), ("billId", "count_distinct")
+        ]).rename_columns(keys + ["quantity", "revenue", "bills"])
+        grouped = grouped.sort_by([("revenue", "descending")])
+        if top:
+            grouped = grouped.slice(0, top)
+        return grouped.to_pylist()
+
+    async def totals(self, start_date=None, end_date=None, branch_id=None) -> dict:
+        return await asyncio.to_thread(self._totals, start_date, end_date, branch_id)
+
+    def _totals(self, start_date, end_date, branch_id) -> dict:
+        pc = _arrow().pc
+        table = self._scan("bills", ["total", "discount", "isReturn"], start_date, end_date, branch_id)
+        sales = table.filter(pc.invert(table["isReturn"]))
+        return {
+            "bills": sales.num_rows,
+            "returns": table.num_rows - sales.num_rows,
+            "netRevenue": pc.sum(table["total"]).as_py() or 0,
+            "totalDiscount": pc.sum(table["discount"]).as_py() or 0,
+        }
+
+    def _scan(self, table_name: str, columns: List[str], start_date, end_date, branch_id) -> "pa.Table":
+        arrow = _arrow()
+        ds = arrow.ds
+        path = self.root / table_name
+        schema = arrow.bill_schema if table_name == "bills" else arrow.item_schema
+        # Before the first export there is nothing to scan; the columns still need their types
+        if not path.exists():
+            return schema.empty_table().select(columns)
+        dataset = ds.dataset(
+            path, format="parquet", partitioning=arrow.partitioning,
+            schema=arrow.pa.unify_schemas([schema, arrow.partitioning.schema])
+        )
+        # Partition keys prune whole directories; createdAt trims the boundary days
+        condition = None
+        for expression in (
+            ds.field("date") >= start_date[:10] if start_date else None,
+            ds.field("date") <= end_date[:10] if end_date else None,
+            ds.field("branch") == branch_id if branch_id else None,
+            ds.field("createdAt") >= _timestamp(start_date) if start_date else None,
+            ds.field("createdAt") <= _timestamp(end_date) if end_date else None,
+        ):
+            if expression is not None:
+                condition = expression if condition is None else condition & expression
+        return dataset.to_table(columns=columns, filter=condition)
+
+    async def watermark(self) -> Optional[str]:
+        """createdAt of the newest exported bill"""
+        state = await self.db.export_state.find_one({"id": "bills"}, {"_id": 0, "watermark": 1})
+        return state.get("watermark") if state else None
+
+    async def status(self) -> dict:
+        files = await asyncio.to_thread(lambda: list(self.root.rglob("*.parquet")) if self.root.exists() else [])
+        return {
+            "root": str(self.root),
+            "files": len(files),
+            "bytes": sum(os.path.getsize(path) for path in files),
+            "watermark": await self.watermark(),
+            "intervalMinutes": self.interval_minutes,
+            "lastRun": self.last_run,
+        }
+
+
+def _timestamp(value: str) -> "pa.Scalar":
+    pa = _arrow().pa
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return pa.scalar(moment, type=pa.timestamp("us", tz="UTC"))
+
+
+def _write_tables(targets: List[Tuple[Path, "pa.Table"]]) -> None:
+    pq = _arrow().pq
+    for path, table in targets:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_suffix(".tmp")
+        pq.write_table(table, temporary, compression="zstd")
+        os.replace(temporary, path)
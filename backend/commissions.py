@@ -0,0 +1,239 @@
+"""Background commission accrual.
+
+Checkout and returns only enqueue the bill they wrote; a worker task drains
+the queue in batches and, per batch:
+
+1. upserts one commission row per bill (keyed by ``billId``, so replays
+   never duplicate a row), inserted with ``balanced: False``,
+2. claims the rows not yet ``balanced`` or claimed by stamping them with a
+   new ``batchId``, so concurrent batches and replays never share a row,
+3. applies the claimed rows to per-employee running balances in
+   ``commission_balances``; each balance records the batch ids it took, so
+   applying a batch again changes nothing,
+4. flags the claimed rows ``balanced`` and marks the bills ``commissionAccrued``.
+
+Every bill stores what accrual needs (``commissionRate`` and, for returns,
+``commissionEmployeeId``), so a crash between steps is recovered on startup:
+batches claimed but never flagged are applied again (a no-op where step 3
+finished), then unaccrued bills are replayed. Replay leaves recent bills
+alone, since with several workers they may still be queued in a live one.
+Amounts are rounded to cents so that a sale and its full return cancel out.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from pymongo import UpdateOne
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 200
+FLUSH_INTERVAL = 0.05
+REPLAY_SETTLE_SECONDS = 60
+# Batch ids kept per balance; an interrupted batch is finished on the next startup, long before it ages out
+APPLIED_BATCHES = 500
+
+
+def cents(amount: float) -> float:
+    return round(amount, 2)
+
+
+def commission_for(bill: dict) -> dict:
+    """Commission row owed for a sale or return bill"""
+    rate = bill["commissionRate"]
+    return {
+        "id": str(uuid.uuid4()),
+        "employeeId": bill.get("commissionEmployeeId") or bill["employeeId"],
+        "branchId": bill["branchId"],
+        "billId": bill["id"],
+        "saleAmount": cents(bill["totalAmount"]),
+        "commissionRate": rate,
+        "commissionAmount": cents(bill["totalAmount"] * rate),
+        "status": "pending",
+        "balanced": False,
+        "createdAt": bill["createdAt"]
+    }
+
+
+class CommissionPipeline:
+    def __init__(self, db, batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+
+    def submit(self, bill: dict) -> None:
+        """Queue a stored bill (saved with ``commissionAccrued: False``) for accrual"""
+        self.queue.put_nowait(bill)
+
+    def start(self) -> None:
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run(), name="commission-pipeline")
+
+    async def stop(self) -> None:
+        """Stop the worker after accruing everything already queued"""
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        await self._drain()
+
+    async def flush(self) -> None:
+        """Wait until every queued bill has been accrued"""
+        await self.queue.join()
+
+    async def _run(self) -> None:
+        while True:
+            batch = [await self.queue.get()]
+            # Give concurrent checkouts a moment to join the batch
+            await asyncio.sleep(self.flush_interval)
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                await self.accrue(batch)
+            except Exception:
+                logger.exception("Commission accrual failed for %d bills; they will be replayed on restart", len(batch))
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _drain(self) -> None:
+        while not self.queue.empty():
+            batch = []
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                await self.accrue(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def accrue(self, bills: List[dict]) -> int:
+        """Accrue commissions for a batch of bills; returns the number of new rows"""
+        if not bills:
+            return 0
+        rows = [commission_for(bill) for bill in bills]
+        result = await self.db.commissions.bulk_write([
+            UpdateOne({"billId": row["billId"]}, {"$setOnInsert": row}, upsert=True) for row in rows
+        ], ordered=False)
+
+        # Claim the rows not yet in the balances; a row only ever joins one batch
+        batch_id = str(uuid.uuid4())
+        await self.db.commissions.update_many(
+            {"billId": {"$in": [row["billId"] for row in rows]}, "balanced": False, "batchId": None},
+            {"$set": {"batchId": batch_id}}
+        )
+        await self._apply(batch_id)
+
+        await self.db.bills.update_many(
+            {"id": {"$in": [bill["id"] for bill in bills]}},
+            {"$set": {"commissionAccrued": True}}
+        )
+        accrued.inc(amount=len(result.upserted_ids))
+        return len(result.upserted_ids)
+
+    async def _apply(self, batch_id: str) -> None:
+        """Move the rows claimed by `batch_id` into the balances and flag them; safe to repeat"""
+        claimed = await self.db.commissions.find(
+            {"batchId": batch_id, "balanced": False},
+            {"_id": 0, "employeeId": 1, "branchId": 1, "commissionAmount": 1, "saleAmount": 1}
+        ).to_list(None)
+        deltas = {}
+        for row in claimed:
+            delta = deltas.setdefault(row["employeeId"], {"pending": 0.0, "sales": 0.0, "count": 0, "branchId": row["branchId"]})
+            delta["pending"] += row["commissionAmount"]
+            delta["sales"] += row["saleAmount"]
+            delta["count"] += 1
+        if deltas:
+            now = datetime.now(timezone.utc).isoformat()
+            await self.db.commission_balances.bulk_write([
+                UpdateOne(
+                    {"employeeId": employee_id},
+                    {"$setOnInsert": {"branchId": delta["branchId"], "pending": 0.0, "paid": 0.0, "sales": 0.0, "count": 0}},
+                    upsert=True
+                )
+                for employee_id, delta in deltas.items()
+            ], ordered=False)
+            # A balance that already took this batch is left alone
+            await self.db.commission_balances.bulk_write([
+                UpdateOne(
+                    {"employeeId": employee_id, "batches": {"$ne": batch_id}},
+                    {
+                        "$inc": {"pending": cents(delta["pending"]), "sales": cents(delta["sales"]), "count": delta["count"]},
+                        "$set": {"branchId": delta["branchId"], "updatedAt": now},
+                        "$push": {"batches": {"$each": [batch_id], "$slice": -APPLIED_BATCHES}}
+                    }
+                )
+                for employee_id, delta in deltas.items()
+            ], ordered=False)
+        await self.db.commissions.update_many({"batchId": batch_id, "balanced": False}, {"$set": {"balanced": True}})
+
+    async def finish_claimed(self) -> int:
+        """Apply batches claimed but never flagged balanced, e.g. after a crash; returns batches finished"""
+        batch_ids = await self.db.commissions.distinct("batchId", {"balanced": False, "batchId": {"$ne": None}})
+        for batch_id in batch_ids:
+            await self._apply(batch_id)
+        return len(batch_ids)
+
+    async def replay(self, settle_seconds: float = REPLAY_SETTLE_SECONDS) -> int:
+        """Accrue bills stored but never accrued, e.g. after a crash; returns bills replayed"""
+        await self.finish_claimed()
+        # Bills written before the pipeline existed were accrued inline at checkout
+        await self.db.bills.update_many(
+            {"commissionAccrued": {"$exists": False}},
+            {"$set": {"commissionAccrued": True}}
+        )
+        settled = (datetime.now(timezone.utc) - timedelta(seconds=settle_seconds)).isoformat()
+        replayed = 0
+        cursor = self.db.bills.find({"commissionAccrued": False, "createdAt": {"$lt": settled}}, {"_id": 0}).sort("createdAt", 1)
+        batch = []
+        async for bill in cursor:
+            batch.append(bill)
+            if len(batch) >= self.batch_size:
+                await self.accrue(batch)
+                replayed += len(batch)
+                batch = []
+        if batch:
+            await self.accrue(batch)
+            replayed += len(batch)
+        return replayed
+
+    async def rebuild_balances(self) -> None:
+        """Recompute every running balance from the commission rows"""
+        totals = await self.db.commissions.aggregate([
+            {"$group": {
+                "_id": {"employeeId": "$employeeId", "status": "$status"},
+                "amount": {"$sum": "$commissionAmount"},
+                "sales": {"$sum": "$saleAmount"},
+                "count": {"$sum": 1},
+                "branchId": {"$last": "$branchId"}
+            }}
+        ]).to_list(None)
+        balances = {}
+        for total in totals:
+            employee_id = total["_id"]["employeeId"]
+            balance = balances.setdefault(employee_id, {
+                "employeeId": employee_id, "branchId": None, "pending": 0.0, "paid": 0.0, "sales": 0.0, "count": 0
+            })
+            balance["paid" if total["_id"]["status"] == "paid" else "pending"] += total["amount"]
+            balance["sales"] += total["sales"]
+            balance["count"] += total["count"]
+            balance["branchId"] = balance["branchId"] or total["branchId"]
+        now = datetime.now(timezone.utc).isoformat()
+        await self.db.commission_balances.delete_many({})
+        if balances:
+            await self.db.commission_balances.insert_many([{**balance, "updatedAt": now} for balance in balances.values()])
+        await self.db.commissions.update_many({"balanced": False}, {"$set": {"balanced": True}})
+
+
+accrued = metrics.register(metrics.Counter(
+    "commissions_accrued_total", "Commission rows written by the background pipeline"))
@@ -0,0 +1,281 @@
+"""Coordination between API worker processes sharing one database.
+
+* ``InvalidationBus`` mirrors the ``collection_versions`` stamps into every
+  worker. A write bumps its collection's stamp; the worker that wrote it
+  sees the new stamp immediately, the others through a MongoDB change
+  stream or, where change streams are unavailable (standalone servers),
+  by polling the stamps every ``poll_interval`` seconds.
+* ``LocalCache`` is a per-process cache dropped whenever the stamp of the
+  collection it mirrors moves, so a cached value never outlives a write
+  for longer than the bus takes to deliver it.
+* ``Lease`` gives one worker at a time a named role (startup maintenance,
+  periodic jobs), with expiry so a crashed holder is replaced.
+"""
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+MODES = ("auto", "change_stream", "poll", "local")
+
+
+class InvalidationBus:
+    def __init__(self, db, mode: str = "auto", poll_interval: float = 1.0):
+        if mode not in MODES:
+            raise ValueError(f"Unknown cache bus mode {mode!r}; expected one of {', '.join(MODES)}")
+        self.db = db
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.transport: Optional[str] = None
+        self.stamps: Dict[str, dict] = {}
+        self._subscribers: Dict[str, List[Callable[[dict], None]]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def live(self) -> bool:
+        """Whether the local stamps are being kept in step with the database"""
+        return self.transport is not None
+
+    def subscribe(self, collection: str, callback: Callable[[dict], None]) -> None:
+        self._subscribers.setdefault(collection, []).append(callback)
+
+    def version(self, collection: str) -> int:
+        return self.stamps.get(collection, {}).get("version", 0)
+
+    def stamp(self, collection: str) -> Optional[dict]:
+        """Latest known stamp, or None when the caller should read the database"""
+        if not self.live:
+            return None
+        return self.stamps.get(collection, {"id": collection, "version": 0})
+
+    def publish(self, stamp: dict, source: str = "local") -> None:
+        """Record a stamp and notify subscribers if it is newer than the one held"""
+        name = stamp["id"]
+        if stamp.get("version", 0) <= self.version(name):
+            return
+        self.stamps[name] = {key: value for key, value in stamp.items() if key != "_id"}
+        invalidations.inc(name, source)
+        for callback in self._subscribers.get(name, []):
+            callback(self.stamps[name])
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        await self._load()
+        if self.mode == "local":
+            self.transport = "local"
+            return
+        self._task = asyncio.create_task(self._run(), name="cache-bus")
+        # Wait for the first watch or poll so `live` is settled when startup finishes
+        for _ in range(50):
+            if self.transport is not None:
+                break
+            await asyncio.sleep(0.01)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.transport = None
+
+    async def _load(self) -> None:
+        async for stamp in self.db.collection_versions.find({}, {"_id": 0}):
+            self.publish(stamp, "load")
+
+    async def _run(self) -> None:
+        use_change_stream = self.mode in ("auto", "change_stream")
+        streamed = False
+        while True:
+            try:
+                if use_change_stream:
+                    await self._watch()
+                else:
+                    await self._poll()
+            except Exception as error:
+                streamed = streamed or self.transport == "change_stream"
+                self.transport = None
+                if self.mode == "auto" and use_change_stream and not streamed:
+                    # Standalone servers have no change streams
+                    logger.info("Change streams unavailable (%s); polling version stamps every %.1fs", error, self.poll_interval)
+                    use_change_stream = False
+                    continue
+                logger.warning("Cache bus lost its %s feed: %s", "change stream" if use_change_stream else "poll", error)
+                await asyncio.sleep(self.poll_interval)
+
+    async def _watch(self) -> None:
+        async with self.db.collection_versions.watch(full_document="updateLookup") as stream:
+            # Changes made between the initial load and the stream opening
+            await self._load()
+            self.transport = "change_stream"
+            async for change in stream:
+                if change.get("fullDocument"):
+                    self.publish(change["fullDocument"], "change_stream")
+
+    async def _poll(self) -> None:
+        while True:
+            await self._load()
+            self.transport = "poll"
+            await asyncio.sleep(self.poll_interval)
+
+    def status(self) -> dict:
+        return {"mode": self.mode, "transport": self.transport, "pollInterval": self.poll_interval,
+                "versions": {name: stamp.get("version", 0) for name, stamp in sorted(self.stamps.items())}}
+
+
+class LocalCache:
+    """Bounded LRU of values derived from one collection, cleared when its stamp moves"""
+
+    def __init__(self, bus: InvalidationBus, collection: str, name: str, max_entries: int = 1024):
+        self.bus = bus
+        self.collection = collection
+        self.name = name
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Any, Any]" = OrderedDict()
+        bus.subscribe(collection, lambda stamp: self._entries.clear())
+
+    @property
+    def version(self) -> int:
+        """Stamp to pass to `put`; read it before loading the value from the database"""
+        return self.bus.version(self.collection)
+
+    def get(self, key) -> Optional[Any]:
+        if not self.bus.live:
+            return None
+        value = self._entries.get(key)
+        if value is None:
+            cache_requests.inc(self.name, "miss")
+            return None
+        self._entries.move_to_end(key)
+        cache_requests.inc(self.name, "hit")
+        return value
+
+    def put(self, key, value, version: int) -> None:
+        # A write that landed while the value was loading makes it stale already
+        if not self.bus.live or version != self.version:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+class Lease:
+    """Exclusive, expiring ownership of a named role stored in the ``leases`` collection"""
+
+    def __init__(
+        self,
+        db,
+        name: str,
+        ttl_seconds: float = 30.0,
+        on_acquired: Optional[Callable[[], Awaitable[None]]] = None,
+        on_lost: Optional[Callable[[], Awaitable[None]]] = None
+    ):
+        self.db = db
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.on_acquired = on_acquired
+        self.on_lost = on_lost
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.held = False
+        self._task: Optional[asyncio.Task] = None
+
+    async def try_acquire(self) -> bool:
+        """Take or renew the lease; False while another live worker holds it"""
+        now = datetime.now(timezone.utc)
+        try:
+            await self.db.leases.find_one_and_update(
+                {"id": self.name, "$or": [{"owner": self.owner}, {"expiresAt": {"$lt": now.isoformat()}}]},
+                {"$set": {
+                    "owner": self.owner,
+                    "expiresAt": (now + timedelta(seconds=self.ttl_seconds)).isoformat(),
+                    "renewedAt": now.isoformat()
+                }},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # The lease exists, is unexpired and belongs to someone else
+            return False
+        return True
+
+    async def release(self) -> None:
+        await self.db.leases.delete_one({"id": self.name, "owner": self.owner})
+
+    @asynccontextmanager
+    async def hold(self, wait_interval: float = 0.25):
+        """Wait for the lease, keep it renewed for the duration of the block, then release it"""
+        while not await self.try_acquire():
+            await asyncio.sleep(wait_interval)
+        renewer = asyncio.create_task(self._renew_forever(), name=f"lease-{self.name}")
+        try:
+            yield
+        finally:
+            renewer.cancel()
+            try:
+                await renewer
+            except asyncio.CancelledError:
+                pass
+            await self.release()
+
+    async def _renew_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.ttl_seconds / 3)
+            await self.try_acquire()
+
+    def start(self) -> None:
+        """Contend for the lease in the background, running the callbacks on each change of hands"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._elect(), name=f"lease-{self.name}")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.held:
+            await self._set_held(False)
+            await self.release()
+
+    async def _elect(self) -> None:
+        while True:
+            try:
+                held = await self.try_acquire()
+            except PyMongoError:
+                logger.exception("Could not renew the %s lease", self.name)
+                held = False
+            if held != self.held:
+                await self._set_held(held)
+            await asyncio.sleep(self.ttl_seconds / 3)
+
+    async def _set_held(self, held: bool) -> None:
+        self.held = held
+        logger.info("%s the %s lease (%s)", "Acquired" if held else "Lost", self.name, self.owner)
+        callback = self.on_acquired if held else self.on_lost
+        if callback is not None:
+            await callback()
+
+
+invalidations = metrics.register(metrics.Counter(
+    "cache_invalidations_total", "Version stamp changes applied to local caches", ("collection", "source")))
+cache_requests = metrics.register(metrics.Counter(
+    "local_cache_requests_total", "Process-local cache lookups", ("cache", "result")))
@@ -0,0 +1,81 @@
+"""Demo catalog loaded into empty storage (by default when STORAGE_BACKEND=memory)"""
+from datetime import datetime, timezone
+
+DEMO_PASSWORD = "demo123"
+
+BRANCHES = [
+    {"id": "branch-1", "name": "Main Store", "address": "123 Main St", "contactNumber": "+1234567890", "isActive": True},
+    {"id": "branch-2", "name": "Downtown Store", "address": "456 Downtown Ave", "contactNumber": "+0987654321", "isActive": True}
+]
+
+EMPLOYEES = [
+    {"id": "emp-1", "fullName": "John Doe", "username": "john", "role": "cashier", "branchId": "branch-1", "commissionRate": 0.05, "isActive": True},
+    {"id": "emp-2", "fullName": "Jane Smith", "username": "jane", "role": "manager", "branchId": "branch-1", "commissionRate": 0.07, "isActive": True}
+]
+
+
+def _variant(sku, color, size, price, barcode, branch_1, branch_2):
+    return {"sku": sku, "color": color, "size": size, "price": price, "barcode": barcode,
+            "stock": [{"branchId": "branch-1", "quantity": branch_1}, {"branchId": "branch-2", "quantity": branch_2}]}
+
+
+PRODUCTS = [
+    {
+        "id": "prod-1",
+        "name": "T-Shirt",
+        "category": "Clothing",
+        "brand": "Fashion Co",
+        "description": "Comfortable cotton t-shirt",
+        "variants": [
+            _variant("TSH-RED-S", "Red", "S", 29.99, "1234567890", 30, 20),
+            _variant("TSH-RED-M", "Red", "M", 29.99, "1234567891", 15, 15),
+            _variant("TSH-BLU-S", "Blue", "S", 29.99, "1234567892", 10, 10),
+            _variant("TSH-BLU-M", "Blue", "M", 29.99, "1234567893", 15, 10)
+        ]
+    },
+    {
+        "id": "prod-2",
+        "name": "Jeans",
+        "category": "Clothing",
+        "brand": "Denim Plus",
+        "description": "Classic blue jeans",
+        "variants": [
+            _variant("JNS-BLU-30", "Blue", "30", 59.99, "2234567890", 15, 10),
+            _variant("JNS-BLU-32", "Blue", "32", 59.99, "2234567891", 15, 10),
+            _variant("JNS-BLK-30", "Black", "30", 64.99, "2234567892", 8, 7),
+            _variant("JNS-BLK-32", "Black", "32", 64.99, "2234567893", 12, 8)
+        ]
+    },
+    {
+        "id": "prod-3",
+        "name": "Sneakers",
+        "category": "Footwear",
+        "brand": "SportWear",
+        "description": "Comfortable running sneakers",
+        "variants": [
+            _variant("SNK-WHT-9", "White", "9", 89.99, "3234567890", 8, 7),
+            _variant("SNK-WHT-10", "White", "10", 89.99, "3234567891", 8, 7),
+            _variant("SNK-BLK-9", "Black", "9", 94.99, "3234567892", 5, 5),
+            _variant("SNK-BLK-10", "Black", "10", 94.99, "3234567893", 6, 6)
+        ]
+    }
+]
+
+CUSTOMERS = [
+    {"id": "cust-1", "name": "Alice Johnson", "phoneNumber": "+1111111111", "loyaltyPoints": 150},
+    {"id": "cust-2", "name": "Bob Williams", "phoneNumber": "+2222222222", "loyaltyPoints": 200}
+]
+
+
+async def seed(db, hash_password) -> bool:
+    """Insert the demo data unless the database already has branches. Returns True if data was loaded."""
+    if await db.branches.count_documents({}):
+        return False
+
+    created_at = datetime.now(timezone.utc).isoformat()
+    password = hash_password(DEMO_PASSWORD)
+    await db.branches.insert_many([{**b, "createdAt": created_at} for b in BRANCHES])
+    await db.employees.insert_many([{**e, "password": password, "createdAt": created_at} for e in EMPLOYEES])
+    await db.products.insert_many([{**p, "createdAt": created_at} for p in PRODUCTS])
+    await db.customers.insert_many([{**c, "createdAt": created_at} for c in CUSTOMERS])
+    return True
@@ -0,0 +1,73 @@
+"""Sparse fieldsets for list and lookup endpoints.
+
+A request may ask for a named view (``view=summary``) or an explicit list of
+top-level fields (``fields=id,name,price``) instead of the full document.
+The selection turns into a MongoDB projection, so unused fields are never
+read, and into a response model holding only those fields, so they are never
+validated or serialized either. Without ``view`` or ``fields`` (or with the
+``full`` view) endpoints keep returning complete documents.
+"""
+import functools
+from typing import Dict, Iterable, List, Optional, Tuple, Type
+
+from pydantic import BaseModel, TypeAdapter, create_model
+
+FULL = "full"
+
+
+class Fieldset:
+    def __init__(self, model: Type[BaseModel], views: Dict[str, Tuple[str, ...]], required: Tuple[str, ...] = ("id",)):
+        self.model = model
+        self.views = views
+        self.required = required
+
+    def select(self, view: Optional[str] = None, fields: Optional[str] = None) -> Optional[Tuple[str, ...]]:
+        """Fields to return, or None for the full document; raises ValueError for unknown names"""
+        if view and fields:
+            raise ValueError("Pass either view or fields, not both")
+        if fields:
+            names = [name.strip() for name in fields.split(",") if name.strip()]
+            unknown = [name for name in names if name not in self.model.model_fields]
+            if unknown:
+                raise ValueError(f"Unknown fields: {', '.join(unknown)}; expected some of {', '.join(self.model.model_fields)}")
+        elif view and view != FULL:
+            if view not in self.views:
+                raise ValueError(f"Unknown view {view!r}; expected one of {', '.join([*self.views, FULL])}")
+            names = self.views[view]
+        else:
+            return None
+        return tuple(dict.fromkeys([*self.required, *names]))
+
+    @staticmethod
+    def label(selected: Optional[Tuple[str, ...]]) -> str:
+        """Short stable name for a selection, for cache keys and ETags"""
+        return FULL if selected is None else "+".join(sorted(selected))
+
+    @staticmethod
+    def projection(selected: Optional[Tuple[str, ...]], also: Iterable[str] = ()) -> Dict[str, int]:
+        """Projection reading the selected fields plus `also` (needed by the endpoint itself)"""
+        if selected is None:
+            return {"_id": 0}
+        return {"_id": 0, **{name: 1 for name in (*selected, *also)}}
+
+    def response_model(self, selected: Tuple[str, ...]) -> Type[BaseModel]:
+        """Model of one document trimmed to `selected`"""
+        return _subset_model(self.model, selected)
+
+    def adapter(self, selected: Tuple[str, ...]) -> TypeAdapter:
+        """Validator and serializer for a list of documents trimmed to `selected`"""
+        return _list_adapter(self.model, selected)
+
+
+@functools.lru_cache(maxsize=256)
+def _subset_model(model: Type[BaseModel], selected: Tuple[str, ...]) -> Type[BaseModel]:
+    # Fields keep their declared types and defaults; anything else in the document is dropped
+    return create_model(
+        f"{model.__name__}Fields",
+        **{name: (model.model_fields[name].annotation, model.model_fields[name]) for name in selected}
+    )
+
+
+@functools.lru_cache(maxsize=256)
+def _list_adapter(model: Type[BaseModel], selected: Tuple[str, ...]) -> TypeAdapter:
+    return TypeAdapter(List[_subset_model(model, selected)])
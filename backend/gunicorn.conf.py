@@ -0,0 +1,34 @@
+"""Gunicorn settings for running the API with one uvicorn worker per core.
+
+    cd backend
+    gunicorn -c gunicorn.conf.py server:app
+
+Workers share nothing but MongoDB. Per-process caches follow the version
+stamps in ``collection_versions`` through the invalidation bus in
+coordination.py (``CACHE_BUS``: auto, change_stream, poll or local), startup
+maintenance runs under a lease one worker at a time, and the periodic
+archive/export jobs run only in the worker holding the maintenance lease.
+
+The in-memory storage backend lives inside a single process, so it always
+runs with one worker.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+if os.environ.get("STORAGE_BACKEND", "mongo") == "memory":
+    workers = 1
+
+# Startup may wait for another worker's maintenance (index builds, migrations)
+timeout = int(os.environ.get("WORKER_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then so slow leaks cannot accumulate
+max_requests = int(os.environ.get("MAX_REQUESTS", "10000"))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.environ.get("ACCESS_LOG")
+errorlog = "-"
@@ -0,0 +1,73 @@
+"""HTTP validators (ETag / Last-Modified) built from collection version stamps.
+
+A version stamp is a small document ``{"id": <collection>, "version": n,
+"updatedAt": <iso>}`` bumped on every write to the collection. Reads compare
+the stamp to the client's ``If-None-Match`` / ``If-Modified-Since`` headers and
+answer 304 without touching the collection itself.
+"""
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+
+def etag_for(stamp: dict, scope: str = "") -> str:
+    suffix = f"-{scope}" if scope else ""
+    return f'W/"{stamp["id"]}-{stamp.get("version", 0)}{suffix}"'
+
+
+def _last_modified(stamp: dict) -> Optional[datetime]:
+    updated_at = stamp.get("updatedAt")
+    if not updated_at:
+        return None
+    if isinstance(updated_at, str):
+        updated_at = datetime.fromisoformat(updated_at)
+    if updated_at.tzinfo is None:
+        updated_at = updated_at.replace(tzinfo=timezone.utc)
+    return updated_at.replace(microsecond=0)
+
+
+def combined(*stamps: dict) -> dict:
+    """One stamp for a response built from several collections; it changes when any of them does"""
+    updated = [moment for moment in map(_last_modified, stamps) if moment is not None]
+    return {
+        "id": "+".join(stamp["id"] for stamp in stamps),
+        "version": ".".join(str(stamp.get("version", 0)) for stamp in stamps),
+        "updatedAt": max(updated) if updated else None
+    }
+
+
+def validators(stamp: dict, scope: str = "") -> Dict[str, str]:
+    headers = {"ETag": etag_for(stamp, scope), "Cache-Control": "private, no-cache"}
+    last_modified = _last_modified(stamp)
+    if last_modified:
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+    return headers
+
+
+def is_not_modified(request: Request, stamp: dict, scope: str = "") -> bool:
+    """Apply RFC 9110 precedence: If-None-Match wins over If-Modified-Since"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        current = etag_for(stamp, scope).removeprefix("W/")
+        return any(tag.strip().removeprefix("W/") == current for tag in if_none_match.split(","))
+
+    if_modified_since = request.headers.get("if-modified-since")
+    last_modified = _last_modified(stamp)
+    if if_modified_since and last_modified:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return last_modified <= since
+    return False
+
+
+def not_modified(stamp: dict, scope: str = "") -> Response:
+    return Response(status_code=304, headers=validators(stamp, scope))
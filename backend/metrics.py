@@ -0,0 +1,343 @@
+"""Request-level performance instrumentation exposed in Prometheus text format.
+
+* ``MetricsMiddleware`` times every request and attributes database and
+  external-provider work to it through a context variable.
+* ``CommandListener`` receives MongoDB command events (Motor command
+  monitoring, or the equivalent events from the memory backend).
+* ``PoolListener`` tracks each client's connection pools: connections open
+  and in use against ``maxPoolSize``, checkouts waiting, and time spent
+  waiting for a connection.
+* ``external_call`` wraps Twilio/Stripe calls.
+* Requests slower than ``SLOW_REQUEST_MS`` are logged with their breakdown,
+  so N+1 query patterns show up as a high ``db_ops`` count.
+"""
+import contextvars
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250, 1000)
+SLOW_REQUEST_SECONDS = float(os.environ.get("SLOW_REQUEST_MS", "500")) / 1000
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {_number(value)}")
+        return lines
+
+
+class Gauge:
+    """Gauge whose value is read from a callback at scrape time"""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...], collect):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for label_values, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.series: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values) -> None:
+        with self._lock:
+            series = self.series.get(label_values)
+            if series is None:
+                # [bucket counts..., sum, count]
+                series = self.series[label_values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, series in sorted(self.series.items()):
+            for bound, count in zip(self.buckets, series):
+                labels = _labels(self.labels + ("le",), label_values + (_number(bound),))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _labels(self.labels + ("le",), label_values + ("+Inf",))
+            lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, label_values)} {_number(series[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labels, label_values)} {series[-1]}")
+        return lines
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+REGISTRY: list = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+http_requests = register(Counter(
+    "http_requests_total", "HTTP requests by route and status", ("method", "route", "status")))
+http_latency = register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route")))
+db_operations = register(Counter(
+    "db_operations_total", "Database commands by command name", ("command",)))
+db_latency = register(Histogram(
+    "db_operation_duration_seconds", "Database command latency", ("command",)))
+db_operations_per_request = register(Histogram(
+    "db_operations_per_request", "Database commands issued per request", ("method", "route"), COUNT_BUCKETS))
+db_time_per_request = register(Histogram(
+    "db_time_per_request_seconds", "Time spent in database commands per request", ("method", "route")))
+external_calls = register(Counter(
+    "external_calls_total", "Calls to external providers", ("service", "operation", "outcome")))
+external_latency = register(Histogram(
+    "external_call_duration_seconds", "External provider call latency", ("service", "operation")))
+slow_requests = register(Counter(
+    "http_slow_requests_total", "Requests slower than SLOW_REQUEST_MS", ("method", "route")))
+
+
+class RequestStats:
+    """Work attributed to the request currently being served"""
+    __slots__ = ("db_ops", "db_seconds", "db_commands", "external")
+
+    def __init__(self):
+        self.db_ops = 0
+        self.db_seconds = 0.0
+        self.db_commands: Dict[str, int] = {}
+        self.external: Dict[str, float] = {}
+
+    def breakdown(self) -> str:
+        commands = ", ".join(f"{name}={count}" for name, count in sorted(self.db_commands.items()))
+        external = ", ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in self.external.items())
+        return (f"db_ops={self.db_ops} db_time={self.db_seconds * 1000:.1f}ms [{commands}]"
+                + (f" external=[{external}]" if external else ""))
+
+
+current_request: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("current_request", default=None)
+
+
+def record_db_command(command_name: str, seconds: float) -> None:
+    db_operations.inc(command_name)
+    db_latency.observe(seconds, command_name)
+    stats = current_request.get()
+    if stats is not None:
+        stats.db_ops += 1
+        stats.db_seconds += seconds
+        stats.db_commands[command_name] = stats.db_commands.get(command_name, 0) + 1
+
+
+class CommandListener(monitoring.CommandListener):
+    """Feeds Motor command monitoring events into the metrics registry.
+
+    Motor runs commands on executor threads with a copy of the calling
+    context, so ``current_request`` still points at the originating request.
+    """
+
+    def started(self, event) -> None:
+        pass
+
+    def succeeded(self, event) -> None:
+        record_db_command(event.command_name, event.duration_micros / 1_000_000)
+
+    def failed(self, event) -> None:
+        record_db_command(event.command_name, event.duration_micros / 1_000_000)
+
+
+class PoolListener(monitoring.ConnectionPoolListener):
+    """Connection pool usage of one named client, one pool per server it talks to.
+
+    A checkout starts and finishes on the same executor thread, so the wait
+    is timed with a thread-local start time.
+    """
+
+    def __init__(self, client: str):
+        self.client = client
+        self._pools: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+        self._checkout_started = threading.local()
+        POOL_LISTENERS.append(self)
+
+    def _pool(self, address) -> Dict[str, int]:
+        server = f"{address[0]}:{address[1]}"
+        pool = self._pools.get(server)
+        if pool is None:
+            pool = self._pools[server] = {"max": 0, "open": 0, "in_use": 0, "waiting": 0}
+        return pool
+
+    def _adjust(self, address, **changes) -> None:
+        with self._lock:
+            pool = self._pool(address)
+            for state, change in changes.items():
+                pool[state] += change
+
+    def pool_created(self, event) -> None:
+        with self._lock:
+            self._pool(event.address)["max"] = event.options.get("maxPoolSize", 100)
+
+    def pool_ready(self, event) -> None:
+        pass
+
+    def pool_cleared(self, event) -> None:
+        pool_cleared.inc(self.client)
+
+    def pool_closed(self, event) -> None:
+        with self._lock:
+            self._pools.pop(f"{event.address[0]}:{event.address[1]}", None)
+
+    def connection_created(self, event) -> None:
+        self._adjust(event.address, open=1)
+
+    def connection_ready(self, event) -> None:
+        pass
+
+    def connection_closed(self, event) -> None:
+        self._adjust(event.address, open=-1)
+
+    def connection_check_out_started(self, event) -> None:
+        self._checkout_started.value = time.perf_counter()
+        self._adjust(event.address, waiting=1)
+
+    def connection_checked_out(self, event) -> None:
+        self._adjust(event.address, waiting=-1, in_use=1)
+        pool_checkout_wait.observe(time.perf_counter() - self._checkout_started.value, self.client)
+
+    def connection_check_out_failed(self, event) -> None:
+        self._adjust(event.address, waiting=-1)
+        pool_checkout_failures.inc(self.client, event.reason)
+        pool_checkout_wait.observe(time.perf_counter() - self._checkout_started.value, self.client)
+
+    def connection_checked_in(self, event) -> None:
+        self._adjust(event.address, in_use=-1)
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {server: dict(pool) for server, pool in self._pools.items()}
+
+
+POOL_LISTENERS: List[PoolListener] = []
+
+
+def _pool_values(state: str) -> Dict[tuple, int]:
+    return {
+        (listener.client, server): pool[state]
+        for listener in POOL_LISTENERS
+        for server, pool in listener.snapshot().items()
+    }
+
+
+pool_connections = register(Gauge(
+    "mongo_pool_connections", "Connections per pool by state (open, in_use, waiting)", ("client", "server", "state"),
+    lambda: {key + (state,): value for state in ("open", "in_use", "waiting") for key, value in _pool_values(state).items()}))
+pool_max_size = register(Gauge(
+    "mongo_pool_max_size", "Configured maxPoolSize per pool", ("client", "server"), lambda: _pool_values("max")))
+pool_checkout_wait = register(Histogram(
+    "mongo_pool_checkout_wait_seconds", "Time spent waiting to check a connection out of the pool", ("client",)))
+pool_checkout_failures = register(Counter(
+    "mongo_pool_checkout_failures_total", "Connection checkouts that failed, by reason", ("client", "reason")))
+pool_cleared = register(Counter(
+    "mongo_pool_cleared_total", "Times a pool was cleared after a server error", ("client",)))
+
+
+@contextmanager
+def external_call(service: str, operation: str):
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        elapsed = time.perf_counter() - started
+        external_calls.inc(service, operation, outcome)
+        external_latency.observe(elapsed, service, operation)
+        stats = current_request.get()
+        if stats is not None:
+            key = f"{service}.{operation}"
+            stats.external[key] = stats.external.get(key, 0.0) + elapsed
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            current_request.reset(token)
+            route = scope.get("route")
+            route_path = getattr(route, "path_format", None) or "unmatched"
+            method = scope["method"]
+            http_requests.inc(method, route_path, str(status["code"]))
+            http_latency.observe(elapsed, method, route_path)
+            db_operations_per_request.observe(stats.db_ops, method, route_path)
+            db_time_per_request.observe(stats.db_seconds, method, route_path)
+            if elapsed >= SLOW_REQUEST_SECONDS:
+                slow_requests.inc(method, route_path)
+                logger.warning("Slow request %s %s took %.1fms: %s",
+                               method, route_path, elapsed * 1000, stats.breakdown())
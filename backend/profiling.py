@@ -0,0 +1,170 @@
+"""On-demand sampling profiler for hot routes.
+
+Profiling is off until an admin enables a route. While it is off the
+middleware costs one dict lookup per request. When enabled, a fraction of
+matching requests is marked as sampled; a background thread periodically
+captures the event-loop thread's stack and, if the task currently running
+belongs to a sampled request, adds it to that route's folded-stack counts.
+Work a request hands to another task (a coalesced read) is counted for it
+once the request adopts that task.
+Samples taken while the loop is idle or waiting on I/O are skipped, so the
+profile shows where sampled requests spend CPU; time spent waiting on
+MongoDB or providers is broken down by /metrics instead.
+The output is the "folded" format used by flamegraph.pl and speedscope.
+"""
+import asyncio
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+MAX_STACKS_PER_ROUTE = 20_000
+MAX_STACK_DEPTH = 128
+
+
+class ProfileTarget:
+    def __init__(self, route: str, fraction: float):
+        self.route = route
+        self.fraction = fraction
+        self.pattern = re.compile("^" + re.sub(r"\\{[^/]+?\\}", "[^/]+", re.escape(route)) + "$")
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.dropped = 0
+        self.sampled_requests = 0
+        self.started_at = time.time()
+
+    def status(self) -> dict:
+        return {
+            "route": self.route,
+            "fraction": self.fraction,
+            "sampledRequests": self.sampled_requests,
+            "samples": self.samples,
+            "distinctStacks": len(self.stacks),
+            "droppedSamples": self.dropped,
+            "startedAt": self.started_at,
+        }
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class Profiler:
+    def __init__(self):
+        self.targets: Dict[str, ProfileTarget] = {}
+        self.interval = 0.005
+        self._active: Dict[int, ProfileTarget] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def enable(self, route: str, fraction: float, interval: Optional[float] = None) -> ProfileTarget:
+        if interval:
+            self.interval = interval
+        target = self.targets.get(route)
+        if target is None:
+            target = self.targets[route] = ProfileTarget(route, fraction)
+        else:
+            target.fraction = fraction
+        self._ensure_sampler()
+        return target
+
+    def disable(self, route: Optional[str] = None) -> None:
+        if route is None:
+            self.targets.clear()
+        else:
+            self.targets.pop(route, None)
+        if not self.targets and self._thread is not None:
+            self._stop.set()
+            self._thread = None
+
+    def match(self, path: str) -> Optional[ProfileTarget]:
+        for target in self.targets.values():
+            if target.pattern.match(path):
+                return target
+        return None
+
+    def _ensure_sampler(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        if self._thread is None or not self._thread.is_alive():
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._stop,), name="route-profiler", daemon=True)
+            self._thread.start()
+
+    def _run(self, stop: threading.Event) -> None:
+        while not stop.wait(self.interval):
+            if self._active:
+                self._sample()
+
+    def _sample(self) -> None:
+        try:
+            task = asyncio.current_task(self._loop)
+        except RuntimeError:
+            return
+        target = self._active.get(id(task)) if task is not None else None
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if target is None or frame is None:
+            return
+        names = []
+        while frame is not None and len(names) < MAX_STACK_DEPTH:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{code.co_firstlineno}")
+            frame = frame.f_back
+        stack = ";".join(reversed(names))
+        with self._lock:
+            target.samples += 1
+            if stack in target.stacks or len(target.stacks) < MAX_STACKS_PER_ROUTE:
+                target.stacks[stack] += 1
+            else:
+                target.dropped += 1
+
+    def begin(self, target: ProfileTarget) -> Optional[int]:
+        task = asyncio.current_task()
+        if task is None:
+            return None
+        target.sampled_requests += 1
+        self._active[id(task)] = target
+        return id(task)
+
+    def end(self, key: Optional[int]) -> None:
+        if key is not None:
+            self._active.pop(key, None)
+
+    def adopt(self, task: asyncio.Future) -> None:
+        """Count samples of `task` toward the sampled request awaiting it, until the task finishes"""
+        if not self._active or id(task) in self._active:
+            return
+        current = asyncio.current_task()
+        target = self._active.get(id(current)) if current is not None else None
+        if target is None:
+            return
+        self._active[id(task)] = target
+        task.add_done_callback(lambda done: self._active.pop(id(done), None))
+
+
+profiler = Profiler()
+
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not profiler.targets or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        target = profiler.match(scope["path"])
+        if target is None or random.random() >= target.fraction:
+            await self.app(scope, receive, send)
+            return
+        key = profiler.begin(target)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profiler.end(key)
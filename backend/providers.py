@@ -0,0 +1,96 @@
+"""External clients created on first use instead of at import.
+
+Importing the server only registers a factory for each provider (database
+client, Stripe, Twilio, password hashing, tokens). The SDK behind a provider
+is imported and its client built the first time a request asks for it, so a
+worker comes up without paying for integrations it may never call. The app
+lifespan warms the providers every request needs (``preload``) and closes
+whatever was created on shutdown.
+"""
+import inspect
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Provider:
+    def __init__(self, name: str, factory: Callable[[], Any], close: Optional[Callable[[Any], Any]] = None, preload: bool = False):
+        self.name = name
+        self.factory = factory
+        self.close = close
+        self.preload = preload
+
+
+class ProviderRegistry:
+    def __init__(self):
+        self._providers: Dict[str, Provider] = {}
+        self._instances: Dict[str, Any] = {}
+        self._created: List[str] = []  # in creation order, closed in reverse
+        self._load_ms: Dict[str, float] = {}
+        self._overridden: set = set()
+        self._lock = threading.RLock()  # a factory may get() another provider
+
+    def register(self, name: str, factory: Callable[[], Any], close: Optional[Callable[[Any], Any]] = None, preload: bool = False) -> None:
+        self._providers[name] = Provider(name, factory, close, preload)
+
+    def get(self, name: str) -> Any:
+        """The provider's instance, built on the first call (None is a valid instance)"""
+        try:
+            return self._instances[name]
+        except KeyError:
+            pass
+        with self._lock:
+            if name not in self._instances:
+                provider = self._providers[name]
+                started = time.perf_counter()
+                instance = provider.factory()
+                self._load_ms[name] = round((time.perf_counter() - started) * 1000, 1)
+                self._instances[name] = instance
+                self._created.append(name)
+                logger.info("Created %s provider in %.1f ms", name, self._load_ms[name])
+        return self._instances[name]
+
+    def override(self, name: str, instance: Any) -> None:
+        """Use `instance` instead of the factory; the caller keeps ownership of it"""
+        with self._lock:
+            self._instances[name] = instance
+            self._overridden.add(name)
+            if name in self._created:
+                self._created.remove(name)
+
+    def created(self, name: str) -> bool:
+        return name in self._instances
+
+    async def startup(self) -> None:
+        for provider in self._providers.values():
+            if provider.preload:
+                self.get(provider.name)
+
+    async def shutdown(self) -> None:
+        """Close every instance the registry built; the next `get` builds a fresh one"""
+        while self._created:
+            name = self._created.pop()
+            instance = self._instances.pop(name)
+            close = self._providers[name].close
+            if close is None or instance is None:
+                continue
+            try:
+                result = close(instance)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                logger.exception("Could not close the %s provider", name)
+
+    def status(self) -> dict:
+        return {
+            name: {
+                "created": name in self._instances,
+                "overridden": name in self._overridden,
+                "preload": provider.preload,
+                "loadMs": self._load_ms.get(name),
+            }
+            for name, provider in sorted(self._providers.items())
+        }
@@ -0,0 +1,380 @@
+"""Stock reconciliation against the sales, return and transfer history.
+
+Inventory quantities are only ever changed by atomic increments, but a
+crashed request, a manual edit or a bug in a new code path can still leave a
+level that the history does not explain. This job replays that history and
+compares the result with ``inventory``.
+
+For every (sku, branch) the job keeps a checkpoint in ``stock_checkpoints``:
+the quantity the history implies as of a cutoff time. A run replays the events
+after the checkpoint, up to its own cutoff:
+
+* sale bills take stock out and return bills put it back (hot and archived
+  bills);
+* transfers move stock between branches (``stock_transfers``);
+* stock-ins and admin adjustments come from the ``stock_movements`` ledger,
+  the only place they are recorded.
+
+A pair without a checkpoint has no history to replay against. The job takes
+its current level as the baseline. Pairs written within ``settle_seconds``
+of the cutoff are skipped as busy and replayed by the next run, so a request
+caught between its inventory write and its bill insert is not reported.
+Mismatches are reported; with ``repair`` the level is set to the replayed
+quantity and the correction is logged as a ``reconciliation`` movement.
+
+The work is split into SKU ranges. Each range reads only bills with a line
+item in it, through a multikey (items.variantSku, createdAt) index on the
+hot and archived bills. On MongoDB each range runs in a worker process with
+its own client, so decoding millions of bills uses every core.
+The in-process memory backend runs the ranges in the API process.
+"""
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from multiprocessing import get_context
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+import archive
+import stock_movements
+
+logger = logging.getLogger(__name__)
+
+STATUSES = ("ok", "mismatch", "repaired", "baselined", "busy")
+REPLAYED_MOVEMENTS = ("stock_in", "adjustment")
+REPORTED_MISMATCHES = 100
+CHECKPOINT_BATCH = 1000
+# Lets each SKU range read only its own bills instead of the whole window
+BILL_SKU_INDEX = [("items.variantSku", 1), ("createdAt", 1)]
+
+
+def shard_bounds(skus: Iterable[str], shards: int) -> List[Tuple[str, Optional[str]]]:
+    """Split the sorted SKUs into at most `shards` contiguous [low, high) ranges; the last is open-ended"""
+    ordered = sorted(set(skus))
+    if not ordered:
+        return []
+    shards = max(1, min(shards, len(ordered)))
+    starts = [ordered[len(ordered) * index // shards] for index in range(shards)]
+    return [(low, starts[index + 1] if index + 1 < shards else None) for index, low in enumerate(starts)]
+
+
+def _sku_range(field: str, low: str, high: Optional[str]) -> dict:
+    bounds = {"$gte": low}
+    if high is not None:
+        bounds["$lt"] = high
+    return {field: bounds}
+
+
+class Replay:
+    """Expected quantities for one SKU range, fed documents one at a time"""
+
+    def __init__(self, low: str, high: Optional[str], cutoff: str, settle_seconds: float):
+        self.low = low
+        self.high = high
+        self.cutoff = cutoff
+        self.busy_after = (datetime.fromisoformat(cutoff) - timedelta(seconds=settle_seconds)).isoformat()
+        self.checkpoints: Dict[Tuple[str, str], dict] = {}
+        self.deltas: Dict[Tuple[str, str], int] = {}
+        self.records: Dict[str, int] = {}
+
+    def _owns(self, sku: str) -> bool:
+        return self.low <= sku and (self.high is None or sku < self.high)
+
+    def _apply(self, sku: str, branch_id: str, quantity: int, created_at: str) -> None:
+        checkpoint = self.checkpoints.get((sku, branch_id))
+        if checkpoint is not None and created_at > checkpoint["asOf"] and self._owns(sku):
+            self.deltas[(sku, branch_id)] = self.deltas.get((sku, branch_id), 0) + quantity
+
+    def _count(self, kind: str) -> None:
+        self.records[kind] = self.records.get(kind, 0) + 1
+
+    @property
+    def since(self) -> Optional[str]:
+        """Earliest checkpoint in the range; None when there is nothing to replay"""
+        return min((checkpoint["asOf"] for checkpoint in self.checkpoints.values()), default=None)
+
+    def checkpoint_read(self) -> Tuple[str, dict, dict]:
+        return "stock_checkpoints", _sku_range("sku", self.low, self.high), {"_id": 0}
+
+    def event_reads(self, months: Iterable[str]) -> List[Tuple[str, str, dict, dict]]:
+        """(kind, collection, filter, projection) of every history read, once checkpoints are loaded"""
+        since = self.since
+        if since is None:
+            return []
+        window = {"createdAt": {"$gt": since, "$lte": self.cutoff}}
+        bill_projection = {"_id": 0, "branchId": 1, "relatedBillId": 1, "createdAt": 1,
+                           "items.variantSku": 1, "items.quantity": 1}
+        # $elemMatch keeps the range on one line item, so MongoDB bounds the multikey index scan on both ends
+        bill_filter = {"items": {"$elemMatch": _sku_range("variantSku", self.low, self.high)}, **window}
+        reads = [("bills", "bills", bill_filter, bill_projection)]
+        reads += [("bills", archive.collection_name(month), bill_filter, bill_projection)
+                  for month in months if month >= since[:7] and month <= self.cutoff[:7]]
+        reads.append(("transfers", "stock_transfers", {**_sku_range("sku", self.low, self.high), **window},
+                      {"_id": 0, "sku": 1, "fromBranchId": 1, "toBranchId": 1, "quantity": 1, "createdAt": 1}))
+        reads.append(("movements", "stock_movements",
+                      {**_sku_range("sku", self.low, self.high), "type": {"$in": list(REPLAYED_MOVEMENTS)}, **window},
+                      {"_id": 0, "sku": 1, "branchId": 1, "quantity": 1, "createdAt": 1}))
+        return reads
+
+    def inventory_read(self) -> Tuple[str, dict, dict]:
+        return "inventory", _sku_range("sku", self.low, self.high), {"_id": 0, "sku": 1, "branchId": 1, "quantity": 1, "updatedAt": 1}
+
+    def feed(self, kind: str, doc: dict) -> None:
+        self._count(kind)
+        if kind == "checkpoints":
+            self.checkpoints[(doc["sku"], doc["branchId"])] = doc
+        elif kind == "bills":
+            # Return bills carry positive quantities and point at the sale they reverse
+            sign = 1 if doc.get("relatedBillId") else -1
+            for item in doc["items"]:
+                self._apply(item["variantSku"], doc["branchId"], sign * item["quantity"], doc["createdAt"])
+        elif kind == "transfers":
+            self._apply(doc["sku"], doc["fromBranchId"], -doc["quantity"], doc["createdAt"])
+            self._apply(doc["sku"], doc["toBranchId"], doc["quantity"], doc["createdAt"])
+        elif kind == "movements":
+            self._apply(doc["sku"], doc["branchId"], doc["quantity"], doc["createdAt"])
+
+    def finish(self, inventory: Iterable[dict]) -> dict:
+        """Compare the replayed quantities with the inventory rows of the range"""
+        results = []
+        seen = set()
+        for level in inventory:
+            self._count("inventory")
+            pair = (level["sku"], level["branchId"])
+            seen.add(pair)
+            results.append(self._result(pair, level["quantity"], level.get("updatedAt")))
+        # A checkpointed pair whose inventory row has gone reads as zero
+        for pair in self.checkpoints:
+            if pair not in seen:
+                results.append(self._result(pair, 0, None))
+        return {"results": results, "records": self.records}
+
+    def _result(self, pair: Tuple[str, str], actual: int, updated_at: Optional[str]) -> dict:
+        result = {"sku": pair[0], "branchId": pair[1], "actual": actual, "updatedAt": updated_at}
+        checkpoint = self.checkpoints.get(pair)
+        if updated_at is not None and updated_at > self.busy_after:
+            result.update(status="busy", expected=None)
+        elif checkpoint is None:
+            result.update(status="baselined", expected=actual)
+        else:
+            expected = checkpoint["quantity"] + self.deltas.get(pair, 0)
+            result.update(status="ok" if expected == actual else "mismatch", expected=expected)
+        return result
+
+
+# Worker processes keep one client each across the shards they are given
+_clients: Dict[str, object] = {}
+
+
+def reconcile_shard(spec: dict) -> dict:
+    """Replay one SKU range in a worker process with its own synchronous client"""
+    from pymongo import MongoClient
+
+    client = _clients.get(spec["url"])
+    if client is None:
+        client = _clients[spec["url"]] = MongoClient(spec["url"], appname="clothpos-reconcile", **spec["options"])
+    db = client[spec["db_name"]]
+    replay = Replay(spec["low"], spec["high"], spec["cutoff"], spec["settle_seconds"])
+    collection, query, projection = replay.checkpoint_read()
+    for doc in db[collection].find(query, projection):
+        replay.feed("checkpoints", doc)
+    for kind, collection, query, projection in replay.event_reads(spec["months"]):
+        for doc in db[collection].find(query, projection, batch_size=5000):
+            replay.feed(kind, doc)
+    collection, query, projection = replay.inventory_read()
+    return replay.finish(db[collection].find(query, projection, batch_size=5000))
+
+
+async def reconcile_shard_async(db, spec: dict) -> dict:
+    """The same replay through the API's own database handle"""
+    replay = Replay(spec["low"], spec["high"], spec["cutoff"], spec["settle_seconds"])
+    collection, query, projection = replay.checkpoint_read()
+    async for doc in db[collection].find(query, projection):
+        replay.feed("checkpoints", doc)
+    for kind, collection, query, projection in replay.event_reads(spec["months"]):
+        async for doc in db[collection].find(query, projection):
+            replay.feed(kind, doc)
+    collection, query, projection = replay.inventory_read()
+    return replay.finish(await db[collection].find(query, projection).to_list(None))
+
+
+class Reconciler:
+    def __init__(
+        self,
+        db,
+        bill_archive: archive.BillArchive,
+        movements: stock_movements.StockMovements,
+        processes: int = 0,
+        shards: int = 0,
+        settle_seconds: float = 60.0,
+        interval_hours: float = 0,
+        repair: bool = False,
+        mongo_url: Optional[str] = None,
+        db_name: Optional[str] = None,
+        client_options: Optional[dict] = None,
+        next_revision: Optional[Callable[[], Awaitable[int]]] = None,
+        on_repaired: Optional[Callable[[], Awaitable[None]]] = None
+    ):
+        self.db = db
+        self.bill_archive = bill_archive
+        self.movements = movements
+        # Worker processes need a server to connect to; 0 replays in this process
+        self.processes = processes if mongo_url else 0
+        # In one process every range rescans the bill window, so ranges only pay off across workers
+        self.shards = shards or (self.processes * 4 if self.processes else 1)
+        self.settle_seconds = settle_seconds
+        self.interval_hours = interval_hours
+        self.repair = repair
+        self.mongo_url = mongo_url
+        self.db_name = db_name
+        self.client_options = client_options or {}
+        self.next_revision = next_revision
+        self.on_repaired = on_repaired
+        self.last_run: Optional[dict] = None
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._indexed_months = set()
+
+    async def ensure_indexes(self) -> None:
+        await self.db.stock_checkpoints.create_index([("sku", 1), ("branchId", 1)], unique=True)
+        await self.db.bills.create_index(BILL_SKU_INDEX)
+        await self._index_months(await self.bill_archive.months())
+
+    async def _index_months(self, months: Iterable[str]) -> None:
+        for month in months:
+            if month not in self._indexed_months:
+                await self.db[archive.collection_name(month)].create_index(BILL_SKU_INDEX)
+                self._indexed_months.add(month)
+
+    async def run(self, repair: Optional[bool] = None, shards: Optional[int] = None) -> dict:
+        """Replay the history of every SKU and compare it with inventory; returns the run report"""
+        repair = self.repair if repair is None else repair
+        async with self._lock:
+            started = time.perf_counter()
+            cutoff = datetime.now(timezone.utc).isoformat()
+            skus = [level["sku"] async for level in self.db.inventory.find({}, {"_id": 0, "sku": 1})]
+            skus += [checkpoint["sku"] async for checkpoint in self.db.stock_checkpoints.find({}, {"_id": 0, "sku": 1})]
+            bounds = shard_bounds(skus, shards or self.shards)
+            months = await self.bill_archive.months()
+            # Months archived since startup
+            await self._index_months(months)
+            specs = [
+                {"low": low, "high": high, "cutoff": cutoff, "settle_seconds": self.settle_seconds, "months": months,
+                 "url": self.mongo_url, "db_name": self.db_name, "options": self.client_options}
+                for low, high in bounds
+            ]
+            outcomes = await self._replay(specs)
+
+            results = [result for outcome in outcomes for result in outcome["results"]]
+            records: Dict[str, int] = {}
+            for outcome in outcomes:
+                for kind, count in outcome["records"].items():
+                    records[kind] = records.get(kind, 0) + count
+            replayed_seconds = time.perf_counter() - started
+            if repair:
+                await self._repair([result for result in results if result["status"] == "mismatch"])
+            await self._save_checkpoints(results, cutoff)
+
+            counts = {status: 0 for status in STATUSES}
+            for result in results:
+                counts[result["status"]] += 1
+            mismatches = [
+                {"sku": result["sku"], "branchId": result["branchId"], "expected": result["expected"],
+                 "actual": result["actual"], "difference": result["actual"] - result["expected"],
+                 "repaired": result["status"] == "repaired"}
+                for result in results if result["status"] in ("mismatch", "repaired")
+            ]
+            total_records = sum(records.values())
+            self.last_run = {
+                "cutoff": cutoff,
+                "repair": repair,
+                "shards": len(specs),
+                "processes": self.processes,
+                "records": records,
+                "recordsPerSecond": round(total_records / replayed_seconds) if replayed_seconds else None,
+                "seconds": round(time.perf_counter() - started, 3),
+                "pairs": counts,
+                "mismatches": mismatches[:REPORTED_MISMATCHES],
+            }
+        if mismatches:
+            logger.warning("Stock reconciliation found %d mismatched levels (%d repaired)", len(mismatches), counts["repaired"])
+        return self.last_run
+
+    async def _replay(self, specs: List[dict]) -> List[dict]:
+        if not self.processes:
+            return [await reconcile_shard_async(self.db, spec) for spec in specs]
+        loop = asyncio.get_running_loop()
+        # Spawned workers do not inherit the event loop or the API's clients
+        with ProcessPoolExecutor(max_workers=self.processes, mp_context=get_context("spawn")) as pool:
+            return await asyncio.gather(*(loop.run_in_executor(pool, reconcile_shard, spec) for spec in specs))
+
+    async def _repair(self, mismatches: List[dict]) -> None:
+        if not mismatches:
+            return
+        revision = await self.next_revision() if self.next_revision else None
+        now = datetime.now(timezone.utc).isoformat()
+        corrections = []
+        # A level whose inventory row is gone stays reported; the row's product is not known here
+        for result in [result for result in mismatches if result["updatedAt"] is not None]:
+            update = {"quantity": result["expected"], "updatedAt": now}
+            if revision is not None:
+                update["rev"] = revision
+            # Only a level nobody has written since it was read is corrected
+            written = await self.db.inventory.update_one(
+                {"sku": result["sku"], "branchId": result["branchId"], "quantity": result["actual"],
+                 "updatedAt": result["updatedAt"]},
+                {"$set": update}
+            )
+            if written.matched_count:
+                result["status"] = "repaired"
+                corrections.append(stock_movements.movement(
+                    "reconciliation", result["sku"], result["branchId"], result["expected"] - result["actual"],
+                    None, created_at=now
+                ))
+            else:
+                result["status"] = "busy"
+        await self.movements.record(corrections)
+        if corrections and self.on_repaired is not None:
+            await self.on_repaired()
+
+    async def _save_checkpoints(self, results: List[dict], cutoff: str) -> None:
+        # Busy pairs keep their old checkpoint and are replayed from it next time
+        updates = [
+            UpdateOne(
+                {"sku": result["sku"], "branchId": result["branchId"]},
+                {"$set": {"quantity": result["expected"], "asOf": cutoff}},
+                upsert=True
+            )
+            for result in results if result["status"] != "busy"
+        ]
+        for start in range(0, len(updates), CHECKPOINT_BATCH):
+            await self.db.stock_checkpoints.bulk_write(updates[start:start + CHECKPOINT_BATCH], ordered=False)
+
+    def start(self) -> None:
+        if self.interval_hours > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run_periodically(), name="stock-reconciliation")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval_hours * 3600)
+            try:
+                await self.run()
+            except Exception:
+                logger.exception("Stock reconciliation run failed")
+
+
+def default_processes() -> int:
+    return min(8, os.cpu_count() or 1)
@@ -0,0 +1,159 @@
+"""Cache of rendered sales reports with write-aware invalidation.
+
+A report is keyed by its normalized parameters: start and end date, branch
+filter, and employee filter. Callers who are not admins are pinned to their
+own employee id, so the employee filter also carries the role scope.
+
+Bill writes bump the ``bills`` version stamp. The stamp counts changes per
+scope (everything, a branch, an employee, and a branch and employee
+together). Changes to today's bills are counted under ``live`` and changes
+to earlier bills (returns against old sales) under ``history``. A cached
+report remembers the counters of its own scope when it was computed, and it
+is served only while they are unchanged:
+
+* a closed range (ending before today) watches ``history`` only, so it
+  stays cached until an old bill in its scope is returned or the LRU
+  evicts it;
+* a range touching today also watches ``live`` and expires after
+  ``open_ttl_seconds`` as a backstop.
+
+Workers read the same counters from the invalidation bus. A worker that
+misses intermediate stamps still sees every change, because the counters
+only grow. ``epoch`` drops everything, e.g. after a counter rebuild or an
+archive run. While a run is moving bills, a report can read a bill both
+from the hot collection and from the archive, or from neither: the hot
+copy is deleted before the month's rollups are refreshed. A run that moved
+bills therefore bumps the epoch when it ends, so no report cached during
+the run outlives it.
+"""
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import metrics
+from coordination import InvalidationBus, cache_requests
+
+COLLECTION = "bills"
+
+ReportKey = Tuple[Optional[str], Optional[str], Optional[str], Optional[str]]
+
+
+def _today() -> str:
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+def _scope(branch_id: Optional[str], employee_id: Optional[str]) -> str:
+    if branch_id and employee_id:
+        return f"b:{branch_id}|e:{employee_id}"
+    if employee_id:
+        return f"e:{employee_id}"
+    if branch_id:
+        return f"b:{branch_id}"
+    return "*"
+
+
+def report_key(start_date: Optional[str], end_date: Optional[str], branch_id: Optional[str], employee_id: Optional[str]) -> ReportKey:
+    """Blank parameters mean no filter"""
+    return tuple((value or "").strip() or None for value in (start_date, end_date, branch_id, employee_id))
+
+
+def bill_change(bill: dict) -> Dict[str, int]:
+    """Stamp counters to increment for a bill written or updated (for `bump_collection_version`)"""
+    namespace = "live" if bill["createdAt"][:10] >= _today() else "history"
+    employees = {bill["employeeId"], bill.get("commissionEmployeeId") or bill["employeeId"]}
+    fields = {f"{namespace}.*": 1, f"{namespace}.b:{bill['branchId']}": 1}
+    for employee_id in employees:
+        fields[f"{namespace}.e:{employee_id}"] = 1
+        fields[f"{namespace}.{_scope(bill['branchId'], employee_id)}"] = 1
+    return fields
+
+
+def merge_changes(changes: Iterable[Dict[str, int]]) -> Dict[str, int]:
+    merged: Dict[str, int] = {}
+    for change in changes:
+        for field, amount in change.items():
+            merged[field] = merged.get(field, 0) + amount
+    return merged
+
+
+class ReportCache:
+    """Bounded LRU of rendered reports, validated against the ``bills`` stamp"""
+
+    def __init__(self, bus: InvalidationBus, name: str = "sales_report", max_entries: int = 256, open_ttl_seconds: float = 300.0):
+        self.bus = bus
+        self.name = name
+        self.max_entries = max_entries
+        self.open_ttl_seconds = open_ttl_seconds
+        self._entries: "OrderedDict[ReportKey, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        CACHES.append(self)
+
+    def version(self, key: ReportKey) -> tuple:
+        """Counters the report depends on; read them before computing it and pass them to `put`"""
+        stamp = self.bus.stamps.get(COLLECTION, {})
+        scope = _scope(key[2], key[3])
+        history = stamp.get("history", {}).get(scope, 0)
+        if self._closed(key):
+            return (stamp.get("epoch", 0), history)
+        return (stamp.get("epoch", 0), history, stamp.get("live", {}).get(scope, 0))
+
+    @staticmethod
+    def _closed(key: ReportKey) -> bool:
+        return key[1] is not None and key[1] < _today()
+
+    def get(self, key: ReportKey) -> Optional[bytes]:
+        if not self.bus.live:
+            return None
+        entry = self._entries.get(key)
+        if entry is not None:
+            body, version, expires_at = entry
+            if version == self.version(key) and (expires_at is None or time.monotonic() < expires_at):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                cache_requests.inc(self.name, "hit")
+                return body
+            del self._entries[key]
+            evictions.inc("expired" if version == self.version(key) else "stale")
+        self.misses += 1
+        cache_requests.inc(self.name, "miss")
+        return None
+
+    def put(self, key: ReportKey, body: bytes, version: tuple) -> None:
+        # A bill that landed while the report was computing makes it stale already
+        if not self.bus.live or version != self.version(key):
+            return
+        expires_at = None if self._closed(key) else time.monotonic() + self.open_ttl_seconds
+        self._entries[key] = (body, version, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            evictions.inc("lru")
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def size(self) -> int:
+        return len(self._entries)
+
+    def status(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "maxEntries": self.max_entries,
+            "openTtlSeconds": self.open_ttl_seconds,
+            "bytes": sum(len(body) for body, _, _ in self._entries.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+CACHES: List[ReportCache] = []
+
+evictions = metrics.register(metrics.Counter(
+    "report_cache_evictions_total", "Cached reports dropped as stale, expired or least recently used", ("reason",)))
+entries = metrics.register(metrics.Gauge(
+    "report_cache_entries", "Reports held in the process-local report cache", ("cache",),
+    lambda: {(cache.name,): cache.size() for cache in CACHES}))
@@ -0,0 +1,358 @@
+"""Incrementally maintained sales counters for top products and category reports.
+
+Every bill adds its line items to counter documents in ``sales_counters``
+keyed by (kind, scope, period, key):
+
+* kind: ``sku`` or ``category``
+* scope: ``*`` (all branches), ``b:<branchId>``, ``e:<employeeId>`` or
+  ``be:<branchId>:<employeeId>`` (an employee's sales at one branch)
+* period: ``d:YYYY-MM-DD`` and ``m:YYYY-MM``, both UTC
+
+Return bills subtract from the day they were processed. A date range is
+answered from whole months plus the boundary days, so a query touches at
+most ~60 periods regardless of its length. Single-period top-K lists are
+read straight off the (kind, scope, period, revenue) index.
+
+Each line item touches a dozen counters, so checkout and returns only queue
+the bill (stored with ``countersRecorded: False``). A worker task merges a
+batch of bills into one bulk write. It first claims the bills by setting
+``countersRecorded`` to its batch id and only counts the bills it claimed,
+so a rebuild or a replay never counts a bill twice. A batch whose counter
+write fails is released for replay. One that crashes the process, or is
+partly applied, stays claimed; startup logs it, and a rebuild restores
+the counters.
+"""
+import asyncio
+import copy
+import logging
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+import archive
+
+logger = logging.getLogger(__name__)
+
+REBUILD_BATCH_SIZE = 2000
+BATCH_SIZE = 200
+FLUSH_INTERVAL = 0.05
+REPLAY_SETTLE_SECONDS = 60
+
+
+def _next_month(day: date) -> date:
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def period_filter(start_date: Optional[str], end_date: Optional[str]) -> dict:
+    """Mongo condition selecting the periods that exactly cover whole UTC days from start to end"""
+    first = date.fromisoformat(start_date[:10]) if start_date else None
+    last = date.fromisoformat(end_date[:10]) if end_date else None
+    if first and last and first > last:
+        return {"period": {"$in": []}}
+
+    days = []
+    months_from = months_to = None  # [months_from, months_to), None means unbounded
+    if first:
+        months_from = first if first.day == 1 else _next_month(first)
+        day = first
+        while day < months_from and (last is None or day <= last):
+            days.append(day)
+            day += timedelta(days=1)
+    if last:
+        following = _next_month(last)
+        if last == following - timedelta(days=1):
+            months_to = following
+        else:
+            months_to = last.replace(day=1)
+            day = max(months_to, months_from) if months_from else months_to
+            while day <= last:
+                days.append(day)
+                day += timedelta(days=1)
+
+    terms = []
+    if len(days) == 1:
+        terms.append({"period": f"d:{days[0].isoformat()}"})
+    elif days:
+        terms.append({"period": {"$in": [f"d:{day.isoformat()}" for day in days]}})
+    if months_from is None or months_to is None or months_from < months_to:
+        lower = f"m:{months_from.isoformat()[:7]}" if months_from else "m:"
+        upper = f"m:{months_to.isoformat()[:7]}" if months_to else "m;"
+        if months_from and months_to and _next_month(months_from) == months_to:
+            terms.append({"period": lower})
+        else:
+            terms.append({"period": {"$gte": lower, "$lt": upper}})
+    if not terms:
+        return {"period": {"$in": []}}
+    return terms[0] if len(terms) == 1 else {"$or": terms}
+
+
+def scope_for(branch_id: Optional[str] = None, employee_id: Optional[str] = None) -> str:
+    if branch_id and employee_id:
+        return f"be:{branch_id}:{employee_id}"
+    if employee_id:
+        return f"e:{employee_id}"
+    if branch_id:
+        return f"b:{branch_id}"
+    return "*"
+
+
+def _bill_counters(bill: dict, counters: Dict[str, dict], categories: Optional[Dict[str, str]] = None) -> None:
+    """Add a bill's line items to `counters`, keyed by counter id"""
+    sign = -1 if bill.get("relatedBillId") else 1
+    employee_id = bill.get("commissionEmployeeId") or bill["employeeId"]
+    scopes = ("*", f"b:{bill['branchId']}", f"e:{employee_id}", f"be:{bill['branchId']}:{employee_id}")
+    periods = (f"d:{bill['createdAt'][:10]}", f"m:{bill['createdAt'][:7]}")
+    for item in bill["items"]:
+        category = item.get("category") or (categories or {}).get(item.get("productId")) or "Uncategorized"
+        keys = (
+            ("sku", item["variantSku"], {"productId": item.get("productId"), "productName": item["productName"], "category": category}),
+            ("category", category, {}),
+        )
+        for scope in scopes:
+            for period in periods:
+                for kind, key, fields in keys:
+                    counter_id = f"{kind}|{scope}|{period}|{key}"
+                    counter = counters.get(counter_id)
+                    if counter is None:
+                        counter = counters[counter_id] = {
+                            "id": counter_id, "kind": kind, "scope": scope, "period": period, "key": key,
+                            "quantity": 0, "revenue": 0, **fields
+                        }
+                    counter["quantity"] += sign * item["quantity"]
+                    counter["revenue"] += sign * item["lineTotal"]
+
+
+class SalesAnalytics:
+    def __init__(
+        self,
+        db,
+        bill_archive,
+        read_db=None,
+        batch_size: int = BATCH_SIZE,
+        flush_interval: float = FLUSH_INTERVAL,
+        on_recorded: Optional[Callable[[List[dict]], Awaitable[None]]] = None
+    ):
+        self.db = db
+        self.bill_archive = bill_archive
+        # Reports read the counters here, possibly from a secondary
+        self.read_db = read_db if read_db is not None else db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # Told about every recorded batch, so caches built on the counters can drop
+        self.on_recorded = on_recorded
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._worker: Optional[asyncio.Task] = None
+
+    def reading_from(self, read_db) -> "SalesAnalytics":
+        """These counters with their report reads sent to `read_db`, e.g. the primary"""
+        view = copy.copy(self)
+        view.read_db = read_db
+        return view
+
+    async def ensure_indexes(self) -> None:
+        await self.db.sales_counters.create_index("id", unique=True)
+        await self.db.sales_counters.create_index([("kind", 1), ("scope", 1), ("period", 1), ("revenue", -1)])
+
+    def submit(self, bill: dict) -> None:
+        """Queue a stored bill (saved with ``countersRecorded: False``) for the counters"""
+        self.queue.put_nowait(bill)
+
+    def start(self) -> None:
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run(), name="sales-counters")
+
+    async def stop(self) -> None:
+        """Stop the worker after recording everything already queued"""
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        await self._drain()
+
+    async def flush(self) -> None:
+        """Wait until every queued bill has been recorded"""
+        await self.queue.join()
+
+    async def _run(self) -> None:
+        while True:
+            batch = [await self.queue.get()]
+            # Give concurrent checkouts a moment to join the batch
+            await asyncio.sleep(self.flush_interval)
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                await self.record(batch)
+            except Exception:
+                logger.exception("Recording sales counters failed for %d bills; they will be replayed on restart", len(batch))
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _drain(self) -> None:
+        while not self.queue.empty():
+            batch = []
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                await self.record(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def record(self, bills: List[dict]) -> int:
+        """Add the sale and return bills not yet counted to the counters in one round trip; returns bills counted"""
+        batch_id = str(uuid.uuid4())
+        ids = [bill["id"] for bill in bills]
+        await self.db.bills.update_many({"id": {"$in": ids}, "countersRecorded": False}, {"$set": {"countersRecorded": batch_id}})
+        try:
+            claimed = {bill["id"] async for bill in self.db.bills.find({"id": {"$in": ids}, "countersRecorded": batch_id}, {"_id": 0, "id": 1})}
+            counted = [bill for bill in bills if bill["id"] in claimed]
+            counters: Dict[str, dict] = {}
+            for bill in counted:
+                _bill_counters(bill, counters)
+            if counters:
+                await self.db.sales_counters.bulk_write([
+                    UpdateOne(
+                        {"id": counter_id},
+                        {
+                            "$inc": {"quantity": counter["quantity"], "revenue": counter["revenue"]},
+                            "$setOnInsert": {field: value for field, value in counter.items() if field not in ("quantity", "revenue")}
+                        },
+                        upsert=True
+                    )
+                    for counter_id, counter in counters.items()
+                ], ordered=False)
+        except Exception as error:
+            # Release the claim so replay counts the batch, unless some counters already took it
+            applied = error.details if isinstance(error, BulkWriteError) else {}
+            if not (applied.get("nModified") or applied.get("nUpserted")):
+                await self.db.bills.update_many({"countersRecorded": batch_id}, {"$set": {"countersRecorded": False}})
+            raise
+        await self.db.bills.update_many({"countersRecorded": batch_id}, {"$set": {"countersRecorded": True}})
+        if counted and self.on_recorded is not None:
+            await self.on_recorded(counted)
+        return len(counted)
+
+    async def replay(self, settle_seconds: float = REPLAY_SETTLE_SECONDS) -> int:
+        """Record bills stored but never counted, e.g. after a crash; returns bills replayed"""
+        # Bills written before the queue existed were counted at checkout
+        await self.db.bills.update_many({"countersRecorded": {"$exists": False}}, {"$set": {"countersRecorded": True}})
+        settled = (datetime.now(timezone.utc) - timedelta(seconds=settle_seconds)).isoformat()
+        interrupted = await self.db.bills.count_documents(
+            {"countersRecorded": {"$nin": [True, False]}, "createdAt": {"$lt": settled}}
+        )
+        if interrupted:
+            logger.warning("%d bills were claimed by a sales counter batch that never finished; "
+                           "rebuild the counters to include them", interrupted)
+        replayed = 0
+        batch = []
+        async for bill in self.db.bills.find({"countersRecorded": False, "createdAt": {"$lt": settled}}, {"_id": 0}).sort("createdAt", 1):
+            batch.append(bill)
+            if len(batch) >= self.batch_size:
+                replayed += await self.record(batch)
+                batch = []
+        if batch:
+            replayed += await self.record(batch)
+        return replayed
+
+    async def rebuild(self) -> int:
+        """Recompute every counter from the hot and archived bills; returns bills read"""
+        counters: Dict[str, dict] = {}
+        # Bills from before line items carried a category fall back to the product's current one
+        categories = {
+            product["id"]: product["category"]
+            async for product in self.db.products.find({}, {"_id": 0, "id": 1, "category": 1})
+        }
+        sources = [self.db.bills] + [self.db[archive.collection_name(month)] for month in await self.bill_archive.months()]
+        bills = 0
+        for collection in sources:
+            async for bill in collection.find({}, {"_id": 0, "items": 1, "branchId": 1, "employeeId": 1,
+                                                   "commissionEmployeeId": 1, "relatedBillId": 1, "createdAt": 1}):
+                _bill_counters(bill, counters, categories)
+                bills += 1
+        await self.db.sales_counters.delete_many({})
+        # Everything read is counted now, including bills still queued or left by an interrupted batch
+        await self.db.bills.update_many({"countersRecorded": {"$ne": True}}, {"$set": {"countersRecorded": True}})
+        documents = list(counters.values())
+        for start in range(0, len(documents), REBUILD_BATCH_SIZE):
+            await self.db.sales_counters.insert_many(documents[start:start + REBUILD_BATCH_SIZE])
+        logger.info("Rebuilt %d sales counters from %d bills", len(documents), bills)
+        return bills
+
+    async def _totals(self, kind: str, scope: str, start_date, end_date, group: str, limit: Optional[int]) -> List[dict]:
+        query = {"kind": kind, "scope": scope, **period_filter(start_date, end_date)}
+        if isinstance(query.get("period"), str) and group == "$key":
+            # One period: the index already holds the counters ordered by revenue
+            cursor = self.read_db.sales_counters.find(query, {"_id": 0}).sort("revenue", -1)
+            if limit:
+                cursor = cursor.limit(limit)
+            return [{**row, "_id": row["key"]} for row in await cursor.to_list(None)]
+        pipeline = [
+            {"$match": query},
+            {"$group": {
+                "_id": group,
+                "quantity": {"$sum": "$quantity"},
+                "revenue": {"$sum": "$revenue"},
+                "productId": {"$first": "$productId"},
+                "productName": {"$first": "$productName"},
+                "category": {"$first": "$category"}
+            }},
+            {"$sort": {"revenue": -1, "_id": 1}}
+        ]
+        if limit:
+            pipeline.append({"$limit": limit})
+        return await self.read_db.sales_counters.aggregate(pipeline).to_list(None)
+
+    async def top_products(self, start_date=None, end_date=None, scope: str = "*", limit: int = 10, by: str = "product") -> List[dict]:
+        """Best sellers by net revenue, per product or per SKU"""
+        if by == "sku":
+            rows = await self._totals("sku", scope, start_date, end_date, "$key", limit)
+            return [{"sku": row["_id"], "name": row.get("productName"), "productId": row.get("productId"),
+                     "category": row.get("category"), "quantity": row["quantity"], "revenue": row["revenue"]} for row in rows]
+        rows = await self._totals("sku", scope, start_date, end_date, "$productId", limit)
+        names = {
+            product["id"]: product["name"]
+            for product in await self.read_db.products.find({"id": {"$in": [row["_id"] for row in rows]}}, {"_id": 0, "id": 1, "name": 1}).to_list(None)
+        }
+        return [{"productId": row["_id"], "name": names.get(row["_id"], row.get("productName")), "category": row.get("category"),
+                 "quantity": row["quantity"], "revenue": row["revenue"]} for row in rows]
+
+    async def categories(self, start_date=None, end_date=None, scope: str = "*") -> List[dict]:
+        rows = await self._totals("category", scope, start_date, end_date, "$key", None)
+        return [{"name": row["_id"], "value": row["revenue"], "quantity": row["quantity"]} for row in rows]
+
+    async def slow_movers(self, start_date=None, end_date=None, branch_id: Optional[str] = None, limit: int = 10) -> List[dict]:
+        """SKUs that sold the fewest units in the range, including ones that did not sell at all"""
+        sold = {row["_id"]: row for row in await self._totals("sku", scope_for(branch_id), start_date, end_date, "$key", None)}
+        stock_query = {"branchId": branch_id} if branch_id else {}
+        stock = {
+            row["_id"]: row["quantity"]
+            for row in await self.read_db.inventory.aggregate([
+                {"$match": stock_query},
+                {"$group": {"_id": "$sku", "quantity": {"$sum": "$quantity"}}}
+            ]).to_list(None)
+        }
+        rows = []
+        async for product in self.read_db.products.find({}, {"_id": 0, "id": 1, "name": 1, "category": 1, "variants": 1}):
+            for variant in product["variants"]:
+                counter = sold.get(variant["sku"], {})
+                rows.append({
+                    "sku": variant["sku"],
+                    "productId": product["id"],
+                    "name": product["name"],
+                    "color": variant.get("color"),
+                    "size": variant.get("size"),
+                    "category": product["category"],
+                    "quantity": counter.get("quantity", 0),
+                    "revenue": counter.get("revenue", 0),
+                    "stock": stock.get(variant["sku"], 0)
+                })
+        rows.sort(key=lambda row: (row["quantity"], -row["stock"], row["sku"]))
+        return rows[:limit]
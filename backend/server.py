@@ -1,50 +1,236 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Request
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Query, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.encoders import jsonable_encoder
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from pymongo import ReturnDocument, UpdateOne
 import os
+import base64
+import json
 import logging
+import re
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, field_validator
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, BeforeValidator, Field, ConfigDict, TypeAdapter, field_validator
+from typing import Annotated, List, Optional, Dict, Any
 import uuid
 from datetime import datetime, timezone, timedelta
-from jose import JWTError, jwt
-from passlib.context import CryptContext
-import stripe
-from twilio.rest import Client
-import phonenumbers
+from contextlib import asynccontextmanager
+import admission
+import archive
+import barcodes
+import coalescing
+import columnar_export
+import commissions
+import coordination
+import fieldsets
+import http_cache
+import metrics
+import profiling
+import providers
+import reconciliation
+import report_cache
+import sales_analytics
+import stock_movements
+import storage
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# SDK clients are built on first use; see providers.py
+provider_registry = providers.ProviderRegistry()
+
+# Database connection ("mongo" or the in-process "memory" backend). The client
+# is created by the first query; `db` looks it up in the registry on each use.
+storage_backend = os.environ.get("STORAGE_BACKEND", "mongo")
+
+def create_database_client(name: str, url: Optional[str] = None, **options):
+    return storage.create_client(
+        storage_backend,
+        event_listeners=[metrics.CommandListener(), metrics.PoolListener(name)],
+        url=url,
+        appname=f"clothpos-{name}",
+        **options
+    )
+
+def create_analytics_client():
+    # In-process data lives in a single client
+    if storage_backend == "memory":
+        return provider_registry.get("database")
+    options = storage.client_options("MONGO_ANALYTICS_", fallback="MONGO_", readPreference="secondaryPreferred")
+    return create_database_client("analytics", os.environ.get("MONGO_ANALYTICS_URL"), **options)
+
+# Checkout and other transactional traffic, on the primary (MONGO_MAX_POOL_SIZE etc.)
+provider_registry.register(
+    "database",
+    lambda: create_database_client("transactional", **storage.client_options("MONGO_")),
+    close=lambda client: client.close(),
+    preload=True
+)
+db = storage.LazyDatabase(lambda: provider_registry.get("database"), os.environ['DB_NAME'])
+
+# Report scans get their own pool and may read from secondaries
+# (MONGO_ANALYTICS_READ_PREFERENCE, default secondaryPreferred), so they
+# neither queue behind checkout writes nor load the primary
+provider_registry.register("analytics_database", create_analytics_client, close=lambda client: client.close())
+analytics_db = storage.LazyDatabase(lambda: provider_registry.get("analytics_database"), os.environ['DB_NAME'])
+
+# Keeps per-process caches coherent when several workers share the database.
+# The memory backend lives inside one process, so it has nobody to tell.
+cache_bus = coordination.InvalidationBus(
+    db,
+    mode=os.environ.get("CACHE_BUS", "local" if storage_backend == "memory" else "auto"),
+    poll_interval=float(os.environ.get("CACHE_BUS_POLL_SECONDS", "1"))
+)
+principal_cache = coordination.LocalCache(cache_bus, "employees", "principals")
+
+# Barcode -> variant map behind the till's scan endpoint, rebuilt when the catalog stamp moves
+barcode_index = barcodes.BarcodeIndex(db, cache_bus)
+
+# Rendered sales reports; closed date ranges stay until an old bill in their
+# scope is returned, ranges touching today drop on sales in their scope
+sales_report_cache = report_cache.ReportCache(
+    cache_bus,
+    max_entries=int(os.environ.get("REPORT_CACHE_MAX_ENTRIES", "256")),
+    open_ttl_seconds=float(os.environ.get("REPORT_CACHE_OPEN_TTL_SECONDS", "300"))
+)
+
+# One worker at a time runs startup maintenance; the periodic jobs are started
+# in whichever worker holds the maintenance lease (see startup_event)
+startup_lease = coordination.Lease(db, "startup", ttl_seconds=60)
+
+# Commission accrual runs off the checkout path
+commission_pipeline = commissions.CommissionPipeline(db)
+
+# Largest page of commission rows a single request may ask for
+COMMISSION_PAGE_LIMIT = 200
+
+# Bills older than the horizon move to monthly archive collections
+bill_archive = archive.BillArchive(
+    db,
+    horizon_days=int(os.environ.get("BILL_ARCHIVE_HORIZON_DAYS", "180")),
+    interval_hours=float(os.environ.get("BILL_ARCHIVE_INTERVAL_HOURS", "24")),
+    read_db=analytics_db,
+    # Until a run's rollups are refreshed, reports can miss or double count the moved bills
+    on_archived=lambda: bump_collection_version("bills", {"epoch": 1})
+)
+REPORT_BILL_LIMIT = 10000
+
+# Loyalty points earned per unit of currency spent; returns take them back
+LOYALTY_POINTS_PER_UNIT = float(os.environ.get("LOYALTY_POINTS_PER_UNIT", "1"))
+
+# Largest page of a customer's purchase history a single request may ask for
+CUSTOMER_BILLS_PAGE_LIMIT = 100
+
+# Per-SKU and per-category counters behind top products and category breakdowns,
+# recorded off the checkout path; reports rendered before a batch landed are dropped
+sales_counters = sales_analytics.SalesAnalytics(
+    db,
+    bill_archive,
+    read_db=analytics_db,
+    on_recorded=lambda bills: bump_collection_version(
+        "bills", report_cache.merge_changes(report_cache.bill_change(bill) for bill in bills)
+    )
+)
+
+# Cached sales reports are rendered from these, which read the primary
+report_archive = bill_archive.reading_from(db)
+report_counters = sales_counters.reading_from(db)
+
+# Signed per-(sku, branch) record of every stock change, for audits
+movement_ledger = stock_movements.StockMovements(db, read_db=analytics_db)
+
+# Largest page of stock movements or transfers a single request may ask for
+MOVEMENT_PAGE_LIMIT = 200
+
+# Parquet copy of bills for analytics queries that should not hit MongoDB
+columnar = columnar_export.ColumnarExport(
+    db,
+    bill_archive,
+    Path(os.environ.get("ANALYTICS_EXPORT_DIR", ROOT_DIR / "analytics_data")),
+    interval_minutes=float(os.environ.get("ANALYTICS_EXPORT_INTERVAL_MINUTES", "60"))
+)
+
+# Replays bills, returns, transfers and stock-ins against inventory. On MongoDB
+# the SKU ranges run in worker processes (RECONCILE_PROCESSES); the memory
+# backend replays in this process. Repairs are off unless RECONCILE_REPAIR is set.
+stock_reconciler = reconciliation.Reconciler(
+    db,
+    bill_archive,
+    movement_ledger,
+    processes=int(os.environ.get("RECONCILE_PROCESSES", str(reconciliation.default_processes()))),
+    shards=int(os.environ.get("RECONCILE_SHARDS", "0")),
+    settle_seconds=float(os.environ.get("RECONCILE_SETTLE_SECONDS", "60")),
+    interval_hours=float(os.environ.get("RECONCILE_INTERVAL_HOURS", "24")),
+    repair=os.environ.get("RECONCILE_REPAIR", "false").lower() == "true",
+    mongo_url=os.environ.get("MONGO_URL") if storage_backend != "memory" else None,
+    db_name=os.environ['DB_NAME'],
+    client_options=storage.client_options("MONGO_RECONCILE_", fallback="MONGO_", readPreference="secondaryPreferred"),
+    next_revision=lambda: next_catalog_revision(),
+    on_repaired=lambda: bump_collection_version("inventory")
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup_event()
+    try:
+        yield
+    finally:
+        await shutdown_event()
+
+# Per-route-class concurrency limits; checkout goes ahead of reports and exports
+admission_control = admission.AdmissionController.from_env()
 
 # Create the main app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 api_router = APIRouter(prefix="/api")
 
 # Security
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+def create_password_context():
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+def load_jwt():
+    from jose import jwt
+    return jwt
+
+provider_registry.register("passwords", create_password_context)
+provider_registry.register("jwt", load_jwt, preload=True)  # every authenticated request decodes a token
 security = HTTPBearer()
 SECRET_KEY = os.environ.get("JWT_SECRET", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
+# Delta sync re-sends this many revisions before `since`, covering writes that
+# allocated a revision but had not landed when the client last synced
+CATALOG_SYNC_OVERLAP = int(os.environ.get("CATALOG_SYNC_OVERLAP", "16"))
+
 # Stripe
-stripe.api_key = os.environ.get("STRIPE_API_KEY", "sk_test_emergent")
+def load_stripe():
+    import stripe
+    stripe.api_key = os.environ.get("STRIPE_API_KEY", "sk_test_emergent")
+    return stripe
+
+provider_registry.register("stripe", load_stripe)
 
 # Twilio
 twilio_account_sid = os.environ.get("TWILIO_ACCOUNT_SID", "")
 twilio_auth_token = os.environ.get("TWILIO_AUTH_TOKEN", "")
 twilio_phone_number = os.environ.get("TWILIO_PHONE_NUMBER", "")
-twilio_client = None
-if twilio_account_sid and twilio_auth_token:
-    twilio_client = Client(twilio_account_sid, twilio_auth_token)
+
+def create_twilio_client():
+    if not (twilio_account_sid and twilio_auth_token):
+        return None
+    from twilio.rest import Client
+    return Client(twilio_account_sid, twilio_auth_token)
+
+def load_phonenumbers():
+    import phonenumbers
+    return phonenumbers
+
+provider_registry.register("twilio", create_twilio_client)
+provider_registry.register("phonenumbers", load_phonenumbers)
 
 # Models
 class Branch(BaseModel):
@@ -90,6 +276,9 @@ class Customer(BaseModel):
     phoneNumber: str
     name: Optional[str] = None
     loyaltyPoints: float = 0
+    lifetimeValue: float = 0
+    visitCount: int = 0
+    lastVisit: Optional[str] = None
     createdAt: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class CustomerCreate(BaseModel):
@@ -121,6 +310,15 @@ class ProductCreate(BaseModel):
     brand: Optional[str] = None
     variants: List[ProductVariant]
 
+# Catalog listings are validated and rendered once per coalesced computation
+PRODUCT_LIST = TypeAdapter(List[Product])
+
+# `view=` / `fields=` on product routes; `summary` skips variants and their stock lookup
+PRODUCT_FIELDS = fieldsets.Fieldset(Product, {
+    "summary": ("name", "category", "brand"),
+    "pos": ("name", "category", "brand", "variants"),
+})
+
 class BillItem(BaseModel):
     productId: str
     variantSku: str
@@ -128,6 +326,7 @@ class BillItem(BaseModel):
     quantity: int
     unitPrice: float
     lineTotal: float
+    category: Optional[str] = None
 
 class Bill(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -142,8 +341,35 @@ class Bill(BaseModel):
     totalAmount: float
     paymentMethod: str
     status: str = "completed"
+    commissionRate: float = 0
+    commissionAccrued: bool = False
+    countersRecorded: bool = False
     createdAt: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class ReturnedQuantity(BaseModel):
+    sku: str
+    quantity: int
+
+def upgrade_returned_quantities(value):
+    # Bills returned before SKUs were kept out of field names store a {sku: quantity} map
+    if isinstance(value, dict):
+        return [{"sku": sku, "quantity": quantity} for sku, quantity in value.items()]
+    return value
+
+class BillRecord(Bill):
+    """A stored bill as listed, including the fields returns add"""
+    relatedBillId: Optional[str] = None
+    returnReason: Optional[str] = None
+    # A validator in the annotation carries over to the `fields=` subset models
+    returnedQuantities: Annotated[List[ReturnedQuantity], BeforeValidator(upgrade_returned_quantities)] = []
+    commissionEmployeeId: Optional[str] = None
+
+# `view=` / `fields=` on bill listings; `summary` leaves out the line items
+BILL_FIELDS = fieldsets.Fieldset(BillRecord, {
+    "summary": ("billNumber", "branchId", "employeeId", "customerId", "subtotal", "discountAmount",
+                "totalAmount", "paymentMethod", "status", "relatedBillId", "createdAt"),
+})
+
 class BillCreate(BaseModel):
     customerPhoneNumber: str
     items: List[Dict[str, Any]]
@@ -155,6 +381,7 @@ class Commission(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     employeeId: str
     billId: str
+    branchId: Optional[str] = None
     saleAmount: float
     commissionRate: float
     commissionAmount: float
@@ -184,12 +411,52 @@ class PaymentIntentRequest(BaseModel):
     amount: float
     currency: str = "usd"
 
+class ArchiveRunRequest(BaseModel):
+    horizonDays: Optional[int] = None
+
+    @field_validator("horizonDays")
+    @classmethod
+    def check_horizon(cls, value: Optional[int]) -> Optional[int]:
+        if value is not None and value < 1:
+            raise ValueError("horizonDays must be at least 1")
+        return value
+
+class ReconcileRunRequest(BaseModel):
+    repair: Optional[bool] = None
+    shards: Optional[int] = None
+
+    @field_validator("shards")
+    @classmethod
+    def check_shards(cls, value: Optional[int]) -> Optional[int]:
+        if value is not None and value < 1:
+            raise ValueError("shards must be at least 1")
+        return value
+
+class ProfilingRequest(BaseModel):
+    route: str
+    fraction: float = 0.1
+    intervalMs: float = 5
+
+    @field_validator("fraction")
+    @classmethod
+    def check_fraction(cls, value: float) -> float:
+        if not 0 < value <= 1:
+            raise ValueError("fraction must be in (0, 1]")
+        return value
+
+    @field_validator("intervalMs")
+    @classmethod
+    def check_interval(cls, value: float) -> float:
+        if not 1 <= value <= 1000:
+            raise ValueError("intervalMs must be between 1 and 1000")
+        return value
+
 # Helper Functions
 def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+    return provider_registry.get("passwords").hash(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return provider_registry.get("passwords").verify(plain_password, hashed_password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -198,21 +465,26 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.now(timezone.utc) + timedelta(minutes=15)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = provider_registry.get("jwt").encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    jwt = provider_registry.get("jwt")
     try:
         token = credentials.credentials
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             raise HTTPException(status_code=401, detail="Invalid authentication credentials")
-        user = await db.employees.find_one({"username": username, "isActive": True}, {"_id": 0})
+        user = principal_cache.get(username)
         if user is None:
-            raise HTTPException(status_code=401, detail="User not found")
-        return user
-    except JWTError:
+            version = principal_cache.version
+            user = await db.employees.find_one({"username": username, "isActive": True}, {"_id": 0})
+            if user is None:
+                raise HTTPException(status_code=401, detail="User not found")
+            principal_cache.put(username, user, version)
+        return dict(user)
+    except jwt.JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
 async def get_admin_user(current_user: dict = Depends(get_current_user)):
@@ -222,19 +494,22 @@ async def get_admin_user(current_user: dict = Depends(get_current_user)):
 
 def send_sms(to_number: str, message: str) -> bool:
     """Send SMS via Twilio"""
+    twilio_client = provider_registry.get("twilio")
     if not twilio_client or not twilio_phone_number:
         logging.warning("Twilio not configured, SMS not sent")
         return False
     try:
         # Parse and format phone number
+        phonenumbers = provider_registry.get("phonenumbers")
         parsed = phonenumbers.parse(to_number, None)
         formatted_number = phonenumbers.format_number(parsed, phonenumbers.PhoneNumberFormat.E164)
         
-        message = twilio_client.messages.create(
-            body=message,
-            from_=twilio_phone_number,
-            to=formatted_number
-        )
+        with metrics.external_call("twilio", "messages.create"):
+            message = twilio_client.messages.create(
+                body=message,
+                from_=twilio_phone_number,
+                to=formatted_number
+            )
         logging.info(f"SMS sent successfully: {message.sid}")
         return True
     except Exception as e:
@@ -253,6 +528,142 @@ Bill #{bill_data['billNumber']}
 Total: ${bill_data['totalAmount']:.2f}
 Thank you for shopping with us!"""
 
+async def get_collection_version(name: str) -> dict:
+    """Current version stamp of a collection, used for ETag/Last-Modified"""
+    stamp = cache_bus.stamp(name)
+    if stamp is None:
+        stamp = await db.collection_versions.find_one({"id": name}, {"_id": 0})
+    return stamp or {"id": name, "version": 0}
+
+async def bump_collection_version(name: str, counters: Optional[Dict[str, int]] = None) -> int:
+    """Mark a collection as changed so cached copies revalidate; `counters` are extra stamp fields to increment"""
+    stamp = await db.collection_versions.find_one_and_update(
+        {"id": name},
+        {"$inc": {"version": 1, **(counters or {})}, "$set": {"updatedAt": datetime.now(timezone.utc).isoformat()}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    # This worker's caches drop now; the others hear it through the bus
+    cache_bus.publish(stamp)
+    return stamp["version"]
+
+async def next_catalog_revision() -> int:
+    """Allocate the revision stamped on product and stock changes for delta sync"""
+    counter = await db.counters.find_one_and_update(
+        {"id": "revision:products"}, {"$inc": {"seq": 1}}, upsert=True, return_document=ReturnDocument.AFTER
+    )
+    return counter["seq"]
+
+async def next_bill_sequence(branch_id: str) -> int:
+    """Return the next bill sequence number for a branch from its counter document"""
+    counter_id = f"bills:{branch_id}"
+    counter = await db.counters.find_one_and_update(
+        {"id": counter_id}, {"$inc": {"seq": 1}}, return_document=ReturnDocument.AFTER
+    )
+    if counter is None:
+        # Seed the counter from existing bills the first time a branch is seen
+        existing = await db.bills.count_documents({"branchId": branch_id}) + await bill_archive.count_branch_bills(branch_id)
+        await db.counters.update_one({"id": counter_id}, {"$max": {"seq": existing}}, upsert=True)
+        counter = await db.counters.find_one_and_update(
+            {"id": counter_id}, {"$inc": {"seq": 1}}, return_document=ReturnDocument.AFTER
+        )
+    return counter["seq"]
+
+async def coalesced_json(route: str, key: tuple, compute) -> Response:
+    """Answer identical concurrent requests from one run of `compute`, rendered to JSON once"""
+    async def render() -> bytes:
+        return JSONResponse(jsonable_encoder(await compute())).body
+    return Response(await coalescing.flights.run(route, key, render), media_type="application/json")
+
+def select_fields(fieldset: fieldsets.Fieldset, view: Optional[str], fields: Optional[str]) -> Optional[tuple]:
+    """Fields a request asked for, or None for full documents"""
+    try:
+        return fieldset.select(view, fields)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+def stock_scope(current_user: dict, branch_id: Optional[str] = None) -> Optional[str]:
+    """Branch whose stock a caller sees; None means every branch"""
+    if branch_id == "all":
+        return None
+    if branch_id:
+        return branch_id
+    if current_user["role"] == "admin":
+        return None
+    return current_user["branchId"]
+
+def split_variant_stock(product_doc: dict) -> List[dict]:
+    """Remove embedded stock from a product's variants and return it as inventory entries"""
+    entries = []
+    for variant in product_doc["variants"]:
+        for level in variant.pop("stock", None) or []:
+            entries.append({"sku": variant["sku"], "branchId": level["branchId"], "quantity": level.get("quantity", 0)})
+    return entries
+
+async def set_stock_levels(product_id: str, entries: List[dict], rev: int, user_id: Optional[str] = None) -> None:
+    """Write absolute stock quantities for (sku, branchId) pairs; levels a user sets are logged as adjustments"""
+    if not entries:
+        return
+    now = datetime.now(timezone.utc).isoformat()
+    previous = {}
+    if user_id:
+        async for level in db.inventory.find(
+            {"sku": {"$in": [entry["sku"] for entry in entries]}}, {"_id": 0, "sku": 1, "branchId": 1, "quantity": 1}
+        ):
+            previous[(level["sku"], level["branchId"])] = level["quantity"]
+    await db.inventory.bulk_write([
+        UpdateOne(
+            {"sku": entry["sku"], "branchId": entry["branchId"]},
+            {"$set": {"productId": product_id, "quantity": entry["quantity"], "rev": rev, "updatedAt": now}},
+            upsert=True
+        )
+        for entry in entries
+    ], ordered=False)
+    if user_id:
+        await movement_ledger.record(
+            stock_movements.movement(
+                "adjustment", entry["sku"], entry["branchId"],
+                entry["quantity"] - previous.get((entry["sku"], entry["branchId"]), 0),
+                user_id, product_id, created_at=now
+            )
+            for entry in entries
+        )
+
+async def attach_stock(products: List[dict], branch_id: Optional[str]) -> None:
+    """Fill each variant's stock list from the inventory collection.
+
+    With a branch only that branch's rows are read; a single product is
+    looked up by SKU, larger pages scan the branch through the (branchId, sku)
+    index instead of sending a long $in list.
+    """
+    if not products:
+        return
+    query = {"branchId": branch_id} if branch_id else {}
+    if len(products) <= 20 or not branch_id:
+        query["sku"] = {"$in": [v["sku"] for product in products for v in product["variants"]]}
+    levels: Dict[str, List[dict]] = {}
+    async for level in db.inventory.find(query, {"_id": 0, "sku": 1, "branchId": 1, "quantity": 1}):
+        levels.setdefault(level["sku"], []).append({"branchId": level["branchId"], "quantity": level["quantity"]})
+    for product in products:
+        for variant in product["variants"]:
+            variant["stock"] = levels.get(variant["sku"], [])
+
+async def migrate_embedded_stock() -> int:
+    """Move stock embedded in product variants into the inventory collection.
+
+    Idempotent: products without embedded stock are never matched, so it is
+    safe to run on every startup.
+    """
+    migrated = 0
+    async for product in db.products.find({"variants.stock.0": {"$exists": True}}, {"_id": 0}):
+        await set_stock_levels(product["id"], split_variant_stock(product), product.get("rev", 0))
+        await db.products.update_one({"id": product["id"]}, {"$unset": {"variants.$[].stock": ""}})
+        migrated += 1
+    if migrated:
+        await bump_collection_version("products")
+        await bump_collection_version("inventory")
+    return migrated
+
 # Auth Routes
 @api_router.post("/auth/login")
 async def login(request: LoginRequest):
@@ -280,14 +691,19 @@ async def create_branch(branch: BranchCreate, current_user: dict = Depends(get_a
     doc = branch_obj.model_dump()
     doc['createdAt'] = doc['createdAt'].isoformat()
     await db.branches.insert_one(doc)
+    await bump_collection_version("branches")
     return branch_obj
 
 @api_router.get("/branches", response_model=List[Branch])
-async def get_branches(current_user: dict = Depends(get_current_user)):
+async def get_branches(request: Request, response: Response, current_user: dict = Depends(get_current_user)):
+    stamp = await get_collection_version("branches")
+    if http_cache.is_not_modified(request, stamp):
+        return http_cache.not_modified(stamp)
     branches = await db.branches.find({"isActive": True}, {"_id": 0}).to_list(1000)
     for branch in branches:
         if isinstance(branch['createdAt'], str):
             branch['createdAt'] = datetime.fromisoformat(branch['createdAt'])
+    response.headers.update(http_cache.validators(stamp))
     return branches
 
 @api_router.get("/branches/{branch_id}", response_model=Branch)
@@ -315,14 +731,19 @@ async def create_employee(employee: EmployeeCreate, current_user: dict = Depends
     doc['password'] = employee_dict["password"]
     doc['createdAt'] = doc['createdAt'].isoformat()
     await db.employees.insert_one(doc)
+    await bump_collection_version("employees")
     return employee_obj
 
 @api_router.get("/employees", response_model=List[Employee])
-async def get_employees(current_user: dict = Depends(get_admin_user)):
+async def get_employees(request: Request, response: Response, current_user: dict = Depends(get_admin_user)):
+    stamp = await get_collection_version("employees")
+    if http_cache.is_not_modified(request, stamp):
+        return http_cache.not_modified(stamp)
     employees = await db.employees.find({"isActive": True}, {"_id": 0, "password": 0}).to_list(1000)
     for emp in employees:
         if isinstance(emp['createdAt'], str):
             emp['createdAt'] = datetime.fromisoformat(emp['createdAt'])
+    response.headers.update(http_cache.validators(stamp))
     return employees
 
 # Customer Routes
@@ -350,12 +771,67 @@ async def search_customer(phone: str, current_user: dict = Depends(get_current_u
     return customer
 
 @api_router.get("/customers/{customer_id}/bills")
-async def get_customer_bills(customer_id: str, current_user: dict = Depends(get_current_user)):
-    bills = await db.bills.find({"customerId": customer_id}, {"_id": 0}).to_list(1000)
-    for bill in bills:
-        if isinstance(bill['createdAt'], str):
-            bill['createdAt'] = datetime.fromisoformat(bill['createdAt'])
-    return bills
+async def get_customer_bills(
+    customer_id: str,
+    current_user: dict = Depends(get_current_user),
+    cursor: Optional[str] = None,
+    limit: int = 20,
+    view: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    """Newest-first purchase history across hot and archived bills"""
+    limit = min(max(limit, 1), CUSTOMER_BILLS_PAGE_LIMIT)
+    selected = select_fields(BILL_FIELDS, view, fields)
+    projection = BILL_FIELDS.projection(selected, also=("createdAt",))
+    query = {"customerId": customer_id}
+    if cursor:
+        query = after_cursor(query, cursor)
+    # Archived bills are older than hot ones except for stragglers held back
+    # for commission accrual, so both sides are read and merged
+    bills = await db.bills.find(query, projection).sort([("createdAt", -1), ("id", -1)]).limit(limit + 1).to_list(None)
+    bills += await bill_archive.customer_bills(query, limit + 1, projection)
+    bills.sort(key=lambda bill: (bill["createdAt"], bill["id"]), reverse=True)
+    next_cursor = encode_cursor(bills[limit - 1]) if len(bills) > limit else None
+    bills = bills[:limit]
+    if selected is not None:
+        adapter = BILL_FIELDS.adapter(selected)
+        bills = adapter.dump_python(adapter.validate_python(bills), mode="json")
+    return {"bills": bills, "nextCursor": next_cursor}
+
+def loyalty_points(amount: float) -> float:
+    return round(amount * LOYALTY_POINTS_PER_UNIT, 2)
+
+async def record_customer_visit(bill: dict) -> None:
+    """Fold a sale or return bill into its customer's lifetime stats"""
+    update = {"$inc": {"lifetimeValue": bill["totalAmount"], "loyaltyPoints": loyalty_points(bill["totalAmount"])}}
+    if not bill.get("relatedBillId"):
+        update["$inc"]["visitCount"] = 1
+        update["$max"] = {"lastVisit": bill["createdAt"]}
+    await db.customers.update_one({"id": bill["customerId"]}, update)
+
+async def rebuild_customer_stats() -> int:
+    """Recompute every customer's lifetime stats from hot and archived bills; returns customers with bills"""
+    stats: Dict[str, dict] = {}
+    sources = [db.bills] + [db[archive.collection_name(month)] for month in await bill_archive.months()]
+    for collection in sources:
+        async for bill in collection.find({}, {"_id": 0, "customerId": 1, "totalAmount": 1, "relatedBillId": 1, "createdAt": 1}):
+            entry = stats.setdefault(bill["customerId"], {"lifetimeValue": 0, "loyaltyPoints": 0, "visitCount": 0, "lastVisit": None})
+            entry["lifetimeValue"] += bill["totalAmount"]
+            entry["loyaltyPoints"] += loyalty_points(bill["totalAmount"])
+            if not bill.get("relatedBillId"):
+                entry["visitCount"] += 1
+                entry["lastVisit"] = max(entry["lastVisit"] or "", bill["createdAt"])
+    customer_ids = list(stats)
+    for start in range(0, len(customer_ids), 1000):
+        await db.customers.bulk_write([
+            UpdateOne({"id": customer_id}, {"$set": stats[customer_id]}) for customer_id in customer_ids[start:start + 1000]
+        ], ordered=False)
+    # Customers without a single bill
+    await db.customers.update_many(
+        {"visitCount": {"$exists": False}},
+        {"$set": {"lifetimeValue": 0, "loyaltyPoints": 0, "visitCount": 0, "lastVisit": None}}
+    )
+    return len(customer_ids)
 
 # Product Routes
 @api_router.post("/products", response_model=Product)
@@ -363,130 +839,241 @@ async def create_product(product: ProductCreate, current_user: dict = Depends(ge
     product_obj = Product(**product.model_dump())
     doc = product_obj.model_dump()
     doc['createdAt'] = doc['createdAt'].isoformat()
+    doc['rev'] = await next_catalog_revision()
+    for variant in doc['variants']:
+        variant['rev'] = doc['rev']
+    stock = split_variant_stock(doc)
     await db.products.insert_one(doc)
+    await set_stock_levels(doc["id"], stock, doc['rev'], current_user["id"])
+    await bump_collection_version("products")
+    await bump_collection_version("inventory")
+    await bump_collection_version(barcodes.COLLECTION)
     return product_obj
 
 @api_router.get("/products", response_model=List[Product])
-async def get_products(current_user: dict = Depends(get_current_user)):
-    products = await db.products.find({}, {"_id": 0}).to_list(1000)
+async def get_products(
+    request: Request,
+    current_user: dict = Depends(get_current_user),
+    branch_id: Optional[str] = None,
+    view: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    branch_scope = stock_scope(current_user, branch_id)
+    selected = select_fields(PRODUCT_FIELDS, view, fields)
+    etag_scope = branch_scope or "all"
+    if selected is not None:
+        etag_scope += ":" + fieldsets.Fieldset.label(selected)
+    stamp = await get_collection_version("products")
+    if selected is None or "variants" in selected:
+        # Stock levels ride along with the variants; sales only bump the inventory stamp
+        stamp = http_cache.combined(stamp, await get_collection_version("inventory"))
+    if http_cache.is_not_modified(request, stamp, etag_scope):
+        return http_cache.not_modified(stamp, etag_scope)
+
+    async def render() -> bytes:
+        products = await db.products.find({}, PRODUCT_FIELDS.projection(selected)).to_list(1000)
+        if selected is None or "variants" in selected:
+            await attach_stock(products, branch_scope)
+        adapter = PRODUCT_LIST if selected is None else PRODUCT_FIELDS.adapter(selected)
+        return adapter.dump_json(adapter.validate_python(products))
+
+    # Terminals opening together share one scan; the stamp keeps later writes out of it
+    body = await coalescing.flights.run("products", (etag_scope, stamp.get("version", 0)), render)
+    return Response(body, media_type="application/json", headers=http_cache.validators(stamp, etag_scope))
+
+@api_router.get("/products/changes")
+async def get_product_changes(
+    since: int = 0,
+    current_user: dict = Depends(get_current_user),
+    branch_id: Optional[str] = None
+):
+    """Products and stock entries changed after revision `since`.
+
+    Products carry only their changed variants; `stock` lists changed
+    (sku, branchId) quantities within the caller's stock scope. Clients keep
+    the returned `revision` and pass it back as `since`. A full catalog is
+    returned when `since` is 0.
+    """
+    branch_scope = stock_scope(current_user, branch_id)
+    counter = await db.counters.find_one({"id": "revision:products"}, {"_id": 0})
+    revision = counter["seq"] if counter else 0
+    stock_query = {"branchId": branch_scope} if branch_scope else {}
+    stock_projection = {"_id": 0, "sku": 1, "branchId": 1, "quantity": 1, "rev": 1}
+    if since <= 0:
+        products = await db.products.find({}, {"_id": 0}).to_list(None)
+        stock = await db.inventory.find(stock_query, stock_projection).to_list(None)
+        return {"revision": revision, "full": True, "products": products, "stock": stock}
+    
+    floor = max(0, since - CATALOG_SYNC_OVERLAP)
+    products = await db.products.find({"rev": {"$gt": floor}}, {"_id": 0}).to_list(None)
     for product in products:
-        if isinstance(product['createdAt'], str):
-            product['createdAt'] = datetime.fromisoformat(product['createdAt'])
-    return products
+        product["variants"] = [v for v in product["variants"] if v.get("rev", 0) > floor]
+    stock = await db.inventory.find({**stock_query, "rev": {"$gt": floor}}, stock_projection).to_list(None)
+    return {"revision": revision, "full": False, "products": products, "stock": stock}
+
+@api_router.get("/products/scan/{barcode}")
+async def scan_barcode(barcode: str, current_user: dict = Depends(get_current_user), branch_id: Optional[str] = None):
+    """The scanned variant, its price and its stock in the caller's branch (all branches summed without one)"""
+    variant = await barcode_index.lookup(barcode)
+    if variant is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    branch_scope = stock_scope(current_user, branch_id)
+    if branch_scope:
+        level = await db.inventory.find_one({"sku": variant["sku"], "branchId": branch_scope}, {"_id": 0, "quantity": 1})
+        stock = level["quantity"] if level else 0
+    else:
+        stock = sum([level["quantity"] async for level in db.inventory.find({"sku": variant["sku"]}, {"_id": 0, "quantity": 1})])
+    return JSONResponse({**variant, "branchId": branch_scope, "stock": stock})
 
 @api_router.get("/products/search/barcode/{code}")
-async def search_by_barcode(code: str, current_user: dict = Depends(get_current_user)):
-    product = await db.products.find_one({"variants.barcode": code}, {"_id": 0})
+async def search_by_barcode(
+    code: str,
+    current_user: dict = Depends(get_current_user),
+    branch_id: Optional[str] = None,
+    view: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    selected = select_fields(PRODUCT_FIELDS, view, fields)
+    product = await db.products.find_one({"variants.barcode": code}, PRODUCT_FIELDS.projection(selected))
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    if isinstance(product['createdAt'], str):
-        product['createdAt'] = datetime.fromisoformat(product['createdAt'])
-    return product
+    return await render_product(product, selected, stock_scope(current_user, branch_id))
 
 @api_router.get("/products/{product_id}", response_model=Product)
-async def get_product(product_id: str, current_user: dict = Depends(get_current_user)):
-    product = await db.products.find_one({"id": product_id}, {"_id": 0})
+async def get_product(
+    product_id: str,
+    current_user: dict = Depends(get_current_user),
+    branch_id: Optional[str] = None,
+    view: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    selected = select_fields(PRODUCT_FIELDS, view, fields)
+    product = await db.products.find_one({"id": product_id}, PRODUCT_FIELDS.projection(selected))
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
+    return await render_product(product, selected, stock_scope(current_user, branch_id))
+
+async def render_product(product: dict, selected: Optional[tuple], branch_scope: Optional[str]):
+    """A looked-up product with its stock, trimmed to the selected fields"""
+    if selected is None or "variants" in selected:
+        await attach_stock([product], branch_scope)
+    if selected is not None:
+        return Response(PRODUCT_FIELDS.response_model(selected).model_validate(product).model_dump_json(), media_type="application/json")
     if isinstance(product['createdAt'], str):
         product['createdAt'] = datetime.fromisoformat(product['createdAt'])
     return product
 
 @api_router.put("/products/{product_id}")
 async def update_product(product_id: str, product: ProductCreate, current_user: dict = Depends(get_admin_user)):
+    rev = await next_catalog_revision()
+    update = product.model_dump()
+    update["rev"] = rev
+    for variant in update["variants"]:
+        variant["rev"] = rev
+    stock = split_variant_stock(update)
     result = await db.products.update_one(
         {"id": product_id},
-        {"$set": product.model_dump()}
+        {"$set": update}
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
+    await set_stock_levels(product_id, stock, rev, current_user["id"])
+    await bump_collection_version("products")
+    await bump_collection_version("inventory")
+    await bump_collection_version(barcodes.COLLECTION)
     return {"message": "Product updated successfully"}
 
 # Inventory Routes
 @api_router.post("/inventory/stock-in")
 async def stock_in(request: StockInRequest, current_user: dict = Depends(get_admin_user)):
-    product = await db.products.find_one({"variants.sku": request.sku}, {"_id": 0})
+    product = await db.products.find_one({"variants.sku": request.sku}, {"_id": 0, "id": 1})
     if not product:
         raise HTTPException(status_code=404, detail="Product variant not found")
     
-    for i, variant in enumerate(product["variants"]):
-        if variant["sku"] == request.sku:
-            stock_found = False
-            for j, stock_entry in enumerate(variant["stock"]):
-                if stock_entry["branchId"] == request.branchId:
-                    variant["stock"][j]["quantity"] += request.quantity
-                    stock_found = True
-                    break
-            
-            if not stock_found:
-                variant["stock"].append({"branchId": request.branchId, "quantity": request.quantity})
-            
-            await db.products.update_one(
-                {"id": product["id"]},
-                {"$set": {f"variants.{i}": variant}}
-            )
-            return {"message": "Stock added successfully", "newQuantity": sum(s["quantity"] for s in variant["stock"])}
+    now = datetime.now(timezone.utc).isoformat()
+    await db.inventory.update_one(
+        {"sku": request.sku, "branchId": request.branchId},
+        {
+            "$inc": {"quantity": request.quantity},
+            "$set": {"productId": product["id"], "rev": await next_catalog_revision(), "updatedAt": now}
+        },
+        upsert=True
+    )
+    await bump_collection_version("inventory")
+    await movement_ledger.record([stock_movements.movement(
+        "stock_in", request.sku, request.branchId, request.quantity, current_user["id"], product["id"], created_at=now
+    )])
     
-    raise HTTPException(status_code=404, detail="Variant not found")
+    levels = await db.inventory.find({"sku": request.sku}, {"_id": 0, "quantity": 1}).to_list(None)
+    return {"message": "Stock added successfully", "newQuantity": sum(s["quantity"] for s in levels)}
 
 @api_router.post("/inventory/transfer")
 async def transfer_stock(request: StockTransferRequest, current_user: dict = Depends(get_admin_user)):
-    product = await db.products.find_one({"variants.sku": request.sku}, {"_id": 0})
+    product = await db.products.find_one({"variants.sku": request.sku}, {"_id": 0, "id": 1})
     if not product:
         raise HTTPException(status_code=404, detail="Product variant not found")
     
-    for i, variant in enumerate(product["variants"]):
-        if variant["sku"] == request.sku:
-            from_stock_idx = None
-            to_stock_idx = None
-            
-            for j, stock_entry in enumerate(variant["stock"]):
-                if stock_entry["branchId"] == request.fromBranchId:
-                    from_stock_idx = j
-                if stock_entry["branchId"] == request.toBranchId:
-                    to_stock_idx = j
-            
-            if from_stock_idx is None:
-                raise HTTPException(status_code=400, detail="Source branch has no stock")
-            
-            if variant["stock"][from_stock_idx]["quantity"] < request.quantity:
-                raise HTTPException(status_code=400, detail="Insufficient stock at source branch")
-            
-            variant["stock"][from_stock_idx]["quantity"] -= request.quantity
-            
-            if to_stock_idx is not None:
-                variant["stock"][to_stock_idx]["quantity"] += request.quantity
-            else:
-                variant["stock"].append({"branchId": request.toBranchId, "quantity": request.quantity})
-            
-            await db.products.update_one(
-                {"id": product["id"]},
-                {"$set": {f"variants.{i}": variant}}
-            )
-            
-            # Log transfer
-            await db.stock_transfers.insert_one({
-                "id": str(uuid.uuid4()),
-                "sku": request.sku,
-                "fromBranchId": request.fromBranchId,
-                "toBranchId": request.toBranchId,
-                "quantity": request.quantity,
-                "transferredBy": current_user["id"],
-                "createdAt": datetime.now(timezone.utc).isoformat()
-            })
-            
-            return {"message": "Stock transferred successfully"}
+    rev = await next_catalog_revision()
+    now = datetime.now(timezone.utc).isoformat()
+    # Conditional decrement so concurrent sales and transfers cannot drive stock negative
+    result = await db.inventory.update_one(
+        {"sku": request.sku, "branchId": request.fromBranchId, "quantity": {"$gte": request.quantity}},
+        {"$inc": {"quantity": -request.quantity}, "$set": {"rev": rev, "updatedAt": now}}
+    )
+    if result.matched_count == 0:
+        source = await db.inventory.find_one({"sku": request.sku, "branchId": request.fromBranchId}, {"_id": 0})
+        if source is None:
+            raise HTTPException(status_code=400, detail="Source branch has no stock")
+        raise HTTPException(status_code=400, detail="Insufficient stock at source branch")
     
-    raise HTTPException(status_code=404, detail="Variant not found")
+    await db.inventory.update_one(
+        {"sku": request.sku, "branchId": request.toBranchId},
+        {"$inc": {"quantity": request.quantity}, "$set": {"productId": product["id"], "rev": rev, "updatedAt": now}},
+        upsert=True
+    )
+    await bump_collection_version("inventory")
+    
+    # Log transfer
+    transfer_id = str(uuid.uuid4())
+    await db.stock_transfers.insert_one({
+        "id": transfer_id,
+        "sku": request.sku,
+        "fromBranchId": request.fromBranchId,
+        "toBranchId": request.toBranchId,
+        "quantity": request.quantity,
+        "transferredBy": current_user["id"],
+        "createdAt": now
+    })
+    await movement_ledger.record([
+        stock_movements.movement("transfer_out", request.sku, request.fromBranchId, -request.quantity,
+                                 current_user["id"], product["id"], transfer_id, now),
+        stock_movements.movement("transfer_in", request.sku, request.toBranchId, request.quantity,
+                                 current_user["id"], product["id"], transfer_id, now),
+    ])
+    
+    return {"message": "Stock transferred successfully", "transferId": transfer_id}
 
 @api_router.get("/inventory/low-stock")
 async def get_low_stock(current_user: dict = Depends(get_admin_user), threshold: int = 10):
-    products = await db.products.find({}, {"_id": 0}).to_list(1000)
+    # Names come from the catalog, quantities from inventory
+    catalog = await get_collection_version("products")
+    stock = await get_collection_version("inventory")
+    key = (threshold, catalog.get("version", 0), stock.get("version", 0))
+    return await coalesced_json("low_stock", key, lambda: compute_low_stock(threshold))
+
+async def compute_low_stock(threshold: int) -> List[dict]:
+    totals = {
+        row["_id"]: row["quantity"]
+        for row in await db.inventory.aggregate([
+            {"$group": {"_id": "$sku", "quantity": {"$sum": "$quantity"}}}
+        ]).to_list(None)
+    }
+    products = await db.products.find({}, {"_id": 0, "id": 1, "name": 1, "variants": 1}).to_list(1000)
     low_stock_items = []
     
     for product in products:
         for variant in product["variants"]:
-            total_stock = sum(s["quantity"] for s in variant["stock"])
+            total_stock = totals.get(variant["sku"], 0)
             if total_stock < threshold:
                 low_stock_items.append({
                     "productId": product["id"],
@@ -499,6 +1086,72 @@ async def get_low_stock(current_user: dict = Depends(get_admin_user), threshold:
     
     return low_stock_items
 
+def movement_query(**filters) -> dict:
+    try:
+        return stock_movements.filters(**filters)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+async def movement_page(collection: str, query: dict, cursor: Optional[str], limit: int) -> dict:
+    limit = min(max(limit, 1), MOVEMENT_PAGE_LIMIT)
+    page = await movement_ledger.page(collection, after_cursor(query, cursor) if cursor else query, limit)
+    return {"items": page[:limit], "nextCursor": encode_cursor(page[limit - 1]) if len(page) > limit else None}
+
+@api_router.get("/inventory/movements")
+async def get_stock_movements(
+    current_user: dict = Depends(get_admin_user),
+    sku: Optional[str] = None,
+    branch_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+    movement_type: Optional[str] = Query(None, alias="type"),
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 50
+):
+    """Stock changes newest first; quantities are negative for stock leaving the branch"""
+    query = movement_query(sku=sku, branch_id=branch_id, user_id=user_id, kind=movement_type,
+                           start_date=start_date, end_date=end_date)
+    page = await movement_page("stock_movements", query, cursor, limit)
+    return {"movements": page["items"], "nextCursor": page["nextCursor"]}
+
+@api_router.get("/inventory/movements/net")
+async def get_net_stock_movements(
+    current_user: dict = Depends(get_admin_user),
+    group_by: str = "branch",
+    sku: Optional[str] = None,
+    branch_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+    movement_type: Optional[str] = Query(None, alias="type"),
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None
+):
+    """Inbound, outbound and net quantity per branch, or per branch and SKU with group_by=sku"""
+    query = movement_query(sku=sku, branch_id=branch_id, user_id=user_id, kind=movement_type,
+                           start_date=start_date, end_date=end_date)
+    try:
+        rows = await movement_ledger.net(query, group_by)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    return {"groupBy": group_by, "rows": rows}
+
+@api_router.get("/inventory/transfers")
+async def get_stock_transfers(
+    current_user: dict = Depends(get_admin_user),
+    sku: Optional[str] = None,
+    branch_id: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 50
+):
+    """Transfers newest first; a branch matches as either source or destination"""
+    query = movement_query(sku=sku, start_date=start_date, end_date=end_date)
+    if branch_id:
+        query["$or"] = [{"fromBranchId": branch_id}, {"toBranchId": branch_id}]
+    page = await movement_page("stock_transfers", query, cursor, limit)
+    return {"transfers": page["items"], "nextCursor": page["nextCursor"]}
+
 # Billing Routes
 @api_router.post("/billing", response_model=Bill)
 async def create_bill(bill_request: BillCreate, current_user: dict = Depends(get_current_user)):
@@ -511,22 +1164,27 @@ async def create_bill(bill_request: BillCreate, current_user: dict = Depends(get
         await db.customers.insert_one(customer_doc)
         customer = customer_doc
     
+    # Load every product and the branch's stock for the requested SKUs in two queries
+    branch_id = current_user["branchId"]
+    skus = list({item["sku"] for item in bill_request.items})
+    products = await db.products.find({"variants.sku": {"$in": skus}}, {"_id": 0}).to_list(None)
+    variants = {v["sku"]: (product, v) for product in products for v in product["variants"] if v["sku"] in skus}
+    levels = await db.inventory.find({"sku": {"$in": skus}, "branchId": branch_id}, {"_id": 0}).to_list(None)
+    available = {level["sku"]: level["quantity"] for level in levels}
+    
     # Process items and calculate totals
     bill_items = []
     subtotal = 0
+    requested = {}
     
     for item in bill_request.items:
-        product = await db.products.find_one({"variants.sku": item["sku"]}, {"_id": 0})
-        if not product:
+        if item["sku"] not in variants:
             raise HTTPException(status_code=404, detail=f"Product with SKU {item['sku']} not found")
-        
-        variant = next((v for v in product["variants"] if v["sku"] == item["sku"]), None)
-        if not variant:
-            raise HTTPException(status_code=404, detail=f"Variant {item['sku']} not found")
+        product, variant = variants[item["sku"]]
         
         # Check stock
-        stock_entry = next((s for s in variant["stock"] if s["branchId"] == current_user["branchId"]), None)
-        if not stock_entry or stock_entry["quantity"] < item["quantity"]:
+        requested[item["sku"]] = requested.get(item["sku"], 0) + item["quantity"]
+        if available.get(item["sku"], 0) < requested[item["sku"]]:
             raise HTTPException(status_code=400, detail=f"Insufficient stock for {product['name']}")
         
         line_total = variant["price"] * item["quantity"]
@@ -538,60 +1196,62 @@ async def create_bill(bill_request: BillCreate, current_user: dict = Depends(get
             productName=f"{product['name']} ({variant.get('color', '')}, {variant.get('size', '')})",
             quantity=item["quantity"],
             unitPrice=variant["price"],
-            lineTotal=line_total
+            lineTotal=line_total,
+            category=product["category"]
         ))
     
+    # Update inventory, undoing earlier decrements if a concurrent sale took the stock first
+    rev = await next_catalog_revision()
+    now = datetime.now(timezone.utc).isoformat()
+    decremented = []
+    for sku, quantity in requested.items():
+        result = await db.inventory.update_one(
+            {"sku": sku, "branchId": branch_id, "quantity": {"$gte": quantity}},
+            {"$inc": {"quantity": -quantity}, "$set": {"rev": rev, "updatedAt": now}}
+        )
+        if result.matched_count == 0:
+            if decremented:
+                await db.inventory.bulk_write([
+                    UpdateOne({"sku": done, "branchId": branch_id}, {"$inc": {"quantity": requested[done]}})
+                    for done in decremented
+                ], ordered=False)
+            raise HTTPException(status_code=400, detail=f"Insufficient stock for {variants[sku][0]['name']}")
+        decremented.append(sku)
+    await bump_collection_version("inventory")
+    
     # Generate bill number
-    bill_count = await db.bills.count_documents({"branchId": current_user["branchId"]})
-    bill_number = f"BR-{current_user['branchId'][:4]}-{str(bill_count + 1).zfill(5)}"
+    bill_sequence = await next_bill_sequence(branch_id)
+    bill_number = f"BR-{branch_id[:4]}-{str(bill_sequence).zfill(5)}"
     
     # Create bill
     total_amount = subtotal - bill_request.discount
     bill_obj = Bill(
         billNumber=bill_number,
-        branchId=current_user["branchId"],
+        branchId=branch_id,
         employeeId=current_user["id"],
         customerId=customer["id"],
         items=[item.model_dump() for item in bill_items],
         subtotal=subtotal,
         discountAmount=bill_request.discount,
         totalAmount=total_amount,
-        paymentMethod=bill_request.paymentMethod
+        paymentMethod=bill_request.paymentMethod,
+        commissionRate=current_user.get("commissionRate", 0.05)
     )
     
     bill_doc = bill_obj.model_dump()
     bill_doc['createdAt'] = bill_doc['createdAt'].isoformat()
     
-    # Update inventory
-    for item in bill_request.items:
-        product = await db.products.find_one({"variants.sku": item["sku"]}, {"_id": 0})
-        for i, variant in enumerate(product["variants"]):
-            if variant["sku"] == item["sku"]:
-                for j, stock_entry in enumerate(variant["stock"]):
-                    if stock_entry["branchId"] == current_user["branchId"]:
-                        product["variants"][i]["stock"][j]["quantity"] -= item["quantity"]
-                        await db.products.update_one(
-                            {"id": product["id"]},
-                            {"$set": {f"variants.{i}.stock.{j}.quantity": product["variants"][i]["stock"][j]["quantity"]}}
-                        )
-                        break
-    
-    # Create commission
-    employee = await db.employees.find_one({"id": current_user["id"]}, {"_id": 0})
-    commission_amount = total_amount * employee.get("commissionRate", 0.05)
-    commission_obj = Commission(
-        employeeId=current_user["id"],
-        billId=bill_obj.id,
-        saleAmount=total_amount,
-        commissionRate=employee.get("commissionRate", 0.05),
-        commissionAmount=commission_amount
-    )
-    commission_doc = commission_obj.model_dump()
-    commission_doc['createdAt'] = commission_doc['createdAt'].isoformat()
-    await db.commissions.insert_one(commission_doc)
-    
-    # Save bill
+    # Save bill; its commission and sales counters are recorded in the background
     await db.bills.insert_one(bill_doc)
+    await movement_ledger.record(
+        stock_movements.movement("sale", item["variantSku"], branch_id, -item["quantity"], current_user["id"],
+                                 item["productId"], bill_doc["id"], bill_doc["createdAt"])
+        for item in bill_doc["items"]
+    )
+    commission_pipeline.submit(bill_doc)
+    sales_counters.submit(bill_doc)
+    await record_customer_visit(bill_doc)
+    await bump_collection_version("bills", report_cache.bill_change(bill_doc))
     
     # Send SMS notification
     branch = await db.branches.find_one({"id": current_user["branchId"]}, {"_id": 0})
@@ -602,11 +1262,13 @@ async def create_bill(bill_request: BillCreate, current_user: dict = Depends(get
     return bill_obj
 
 @api_router.get("/billing")
-async def get_bills(current_user: dict = Depends(get_current_user)):
-    if current_user["role"] == "admin":
-        bills = await db.bills.find({}, {"_id": 0}).to_list(1000)
-    else:
-        bills = await db.bills.find({"employeeId": current_user["id"]}, {"_id": 0}).to_list(1000)
+async def get_bills(current_user: dict = Depends(get_current_user), view: Optional[str] = None, fields: Optional[str] = None):
+    selected = select_fields(BILL_FIELDS, view, fields)
+    query = {} if current_user["role"] == "admin" else {"employeeId": current_user["id"]}
+    bills = await db.bills.find(query, BILL_FIELDS.projection(selected)).to_list(1000)
+    if selected is not None:
+        adapter = BILL_FIELDS.adapter(selected)
+        return Response(adapter.dump_json(adapter.validate_python(bills)), media_type="application/json")
     
     for bill in bills:
         if isinstance(bill['createdAt'], str):
@@ -615,61 +1277,123 @@ async def get_bills(current_user: dict = Depends(get_current_user)):
 
 @api_router.get("/billing/{bill_id}")
 async def get_bill(bill_id: str, current_user: dict = Depends(get_current_user)):
-    bill = await db.bills.find_one({"id": bill_id}, {"_id": 0})
+    bill = await db.bills.find_one({"id": bill_id}, {"_id": 0}) or await bill_archive.get_bill(bill_id)
     if not bill:
         raise HTTPException(status_code=404, detail="Bill not found")
     if isinstance(bill['createdAt'], str):
         bill['createdAt'] = datetime.fromisoformat(bill['createdAt'])
     return bill
 
+def returned_quantities(bill: dict) -> Dict[str, int]:
+    """Quantities already returned per SKU; bills returned before the list form keep a {sku: quantity} map"""
+    returned = bill.get("returnedQuantities") or []
+    if isinstance(returned, dict):
+        return dict(returned)
+    return {entry["sku"]: entry["quantity"] for entry in returned}
+
+def allocate_return(lines: List[dict], already_returned: int, quantity: int) -> List[tuple]:
+    """Split `quantity` returned units of one SKU over its bill lines in order, after the units returned before"""
+    allocated = []
+    for line in lines:
+        available = max(0, line["quantity"] - already_returned)
+        already_returned = max(0, already_returned - line["quantity"])
+        taken = min(available, quantity)
+        if taken:
+            allocated.append((line, taken))
+            quantity -= taken
+        if not quantity:
+            break
+    return allocated
+
 @api_router.post("/billing/return")
 async def process_return(return_request: ReturnRequest, current_user: dict = Depends(get_current_user)):
     # Get original bill
     original_bill = await db.bills.find_one({"id": return_request.originalBillId}, {"_id": 0})
+    archived = original_bill is None
+    if archived:
+        original_bill = await bill_archive.get_bill(return_request.originalBillId)
     if not original_bill:
         raise HTTPException(status_code=404, detail="Original bill not found")
     
     if original_bill["status"] == "returned":
         raise HTTPException(status_code=400, detail="Bill already returned")
     
+    # Group the original bill's lines by SKU (a cart may hold the same SKU twice) and merge repeated SKUs in the request
+    original_lines: Dict[str, List[dict]] = {}
+    for item in original_bill["items"]:
+        original_lines.setdefault(item["variantSku"], []).append(item)
+    already_returned = returned_quantities(original_bill)
+    requested = {}
+    for return_item in return_request.items:
+        requested[return_item["sku"]] = requested.get(return_item["sku"], 0) + return_item["quantity"]
+    
     # Process return items
     return_items = []
     return_total = 0
     
-    for return_item in return_request.items:
-        # Find item in original bill
-        original_item = next((item for item in original_bill["items"] if item["variantSku"] == return_item["sku"]), None)
-        if not original_item:
-            raise HTTPException(status_code=404, detail=f"Item {return_item['sku']} not found in original bill")
+    for sku, quantity in requested.items():
+        lines = original_lines.get(sku)
+        if not lines:
+            raise HTTPException(status_code=404, detail=f"Item {sku} not found in original bill")
         
-        if return_item["quantity"] > original_item["quantity"]:
-            raise HTTPException(status_code=400, detail=f"Return quantity exceeds original quantity for {return_item['sku']}")
+        if quantity <= 0:
+            raise HTTPException(status_code=400, detail=f"Return quantity must be positive for {sku}")
         
-        return_total += original_item["unitPrice"] * return_item["quantity"]
-        return_items.append({
-            "variantSku": return_item["sku"],
-            "productName": original_item["productName"],
-            "quantity": return_item["quantity"],
-            "unitPrice": original_item["unitPrice"],
-            "lineTotal": original_item["unitPrice"] * return_item["quantity"]
-        })
+        if quantity + already_returned.get(sku, 0) > sum(line["quantity"] for line in lines):
+            raise HTTPException(status_code=400, detail=f"Return quantity exceeds original quantity for {sku}")
         
-        # Restore inventory
-        product = await db.products.find_one({"variants.sku": return_item["sku"]}, {"_id": 0})
-        for i, variant in enumerate(product["variants"]):
-            if variant["sku"] == return_item["sku"]:
-                for j, stock_entry in enumerate(variant["stock"]):
-                    if stock_entry["branchId"] == original_bill["branchId"]:
-                        product["variants"][i]["stock"][j]["quantity"] += return_item["quantity"]
-                        await db.products.update_one(
-                            {"id": product["id"]},
-                            {"$set": {f"variants.{i}.stock.{j}.quantity": product["variants"][i]["stock"][j]["quantity"]}}
-                        )
-                        break
+        # Refund each unit at the price of the line it was sold on
+        for line, line_quantity in allocate_return(lines, already_returned.get(sku, 0), quantity):
+            line_total = line["unitPrice"] * line_quantity
+            return_total += line_total
+            return_items.append({
+                "productId": line["productId"],
+                "variantSku": sku,
+                "productName": line["productName"],
+                "quantity": line_quantity,
+                "unitPrice": line["unitPrice"],
+                "lineTotal": line_total,
+                "category": line.get("category")
+            })
+    
+    # Record returned quantities on the original bill first, conditional on the
+    # values read above, so two concurrent returns cannot both pass the check
+    returned_after = {sku: already_returned.get(sku, 0) + requested.get(sku, 0) for sku in original_lines}
+    full_return = all(returned_after[sku] >= sum(line["quantity"] for line in lines) for sku, lines in original_lines.items())
+    original_filter = {
+        "status": original_bill["status"],
+        "returnedQuantities": original_bill.get("returnedQuantities")
+    }
+    original_update = {"$set": {
+        "status": "returned" if full_return else "partial-return",
+        "returnedQuantities": [{"sku": sku, "quantity": quantity} for sku, quantity in returned_after.items() if quantity]
+    }}
+    if archived:
+        claimed = await bill_archive.update_bill(return_request.originalBillId, original_update, original_filter)
+    else:
+        claimed = (await db.bills.update_one({"id": return_request.originalBillId, **original_filter}, original_update)).matched_count
+    if not claimed:
+        raise HTTPException(status_code=409, detail="Bill was changed by another return, please retry")
+    
+    # Restore inventory in a single round trip
+    rev = await next_catalog_revision()
+    now = datetime.now(timezone.utc).isoformat()
+    await db.inventory.bulk_write([
+        UpdateOne(
+            {"sku": sku, "branchId": original_bill["branchId"]},
+            {
+                "$inc": {"quantity": quantity},
+                "$set": {"productId": original_lines[sku][0]["productId"], "rev": rev, "updatedAt": now}
+            },
+            upsert=True
+        )
+        for sku, quantity in requested.items()
+    ], ordered=False)
+    await bump_collection_version("inventory")
     
     # Create return bill
-    bill_count = await db.bills.count_documents({"branchId": original_bill["branchId"]})
-    return_bill_number = f"RET-{original_bill['branchId'][:4]}-{str(bill_count + 1).zfill(5)}"
+    bill_sequence = await next_bill_sequence(original_bill["branchId"])
+    return_bill_number = f"RET-{original_bill['branchId'][:4]}-{str(bill_sequence).zfill(5)}"
     
     return_bill = {
         "id": str(uuid.uuid4()),
@@ -685,69 +1409,190 @@ async def process_return(return_request: ReturnRequest, current_user: dict = Dep
         "status": "returned",
         "relatedBillId": return_request.originalBillId,
         "returnReason": return_request.reason,
+        "countersRecorded": False,
         "createdAt": datetime.now(timezone.utc).isoformat()
     }
     
-    await db.bills.insert_one(return_bill)
-    
-    # Reverse commission
-    commission = await db.commissions.find_one({"billId": return_request.originalBillId}, {"_id": 0})
-    if commission:
-        reverse_commission_amount = (return_total / original_bill["totalAmount"]) * commission["commissionAmount"]
-        reverse_commission = {
-            "id": str(uuid.uuid4()),
-            "employeeId": original_bill["employeeId"],
-            "billId": return_bill["id"],
-            "saleAmount": -return_total,
-            "commissionRate": commission["commissionRate"],
-            "commissionAmount": -reverse_commission_amount,
-            "status": "pending",
-            "createdAt": datetime.now(timezone.utc).isoformat()
-        }
-        await db.commissions.insert_one(reverse_commission)
+    # Reverse the seller's commission at the original rate
+    commission_rate = original_bill.get("commissionRate")
+    if commission_rate is None:
+        # Bills from before rates were stored on the bill
+        commission = await db.commissions.find_one({"billId": return_request.originalBillId}, {"_id": 0, "commissionRate": 1})
+        commission_rate = commission["commissionRate"] if commission else 0
+    if original_bill["totalAmount"] and commission_rate:
+        return_bill["commissionRate"] = commission_rate
+        return_bill["commissionEmployeeId"] = original_bill["employeeId"]
+        return_bill["commissionAccrued"] = False
     
-    # Update original bill status
-    full_return = all(return_item["quantity"] == next(item["quantity"] for item in original_bill["items"] if item["variantSku"] == return_item["sku"]) for return_item in return_request.items)
-    status = "returned" if full_return else "partial-return"
-    await db.bills.update_one({"id": return_request.originalBillId}, {"$set": {"status": status}})
+    await db.bills.insert_one(return_bill)
+    await movement_ledger.record(
+        stock_movements.movement("return", item["variantSku"], return_bill["branchId"], item["quantity"], current_user["id"],
+                                 item["productId"], return_bill["id"], return_bill["createdAt"])
+        for item in return_items
+    )
+    if "commissionRate" in return_bill:
+        commission_pipeline.submit(return_bill)
+    sales_counters.submit(return_bill)
+    await record_customer_visit(return_bill)
+    await bump_collection_version("bills", report_cache.merge_changes(
+        [report_cache.bill_change(return_bill), report_cache.bill_change(original_bill)]
+    ))
     
     return {"message": "Return processed successfully", "returnBillId": return_bill["id"], "refundAmount": return_total}
 
 # Commission Routes
+def encode_cursor(doc: dict) -> str:
+    """Opaque keyset cursor for newest-first (createdAt, id) pagination"""
+    raw = json.dumps([doc["createdAt"], doc["id"]]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def after_cursor(query: dict, cursor: str) -> dict:
+    try:
+        created_at, doc_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"$and": [query, {"$or": [
+        {"createdAt": {"$lt": created_at}},
+        {"createdAt": created_at, "id": {"$lt": doc_id}}
+    ]}]}
+
+def commission_filters(
+    employee_id: Optional[str],
+    branch_id: Optional[str],
+    status: Optional[str],
+    start_date: Optional[str],
+    end_date: Optional[str]
+) -> dict:
+    query = {}
+    if employee_id:
+        query["employeeId"] = employee_id
+    if branch_id:
+        query["branchId"] = branch_id
+    if status:
+        query["status"] = status
+    if start_date or end_date:
+        query["createdAt"] = {}
+        if start_date:
+            query["createdAt"]["$gte"] = start_date
+        if end_date:
+            query["createdAt"]["$lte"] = end_date
+    return query
+
+async def commission_summary(query: dict) -> List[dict]:
+    """Pending and paid totals per employee for the commission rows matching `query`.
+
+    Without status or date filters the running balances already hold the
+    answer (a branch filter then selects employees by their current branch);
+    otherwise the matching rows are grouped through the indexes.
+    """
+    if "status" not in query and "createdAt" not in query:
+        rows = await db.commission_balances.find(query, {"_id": 0, "updatedAt": 0, "batches": 0}).sort("employeeId", 1).to_list(None)
+    else:
+        is_paid = {"$eq": ["$status", "paid"]}
+        rows = await db.commissions.aggregate([
+            {"$match": query},
+            {"$group": {
+                "_id": "$employeeId",
+                "branchId": {"$first": "$branchId"},
+                "pending": {"$sum": {"$cond": [is_paid, 0, "$commissionAmount"]}},
+                "paid": {"$sum": {"$cond": [is_paid, "$commissionAmount", 0]}},
+                "sales": {"$sum": "$saleAmount"},
+                "count": {"$sum": 1}
+            }},
+            {"$sort": {"_id": 1}}
+        ]).to_list(None)
+        for row in rows:
+            row["employeeId"] = row.pop("_id")
+    # Running sums of cent amounts still pick up float residue
+    for row in rows:
+        row["pending"], row["paid"], row["sales"] = (commissions.cents(row[key]) for key in ("pending", "paid", "sales"))
+    return rows
+
+async def list_commissions(query: dict, view: str, cursor: Optional[str], limit: int) -> dict:
+    if view not in ("list", "summary"):
+        raise HTTPException(status_code=400, detail="view must be 'list' or 'summary'")
+    employees = await commission_summary(query)
+    result = {
+        "pending": commissions.cents(sum(row["pending"] for row in employees)),
+        "paid": commissions.cents(sum(row["paid"] for row in employees))
+    }
+    if view == "summary":
+        names = {
+            employee["id"]: employee["fullName"]
+            for employee in await db.employees.find(
+                {"id": {"$in": [row["employeeId"] for row in employees]}}, {"_id": 0, "id": 1, "fullName": 1}
+            ).to_list(None)
+        }
+        for row in employees:
+            row["employeeName"] = names.get(row["employeeId"])
+        result["employees"] = employees
+        return result
+    
+    limit = min(max(limit, 1), COMMISSION_PAGE_LIMIT)
+    page_query = after_cursor(query, cursor) if cursor else query
+    page = await db.commissions.find(page_query, {"_id": 0, "balanced": 0}).sort([("createdAt", -1), ("id", -1)]).limit(limit + 1).to_list(None)
+    result["commissions"] = page[:limit]
+    result["nextCursor"] = encode_cursor(page[limit - 1]) if len(page) > limit else None
+    return result
+
 @api_router.get("/commissions/my")
-async def get_my_commissions(current_user: dict = Depends(get_current_user)):
-    commissions = await db.commissions.find({"employeeId": current_user["id"]}, {"_id": 0}).to_list(1000)
-    for comm in commissions:
-        if isinstance(comm['createdAt'], str):
-            comm['createdAt'] = datetime.fromisoformat(comm['createdAt'])
-    return commissions
+async def get_my_commissions(
+    current_user: dict = Depends(get_current_user),
+    status: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    view: str = "list",
+    cursor: Optional[str] = None,
+    limit: int = 50
+):
+    query = commission_filters(current_user["id"], None, status, start_date, end_date)
+    return await list_commissions(query, view, cursor, limit)
 
 @api_router.get("/commissions/all")
-async def get_all_commissions(current_user: dict = Depends(get_admin_user)):
-    commissions = await db.commissions.find({}, {"_id": 0}).to_list(1000)
-    for comm in commissions:
-        if isinstance(comm['createdAt'], str):
-            comm['createdAt'] = datetime.fromisoformat(comm['createdAt'])
-    return commissions
+async def get_all_commissions(
+    current_user: dict = Depends(get_admin_user),
+    status: Optional[str] = None,
+    employee_id: Optional[str] = None,
+    branch_id: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    view: str = "list",
+    cursor: Optional[str] = None,
+    limit: int = 50
+):
+    query = commission_filters(employee_id, branch_id, status, start_date, end_date)
+    return await list_commissions(query, view, cursor, limit)
 
 @api_router.post("/commissions/payout")
 async def payout_commissions(request: CommissionPayoutRequest, current_user: dict = Depends(get_admin_user)):
-    for comm_id in request.commissionIds:
-        await db.commissions.update_one(
-            {"id": comm_id},
-            {"$set": {"status": "paid", "paidAt": datetime.now(timezone.utc).isoformat()}}
-        )
+    # Tag the rows this payout claims so a concurrent payout cannot move them twice
+    payout_id = str(uuid.uuid4())
+    await db.commissions.update_many(
+        {"id": {"$in": request.commissionIds}, "status": "pending"},
+        {"$set": {"status": "paid", "paidAt": datetime.now(timezone.utc).isoformat(), "payoutId": payout_id}}
+    )
+    paid = await db.commissions.aggregate([
+        {"$match": {"payoutId": payout_id}},
+        {"$group": {"_id": "$employeeId", "amount": {"$sum": "$commissionAmount"}}}
+    ]).to_list(None)
+    if paid:
+        await db.commission_balances.bulk_write([
+            UpdateOne({"employeeId": row["_id"]}, {"$inc": {"pending": -commissions.cents(row["amount"]), "paid": commissions.cents(row["amount"])}})
+            for row in paid
+        ], ordered=False)
     return {"message": "Commissions marked as paid"}
 
 # Payment Routes
 @api_router.post("/payments/create-intent")
 async def create_payment_intent(request: PaymentIntentRequest, current_user: dict = Depends(get_current_user)):
     try:
-        intent = stripe.PaymentIntent.create(
-            amount=int(request.amount * 100),  # Convert to cents
-            currency=request.currency,
-            metadata={"employee_id": current_user["id"], "branch_id": current_user["branchId"]}
-        )
+        stripe = provider_registry.get("stripe")
+        with metrics.external_call("stripe", "PaymentIntent.create"):
+            intent = stripe.PaymentIntent.create(
+                amount=int(request.amount * 100),  # Convert to cents
+                currency=request.currency,
+                metadata={"employee_id": current_user["id"], "branch_id": current_user["branchId"]}
+            )
         return {"clientSecret": intent.client_secret, "paymentIntentId": intent.id}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -755,13 +1600,21 @@ async def create_payment_intent(request: PaymentIntentRequest, current_user: dic
 # Dashboard Routes
 @api_router.get("/dashboard/stats")
 async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
+    scope = ("admin",) if current_user["role"] == "admin" else ("employee", current_user["id"])
+    # The stamp keeps a request that follows a sale out of a computation started before it
+    stamp = await get_collection_version("bills")
+    return await coalesced_json("dashboard_stats", (*scope, stamp.get("version", 0)), lambda: compute_dashboard_stats(current_user))
+
+async def compute_dashboard_stats(current_user: dict) -> dict:
     if current_user["role"] == "admin":
-        bills = await db.bills.find({"status": {"$ne": "returned"}}, {"_id": 0}).to_list(10000)
+        bills = await analytics_db.bills.find({"status": {"$ne": "returned"}}, {"_id": 0}).to_list(10000)
+        archived = await bill_archive.sales_totals()
     else:
-        bills = await db.bills.find({"employeeId": current_user["id"], "status": {"$ne": "returned"}}, {"_id": 0}).to_list(10000)
+        bills = await analytics_db.bills.find({"employeeId": current_user["id"], "status": {"$ne": "returned"}}, {"_id": 0}).to_list(10000)
+        archived = await bill_archive.sales_totals(employee_id=current_user["id"])
     
-    total_sales = sum(bill["totalAmount"] for bill in bills)
-    total_transactions = len(bills)
+    total_sales = sum(bill["totalAmount"] for bill in bills) + archived["totalSales"]
+    total_transactions = len(bills) + archived["count"]
     avg_bill_value = total_sales / total_transactions if total_transactions > 0 else 0
     
     return {
@@ -778,6 +1631,29 @@ async def get_sales_report(
     branch_id: Optional[str] = None,
     employee_id: Optional[str] = None
 ):
+    if not employee_id and current_user["role"] != "admin":
+        employee_id = current_user["id"]
+    key = report_cache.report_key(start_date, end_date, branch_id, employee_id)
+    cached = sales_report_cache.get(key)
+    if cached is None:
+        version = sales_report_cache.version(key)
+        # Reports kept under the primary's stamp are rendered from the primary; a lagging
+        # secondary would pin a report missing its newest bills until the next change
+        primary = cache_bus.live
+        cached = await coalescing.flights.run(
+            "sales_report", (key, version, primary), lambda: render_sales_report(*key, primary=primary)
+        )
+        sales_report_cache.put(key, cached, version)
+    return Response(cached, media_type="application/json")
+
+async def render_sales_report(
+    start_date: Optional[str], end_date: Optional[str], branch_id: Optional[str], employee_id: Optional[str],
+    primary: bool = False
+) -> bytes:
+    """Sales report body; `primary` reads everything from the primary instead of the analytics secondary"""
+    source, archived_bills, counters = (
+        (db, report_archive, report_counters) if primary else (analytics_db, bill_archive, sales_counters)
+    )
     query = {"status": {"$ne": "returned"}}
     
     if start_date:
@@ -792,34 +1668,230 @@ async def get_sales_report(
         query["branchId"] = branch_id
     if employee_id:
         query["employeeId"] = employee_id
-    elif current_user["role"] != "admin":
-        query["employeeId"] = current_user["id"]
     
-    bills = await db.bills.find(query, {"_id": 0}).to_list(10000)
+    bills = await source.bills.find(query, {"_id": 0}).to_list(REPORT_BILL_LIMIT)
+    totals = archive.empty_totals()
+    for bill in bills:
+        archive.add_bill(totals, bill)
     
-    total_sales = sum(bill["totalAmount"] for bill in bills)
-    total_discount = sum(bill["discountAmount"] for bill in bills)
-    payment_methods = {}
+    # Archived days come from rollups; archived bills only fill the detail list
+    archived = await archived_bills.sales_totals(start_date, end_date, query.get("branchId"), query.get("employeeId"))
+    archive.merge_totals(totals, archived)
+    if archived["count"] and len(bills) < REPORT_BILL_LIMIT:
+        bills += await archived_bills.find_bills(query, start_date, end_date, REPORT_BILL_LIMIT - len(bills))
     
-    for bill in bills:
-        method = bill["paymentMethod"]
-        if method not in payment_methods:
-            payment_methods[method] = {"count": 0, "total": 0}
-        payment_methods[method]["count"] += 1
-        payment_methods[method]["total"] += bill["totalAmount"]
+    scope = sales_analytics.scope_for(query.get("branchId"), query.get("employeeId"))
+    try:
+        sales_by_category = await counters.categories(start_date, end_date, scope)
+        top_products = await counters.top_products(start_date, end_date, scope, limit=5)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be ISO 8601")
     
-    return {
-        "totalSales": total_sales,
-        "totalTransactions": len(bills),
-        "totalDiscount": total_discount,
-        "avgBillValue": total_sales / len(bills) if bills else 0,
-        "paymentMethods": payment_methods,
+    return JSONResponse(jsonable_encoder({
+        "totalSales": totals["totalSales"],
+        "totalTransactions": totals["count"],
+        "totalDiscount": totals["totalDiscount"],
+        "avgBillValue": totals["totalSales"] / totals["count"] if totals["count"] else 0,
+        "paymentMethods": totals["paymentMethods"],
+        "salesByCategory": sales_by_category,
+        "topProducts": top_products,
         "bills": bills
+    })).body
+
+# Archive Routes
+@api_router.get("/admin/archive/bills")
+async def get_archive_status(current_user: dict = Depends(get_admin_user)):
+    return {
+        "horizonDays": bill_archive.horizon_days,
+        "intervalHours": bill_archive.interval_hours,
+        "hotBills": await db.bills.estimated_document_count(),
+        "archivedBills": await db.bill_archive_index.estimated_document_count(),
+        "months": await bill_archive.months(),
+        "lastRun": bill_archive.last_run
+    }
+
+@api_router.post("/admin/archive/bills")
+async def run_bill_archive(request: ArchiveRunRequest, current_user: dict = Depends(get_admin_user)):
+    result = await bill_archive.run(request.horizonDays)
+    logger.info("Bill archive run by %s moved %d bills", current_user["username"], result["moved"])
+    return result
+
+# Stock Reconciliation Routes
+@api_router.get("/admin/inventory/reconcile")
+async def get_reconcile_status(current_user: dict = Depends(get_admin_user)):
+    return {
+        "intervalHours": stock_reconciler.interval_hours,
+        "repair": stock_reconciler.repair,
+        "processes": stock_reconciler.processes,
+        "shards": stock_reconciler.shards,
+        "checkpoints": await db.stock_checkpoints.estimated_document_count(),
+        "lastRun": stock_reconciler.last_run
+    }
+
+@api_router.post("/admin/inventory/reconcile")
+async def run_reconcile(request: ReconcileRunRequest, current_user: dict = Depends(get_admin_user)):
+    result = await stock_reconciler.run(request.repair, request.shards)
+    logger.info("Stock reconciliation run by %s: %s", current_user["username"], result["pairs"])
+    return result
+
+# Analytics Routes
+@api_router.get("/analytics/sales")
+async def get_analytics_sales(
+    current_user: dict = Depends(get_admin_user),
+    group_by: str = "category",
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    branch_id: Optional[str] = None,
+    top: Optional[int] = None
+):
+    """Revenue per category, product or SKU from the Parquet export"""
+    if group_by not in columnar_export.GROUP_KEYS:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of {', '.join(columnar_export.GROUP_KEYS)}")
+    try:
+        totals = await columnar.totals(start_date, end_date, branch_id)
+        rows = await columnar.sales_by(group_by, start_date, end_date, branch_id, top)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be ISO 8601")
+    return {
+        "groupBy": group_by,
+        "exportedThrough": await columnar.watermark(),
+        "totals": totals,
+        "rows": rows
+    }
+
+@api_router.get("/analytics/top-products")
+async def get_top_products(
+    current_user: dict = Depends(get_admin_user),
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    branch_id: Optional[str] = None,
+    employee_id: Optional[str] = None,
+    by: str = "product",
+    limit: int = 10
+):
+    if by not in ("product", "sku"):
+        raise HTTPException(status_code=400, detail="by must be 'product' or 'sku'")
+    scope = sales_analytics.scope_for(branch_id, employee_id)
+    try:
+        return await sales_counters.top_products(start_date, end_date, scope, min(max(limit, 1), 100), by)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be ISO 8601")
+
+@api_router.get("/analytics/categories")
+async def get_category_sales(
+    current_user: dict = Depends(get_admin_user),
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    branch_id: Optional[str] = None,
+    employee_id: Optional[str] = None
+):
+    try:
+        return await sales_counters.categories(start_date, end_date, sales_analytics.scope_for(branch_id, employee_id))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be ISO 8601")
+
+@api_router.get("/analytics/slow-movers")
+async def get_slow_movers(
+    current_user: dict = Depends(get_admin_user),
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    branch_id: Optional[str] = None,
+    limit: int = 10
+):
+    try:
+        return await sales_counters.slow_movers(start_date, end_date, branch_id, min(max(limit, 1), 100))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be ISO 8601")
+
+@api_router.post("/admin/analytics/counters/rebuild")
+async def rebuild_sales_counters(current_user: dict = Depends(get_admin_user)):
+    bills = await sales_counters.rebuild()
+    await bump_collection_version("bills", {"epoch": 1})
+    return {"message": "Sales counters rebuilt", "bills": bills}
+
+@api_router.get("/admin/coordination")
+async def get_coordination_status(current_user: dict = Depends(get_admin_user)):
+    """How the worker answering this request stays in step with the others"""
+    return {
+        "worker": maintenance_lease.owner,
+        "runsPeriodicJobs": maintenance_lease.held,
+        "cacheBus": cache_bus.status(),
+        "providers": provider_registry.status(),
+        "reportCache": sales_report_cache.status(),
+        "leases": await db.leases.find({}, {"_id": 0}).to_list(None)
     }
 
+@api_router.post("/admin/customers/stats/rebuild")
+async def rebuild_customer_stats_route(current_user: dict = Depends(get_admin_user)):
+    customers = await rebuild_customer_stats()
+    return {"message": "Customer stats rebuilt", "customers": customers}
+
+@api_router.get("/admin/analytics/export")
+async def get_export_status(current_user: dict = Depends(get_admin_user)):
+    return await columnar.status()
+
+@api_router.post("/admin/analytics/export")
+async def run_export(current_user: dict = Depends(get_admin_user)):
+    return await columnar.run()
+
+@api_router.delete("/admin/analytics/export")
+async def reset_export(current_user: dict = Depends(get_admin_user)):
+    await columnar.reset()
+    return {"message": "Export cleared; the next run re-exports all bills"}
+
+# Admission Routes
+@api_router.get("/admin/admission")
+async def get_admission_status(current_user: dict = Depends(get_admin_user)):
+    """Slots, queues and shed counts per route class in the worker answering this request"""
+    return admission_control.status()
+
+# Profiling Routes
+@api_router.get("/admin/profiling")
+async def get_profiling_status(current_user: dict = Depends(get_admin_user)):
+    return {
+        "intervalMs": profiling.profiler.interval * 1000,
+        "targets": [target.status() for target in profiling.profiler.targets.values()]
+    }
+
+@api_router.post("/admin/profiling")
+async def enable_profiling(request: ProfilingRequest, current_user: dict = Depends(get_admin_user)):
+    target = profiling.profiler.enable(request.route, request.fraction, request.intervalMs / 1000)
+    logger.info("Profiling enabled for %s at %.0f%% by %s", request.route, request.fraction * 100, current_user["username"])
+    return target.status()
+
+@api_router.delete("/admin/profiling")
+async def disable_profiling(route: Optional[str] = None, current_user: dict = Depends(get_admin_user)):
+    profiling.profiler.disable(route)
+    return {"message": "Profiling disabled"}
+
+@api_router.get("/admin/profiling/stacks")
+async def download_profile(route: str, current_user: dict = Depends(get_admin_user)):
+    target = profiling.profiler.targets.get(route)
+    if not target:
+        raise HTTPException(status_code=404, detail="Route is not being profiled")
+    filename = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+    return Response(
+        content=target.folded(),
+        media_type="text/plain",
+        headers={"Content-Disposition": f'attachment; filename="{filename}.folded"'}
+    )
+
+# Metrics
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(authorization: Optional[str] = Header(None)):
+    metrics_token = os.environ.get("METRICS_TOKEN")
+    if metrics_token and authorization != f"Bearer {metrics_token}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # Include the router in the main app
 app.include_router(api_router)
 
+app.add_middleware(GZipMiddleware, minimum_size=int(os.environ.get("GZIP_MIN_BYTES", "1024")))
+app.add_middleware(profiling.ProfilingMiddleware)
+app.add_middleware(admission.AdmissionMiddleware, controller=admission_control)
+app.add_middleware(metrics.MetricsMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -834,8 +1906,68 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("startup")
+async def ensure_indexes():
+    await db.branches.create_index("id", unique=True)
+    await db.employees.create_index("id", unique=True)
+    await db.employees.create_index("username")
+    await db.customers.create_index("id", unique=True)
+    await db.customers.create_index("phoneNumber")
+    await db.products.create_index("id", unique=True)
+    await db.products.create_index("variants.sku")
+    await db.products.create_index("variants.barcode")
+    await db.products.create_index("rev")
+    await db.inventory.create_index([("sku", 1), ("branchId", 1)], unique=True)
+    await db.inventory.create_index([("branchId", 1), ("sku", 1)])
+    await db.inventory.create_index("productId")
+    await db.inventory.create_index("rev")
+    await db.bills.create_index("id", unique=True)
+    await db.bills.create_index([("branchId", 1), ("createdAt", 1)])
+    await db.bills.create_index([("employeeId", 1), ("createdAt", 1)])
+    await db.bills.create_index([("customerId", 1), ("createdAt", 1)])
+    await db.bills.create_index("createdAt")
+    await db.bills.create_index("commissionAccrued")
+    await db.bills.create_index("countersRecorded")
+    await db.commissions.create_index("billId", unique=True)
+    await db.commissions.create_index([("employeeId", 1), ("createdAt", 1)])
+    await db.commissions.create_index([("branchId", 1), ("createdAt", 1)])
+    await db.commissions.create_index([("status", 1), ("createdAt", 1)])
+    await db.commissions.create_index([("createdAt", 1), ("id", 1)])
+    await db.commissions.create_index("payoutId", sparse=True)
+    await db.commissions.create_index("batchId", sparse=True)
+    await db.commission_balances.create_index("employeeId", unique=True)
+    await db.commission_balances.create_index("branchId")
+    await bill_archive.ensure_indexes()
+    await sales_counters.ensure_indexes()
+    await movement_ledger.ensure_indexes()
+    await stock_reconciler.ensure_indexes()
+    await db.counters.create_index("id", unique=True)
+    await db.collection_versions.create_index("id", unique=True)
+    await db.leases.create_index("id", unique=True)
+
+async def start_periodic_jobs() -> None:
+    bill_archive.start()
+    columnar.start()
+    stock_reconciler.start()
+
+async def stop_periodic_jobs() -> None:
+    await stock_reconciler.stop()
+    await columnar.stop()
+    await bill_archive.stop()
+
+maintenance_lease = coordination.Lease(db, "maintenance", on_acquired=start_periodic_jobs, on_lost=stop_periodic_jobs)
+
 async def startup_event():
+    await provider_registry.startup()
+    await ensure_indexes()
+    # Workers starting together take turns; later ones find the work done
+    async with startup_lease.hold():
+        await run_startup_maintenance()
+    await cache_bus.start()
+    commission_pipeline.start()
+    sales_counters.start()
+    maintenance_lease.start()
+
+async def run_startup_maintenance():
     # Create default admin if not exists
     admin = await db.employees.find_one({"username": "admin"})
     if not admin:
@@ -850,8 +1982,47 @@ async def startup_event():
         doc["password"] = hash_password("admin123")
         doc['createdAt'] = doc['createdAt'].isoformat()
         await db.employees.insert_one(doc)
+        await bump_collection_version("employees")
         logger.info("Default admin created: username=admin, password=admin123")
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+    
+    if os.environ.get("SEED_DEMO_DATA", "true" if storage_backend == "memory" else "false").lower() == "true":
+        import demo_data
+        if await demo_data.seed(db, hash_password):
+            for name in ("branches", "employees", "products", "inventory"):
+                await bump_collection_version(name)
+            logger.info("Demo data loaded into %s storage", storage_backend)
+    
+    migrated = await migrate_embedded_stock()
+    if migrated:
+        logger.info("Moved embedded stock of %d products into inventory", migrated)
+    
+    # Accrue commissions for bills saved but not accrued before the last shutdown
+    replayed = await commission_pipeline.replay()
+    if replayed:
+        logger.info("Replayed commission accrual for %d bills", replayed)
+    if not await db.commission_balances.estimated_document_count():
+        await commission_pipeline.rebuild_balances()
+    
+    # Customers saved before lifetime stats existed get them from their bills
+    if await db.customers.find_one({"visitCount": {"$exists": False}}, {"_id": 0, "id": 1}):
+        customers = await rebuild_customer_stats()
+        logger.info("Computed lifetime stats for %d customers", customers)
+    
+    # Count bills saved but not counted before the last shutdown
+    replayed = await sales_counters.replay()
+    if replayed:
+        logger.info("Replayed sales counters for %d bills", replayed)
+    
+    # Counters start empty on existing databases, and lack the branch and employee
+    # scope when built before it; build them once from the bills
+    if await db.bills.estimated_document_count() and not await db.sales_counters.find_one(
+        {"scope": {"$regex": "^be:"}}, {"_id": 0, "id": 1}
+    ):
+        await sales_counters.rebuild()
+
+async def shutdown_event():
+    await maintenance_lease.stop()
+    await commission_pipeline.stop()
+    await sales_counters.stop()
+    await cache_bus.stop()
+    await provider_registry.shutdown()
@@ -0,0 +1,132 @@
+"""Stock movement ledger.
+
+Every change to an inventory quantity is recorded in ``stock_movements`` as
+a signed delta for one (sku, branch): sales, returns, stock-ins, the two
+sides of a transfer, adjustments when a product edit sets absolute
+levels, and corrections made by stock reconciliation. Listings filter by
+SKU, branch, user, type and date range, and page newest first through
+compound indexes that end in (createdAt, id). Net
+movement per branch (or per branch and SKU) is grouped in the database, so
+audits never need the raw rows.
+"""
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+TYPES = ("sale", "return", "stock_in", "transfer_out", "transfer_in", "adjustment", "reconciliation")
+GROUPINGS = ("branch", "sku")
+
+
+def movement(
+    kind: str,
+    sku: str,
+    branch_id: str,
+    quantity: int,
+    user_id: Optional[str],
+    product_id: Optional[str] = None,
+    reference: Optional[str] = None,
+    created_at: Optional[str] = None
+) -> dict:
+    """One ledger row; `quantity` is negative for stock leaving the branch"""
+    return {
+        "id": str(uuid.uuid4()),
+        "type": kind,
+        "sku": sku,
+        "productId": product_id,
+        "branchId": branch_id,
+        "quantity": quantity,
+        "userId": user_id,
+        "reference": reference,
+        "createdAt": created_at or datetime.now(timezone.utc).isoformat()
+    }
+
+
+def filters(
+    sku: Optional[str] = None,
+    branch_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+    kind: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None
+) -> dict:
+    if kind and kind not in TYPES:
+        raise ValueError(f"type must be one of {', '.join(TYPES)}")
+    query = {}
+    if sku:
+        query["sku"] = sku
+    if branch_id:
+        query["branchId"] = branch_id
+    if user_id:
+        query["userId"] = user_id
+    if kind:
+        query["type"] = kind
+    if start_date or end_date:
+        query["createdAt"] = {}
+        if start_date:
+            query["createdAt"]["$gte"] = start_date
+        if end_date:
+            query["createdAt"]["$lte"] = end_date
+    return query
+
+
+class StockMovements:
+    def __init__(self, db, read_db=None):
+        self.db = db
+        # Audit reads may go to a secondary
+        self.read_db = read_db if read_db is not None else db
+
+    async def ensure_indexes(self) -> None:
+        await self.db.stock_movements.create_index("id", unique=True)
+        await self.db.stock_movements.create_index([("sku", 1), ("createdAt", 1), ("id", 1)])
+        await self.db.stock_movements.create_index([("branchId", 1), ("createdAt", 1), ("id", 1)])
+        await self.db.stock_movements.create_index([("branchId", 1), ("sku", 1), ("createdAt", 1)])
+        await self.db.stock_movements.create_index([("userId", 1), ("createdAt", 1), ("id", 1)])
+        await self.db.stock_movements.create_index([("createdAt", 1), ("id", 1)])
+        await self.db.stock_transfers.create_index("id", unique=True)
+        await self.db.stock_transfers.create_index([("sku", 1), ("createdAt", 1)])
+        await self.db.stock_transfers.create_index([("fromBranchId", 1), ("createdAt", 1)])
+        await self.db.stock_transfers.create_index([("toBranchId", 1), ("createdAt", 1)])
+        await self.db.stock_transfers.create_index([("createdAt", 1), ("id", 1)])
+
+    async def record(self, movements: Iterable[dict]) -> None:
+        """Append movements in one round trip"""
+        movements = [row for row in movements if row["quantity"]]
+        if movements:
+            await self.db.stock_movements.insert_many(movements, ordered=False)
+
+    async def page(self, collection: str, query: dict, limit: int) -> List[dict]:
+        """Up to `limit` + 1 rows newest first, so the caller can tell whether another page follows"""
+        return await self.read_db[collection].find(query, {"_id": 0}).sort(
+            [("createdAt", -1), ("id", -1)]
+        ).limit(limit + 1).to_list(None)
+
+    async def net(self, query: dict, group_by: str = "branch") -> List[dict]:
+        """Inbound, outbound and net quantity per branch (or per branch and SKU), with per-type nets"""
+        if group_by not in GROUPINGS:
+            raise ValueError(f"group_by must be one of {', '.join(GROUPINGS)}")
+        key = {"branchId": "$branchId", "type": "$type"}
+        if group_by == "sku":
+            key["sku"] = "$sku"
+        groups = await self.read_db.stock_movements.aggregate([
+            {"$match": query},
+            {"$group": {
+                "_id": key,
+                "inbound": {"$sum": {"$cond": [{"$gt": ["$quantity", 0]}, "$quantity", 0]}},
+                "outbound": {"$sum": {"$cond": [{"$lt": ["$quantity", 0]}, "$quantity", 0]}},
+                "movements": {"$sum": 1}
+            }}
+        ]).to_list(None)
+        rows: Dict[tuple, dict] = {}
+        for group in groups:
+            identity = group["_id"]
+            row_key = (identity["branchId"], identity.get("sku"))
+            row = rows.get(row_key)
+            if row is None:
+                row = rows[row_key] = {"branchId": identity["branchId"], **({"sku": identity["sku"]} if group_by == "sku" else {}),
+                                       "inbound": 0, "outbound": 0, "net": 0, "movements": 0, "byType": {}}
+            row["inbound"] += group["inbound"]
+            row["outbound"] += -group["outbound"]
+            row["net"] += group["inbound"] + group["outbound"]
+            row["movements"] += group["movements"]
+            row["byType"][identity["type"]] = group["inbound"] + group["outbound"]
+        return [rows[row_key] for row_key in sorted(rows, key=lambda item: (item[0] or "", item[1] or ""))]
@@ -0,0 +1,1308 @@
+"""Storage backends for the API.
+
+Routes talk to storage through the async collection interface that Motor
+exposes (``find_one``, ``find``, ``update_one``, ``bulk_write``, ``aggregate``
+and friends). Two backends implement it:
+
+* ``mongo``  - Motor against a real MongoDB server (the default)
+* ``memory`` - an indexed, in-process engine for demos, tests and benchmarks
+
+Select one with the ``STORAGE_BACKEND`` environment variable. The memory
+engine answers without ever waiting; ``STORAGE_MEMORY_LATENCY_MS`` makes
+each operation wait that long first, so benchmarks see requests overlap the
+way they do against a real server.
+"""
+import asyncio
+import bisect
+import functools
+import itertools
+import os
+import re
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import ReturnDocument, monitoring
+from pymongo.errors import DuplicateKeyError
+
+STORAGE_BACKENDS = ("mongo", "memory")
+
+# Motor client settings read from the environment as <prefix><NAME>
+CLIENT_OPTIONS = {
+    "MAX_POOL_SIZE": ("maxPoolSize", int),
+    "MIN_POOL_SIZE": ("minPoolSize", int),
+    "MAX_CONNECTING": ("maxConnecting", int),
+    "MAX_IDLE_TIME_MS": ("maxIdleTimeMS", int),
+    "WAIT_QUEUE_TIMEOUT_MS": ("waitQueueTimeoutMS", int),
+    "CONNECT_TIMEOUT_MS": ("connectTimeoutMS", int),
+    "SOCKET_TIMEOUT_MS": ("socketTimeoutMS", int),
+    "SERVER_SELECTION_TIMEOUT_MS": ("serverSelectionTimeoutMS", int),
+    "READ_PREFERENCE": ("readPreference", str),
+    "MAX_STALENESS_SECONDS": ("maxStalenessSeconds", int),
+}
+
+
+def client_options(prefix: str = "MONGO_", fallback: Optional[str] = None, **defaults) -> dict:
+    """Motor keyword options set in the environment under `prefix`.
+
+    Settings missing under `prefix` are taken from `fallback`, then from
+    `defaults` (keyed by the Motor option name).
+    """
+    options = dict(defaults)
+    for env_prefix in filter(None, (fallback, prefix)):
+        for name, (option, convert) in CLIENT_OPTIONS.items():
+            value = os.environ.get(env_prefix + name)
+            if value:
+                options[option] = convert(value)
+    return options
+
+
+def create_client(backend: Optional[str] = None, event_listeners: Optional[list] = None, url: Optional[str] = None, **options):
+    """Create a database client for the configured storage backend.
+
+    ``event_listeners`` are pymongo monitoring listeners; the memory backend
+    reports its operations to the command listeners among them with the same
+    command names. ``options`` (pool size, timeouts, read preference) only
+    apply to MongoDB.
+    """
+    backend = backend or os.environ.get("STORAGE_BACKEND", "mongo")
+    if backend == "memory":
+        latency_ms = float(os.environ.get("STORAGE_MEMORY_LATENCY_MS", "0"))
+        return MemoryClient(event_listeners=event_listeners, latency_seconds=latency_ms / 1000)
+    if backend == "mongo":
+        from motor.motor_asyncio import AsyncIOMotorClient
+        return AsyncIOMotorClient(url or os.environ["MONGO_URL"], event_listeners=event_listeners or [], **options)
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}, expected one of {STORAGE_BACKENDS}")
+
+
+class LazyDatabase:
+    """Database handle whose client is looked up on each use.
+
+    Components keep this handle from import time; the client behind it is
+    created by the first query and may be replaced later (benchmarks swap in
+    in-process storage) without re-pointing every component.
+    """
+
+    def __init__(self, client_factory: Callable[[], Any], name: str):
+        self._client_factory = client_factory
+        self._name = name
+        self._resolved = (None, None)
+
+    def _database(self):
+        client = self._client_factory()
+        resolved_client, database = self._resolved
+        if resolved_client is not client:
+            database = client[self._name]
+            self._resolved = (client, database)
+        return database
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self._database(), name)
+
+    def __getitem__(self, name: str):
+        return self._database()[name]
+
+
+# Document helpers
+_MISSING = object()
+
+
+def _clone(value):
+    """Copy a JSON-like document; much cheaper than copy.deepcopy for plain data"""
+    if isinstance(value, dict):
+        return {k: _clone(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_clone(v) for v in value]
+    return value
+
+
+def _resolve(doc, path: List[str]) -> List[Any]:
+    """Every value reachable at a dotted path, traversing arrays like MongoDB does"""
+    if not path:
+        return [doc]
+    head, rest = path[0], path[1:]
+    if isinstance(doc, dict):
+        if head not in doc:
+            return []
+        return _resolve(doc[head], rest)
+    if isinstance(doc, list):
+        if head.isdigit():
+            index = int(head)
+            return _resolve(doc[index], rest) if index < len(doc) else []
+        values = []
+        for element in doc:
+            if isinstance(element, (dict, list)):
+                values.extend(_resolve(element, path))
+        return values
+    return []
+
+
+def _candidates(doc, field: str) -> List[Any]:
+    """Values to compare a query condition against, expanding terminal arrays"""
+    values = _resolve(doc, field.split("."))
+    expanded = []
+    for value in values:
+        expanded.append(value)
+        if isinstance(value, list):
+            expanded.extend(value)
+    return expanded
+
+
+def _type_rank(value) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, bool):
+        return 5
+    if isinstance(value, (int, float)):
+        return 1
+    if isinstance(value, str):
+        return 2
+    if isinstance(value, dict):
+        return 3
+    if isinstance(value, list):
+        return 4
+    if isinstance(value, datetime):
+        return 6
+    return 7
+
+
+class _SortKey:
+    """Total ordering over mixed BSON-ish values, following MongoDB's type order"""
+    __slots__ = ("value", "rank")
+
+    def __init__(self, value):
+        self.value = value
+        self.rank = _type_rank(value)
+
+    def __lt__(self, other):
+        if self.rank != other.rank:
+            return self.rank < other.rank
+        try:
+            return self.value < other.value
+        except TypeError:
+            return repr(self.value) < repr(other.value)
+
+    def __eq__(self, other):
+        return self.rank == other.rank and self.value == other.value
+
+
+def _comparable(a, b) -> bool:
+    return _type_rank(a) == _type_rank(b) and a is not None
+
+
+def _compare(op: str, candidate, target) -> bool:
+    if not _comparable(candidate, target):
+        return False
+    if op == "$gt":
+        return candidate > target
+    if op == "$gte":
+        return candidate >= target
+    if op == "$lt":
+        return candidate < target
+    return candidate <= target
+
+
+def _match_condition(doc, field: str, condition) -> bool:
+    if isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+        for op, target in condition.items():
+            if not _match_operator(doc, field, op, target, condition):
+                return False
+        return True
+    if isinstance(condition, re.Pattern):
+        return any(isinstance(v, str) and condition.search(v) for v in _candidates(doc, field))
+    values = _candidates(doc, field)
+    if condition is None and not values:
+        return True
+    return any(v == condition for v in values)
+
+
+def _match_operator(doc, field: str, op: str, target, condition) -> bool:
+    if op == "$eq":
+        return _match_condition(doc, field, target)
+    if op == "$ne":
+        return not _match_condition(doc, field, target)
+    if op in ("$gt", "$gte", "$lt", "$lte"):
+        return any(_compare(op, v, target) for v in _candidates(doc, field))
+    if op == "$in":
+        return any(_match_condition(doc, field, t) for t in target)
+    if op == "$nin":
+        return not any(_match_condition(doc, field, t) for t in target)
+    if op == "$exists":
+        return bool(_resolve(doc, field.split("."))) == bool(target)
+    if op == "$elemMatch":
+        for value in _resolve(doc, field.split(".")):
+            if isinstance(value, list) and any(
+                matches(element, target) if isinstance(element, dict) else _match_condition({"v": element}, "v", target)
+                for element in value
+            ):
+                return True
+        return False
+    if op == "$regex":
+        flags = re.IGNORECASE if "i" in condition.get("$options", "") else 0
+        pattern = re.compile(target, flags) if isinstance(target, str) else target
+        return any(isinstance(v, str) and pattern.search(v) for v in _candidates(doc, field))
+    if op == "$options":
+        return True
+    if op == "$not":
+        return not _match_condition(doc, field, target)
+    if op == "$size":
+        return any(isinstance(v, list) and len(v) == target for v in _resolve(doc, field.split(".")))
+    raise NotImplementedError(f"Query operator {op} is not supported by the memory backend")
+
+
+def matches(doc: dict, query: Optional[dict]) -> bool:
+    """Evaluate a MongoDB query filter against a document"""
+    if not query:
+        return True
+    for key, condition in query.items():
+        if key == "$and":
+            if not all(matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(doc, sub) for sub in condition):
+                return False
+        elif not _match_condition(doc, key, condition):
+            return False
+    return True
+
+
+# Projection
+def _project(doc: dict, projection: Optional[dict]) -> dict:
+    if not projection:
+        return _clone(doc)
+    include_id = projection.get("_id", 1)
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    if fields and all(v for v in fields.values()):
+        result = _include(doc, [f.split(".") for f in fields])
+        if include_id and "_id" in doc:
+            result["_id"] = doc["_id"]
+        return result
+    result = _clone(doc)
+    for field in fields:
+        _exclude(result, field.split("."))
+    if not include_id:
+        result.pop("_id", None)
+    return result
+
+
+def _include(value, paths: List[List[str]]):
+    if isinstance(value, list):
+        return [_include(v, paths) for v in value if isinstance(v, (dict, list))]
+    if not isinstance(value, dict):
+        return value
+    grouped: Dict[str, List[List[str]]] = {}
+    for path in paths:
+        grouped.setdefault(path[0], []).append(path[1:])
+    result = {}
+    for key, subpaths in grouped.items():
+        if key not in value:
+            continue
+        if any(not p for p in subpaths):
+            result[key] = _clone(value[key])
+        else:
+            result[key] = _include(value[key], subpaths)
+    return result
+
+
+def _exclude(value, path: List[str]) -> None:
+    if isinstance(value, list):
+        for element in value:
+            _exclude(element, path)
+        return
+    if not isinstance(value, dict) or path[0] not in value:
+        return
+    if len(path) == 1:
+        del value[path[0]]
+    else:
+        _exclude(value[path[0]], path[1:])
+
+
+# Updates
+def _positional_index(doc: dict, query: Optional[dict], array_path: str) -> int:
+    """Index of the first array element matched by the query, for the ``$`` operator"""
+    array = _resolve(doc, array_path.split("."))
+    if not array or not isinstance(array[0], list):
+        raise ValueError(f"The positional operator did not find the match needed from the query ({array_path})")
+    prefix = array_path + "."
+    element_query = {k[len(prefix):]: v for k, v in (query or {}).items() if k.startswith(prefix)}
+    for key, condition in (query or {}).items():
+        if key == array_path and isinstance(condition, dict) and "$elemMatch" in condition:
+            element_query.update(condition["$elemMatch"])
+    for index, element in enumerate(array[0]):
+        if isinstance(element, dict) and matches(element, element_query):
+            return index
+    raise ValueError(f"The positional operator did not find the match needed from the query ({array_path})")
+
+
+def _targets(container, parts: List[str], doc, query, array_filters, create: bool) -> List[Tuple[Any, Any]]:
+    """Expand an update path into (parent, key) pairs, resolving positional operators"""
+    head, rest = parts[0], parts[1:]
+    if isinstance(container, list):
+        if head == "$[]":
+            keys = list(range(len(container)))
+        elif head.startswith("$[") and head.endswith("]"):
+            name = head[2:-1]
+            conditions = {k[len(name) + 1:]: v for f in array_filters for k, v in f.items() if k.split(".")[0] == name}
+            keys = [i for i, element in enumerate(container)
+                    if isinstance(element, dict) and matches(element, conditions)]
+        else:
+            keys = [int(head)]
+    else:
+        keys = [head]
+    targets = []
+    for key in keys:
+        if not rest:
+            targets.append((container, key))
+            continue
+        if isinstance(container, list):
+            if key >= len(container):
+                if not create:
+                    continue
+                container.extend([None] * (key + 1 - len(container)))
+            child = container[key]
+        else:
+            child = container.get(key, _MISSING)
+        if child is _MISSING or child is None:
+            if not create:
+                continue
+            child = {}
+            container[key] = child
+        targets.extend(_targets(child, rest, doc, query, array_filters, create))
+    return targets
+
+
+def _expand_positional(path: str, doc: dict, query) -> str:
+    if ".$." not in path and not path.endswith(".$"):
+        return path
+    parts = path.split(".")
+    position = parts.index("$")
+    index = _positional_index(doc, query, ".".join(parts[:position]))
+    parts[position] = str(index)
+    return ".".join(parts)
+
+
+def _apply_update(doc: dict, update: dict, query=None, array_filters=None, inserting: bool = False) -> None:
+    if not any(k.startswith("$") for k in update):
+        preserved_id = doc.get("_id")
+        doc.clear()
+        doc.update(_clone(update))
+        if preserved_id is not None:
+            doc["_id"] = preserved_id
+        return
+    array_filters = array_filters or []
+    for op, fields in update.items():
+        if op == "$setOnInsert" and not inserting:
+            continue
+        for path, value in fields.items():
+            path = _expand_positional(path, doc, query)
+            create = op not in ("$unset", "$pull", "$pullAll")
+            for parent, key in _targets(doc, path.split("."), doc, query, array_filters, create):
+                _apply_operator(op, parent, key, value)
+
+
+def _apply_operator(op: str, parent, key, value) -> None:
+    exists = (key < len(parent)) if isinstance(parent, list) else (key in parent)
+    current = parent[key] if exists else None
+    if op in ("$set", "$setOnInsert"):
+        parent[key] = _clone(value)
+    elif op == "$unset":
+        if exists:
+            if isinstance(parent, list):
+                parent[key] = None
+            else:
+                del parent[key]
+    elif op == "$inc":
+        parent[key] = (current or 0) + value
+    elif op == "$mul":
+        parent[key] = (current or 0) * value
+    elif op == "$max":
+        if not exists or _SortKey(current) < _SortKey(value):
+            parent[key] = _clone(value)
+    elif op == "$min":
+        if not exists or _SortKey(value) < _SortKey(current):
+            parent[key] = _clone(value)
+    elif op == "$push":
+        items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+        array = current if isinstance(current, list) else []
+        array.extend(_clone(v) for v in items)
+        if isinstance(value, dict) and "$slice" in value:
+            limit = value["$slice"]
+            array[:] = array[limit:] if limit < 0 else array[:limit]
+        parent[key] = array
+    elif op == "$addToSet":
+        items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+        array = current if isinstance(current, list) else []
+        for item in items:
+            if item not in array:
+                array.append(_clone(item))
+        parent[key] = array
+    elif op == "$pull":
+        if isinstance(current, list):
+            if isinstance(value, dict):
+                current[:] = [v for v in current if not (isinstance(v, dict) and matches(v, value))]
+            else:
+                current[:] = [v for v in current if v != value]
+    elif op == "$pullAll":
+        if isinstance(current, list):
+            current[:] = [v for v in current if v not in value]
+    else:
+        raise NotImplementedError(f"Update operator {op} is not supported by the memory backend")
+
+
+def _upsert_seed(query: dict) -> dict:
+    """Fields an upsert copies from equality conditions in its filter"""
+    seed: Dict[str, Any] = {}
+    for key, condition in (query or {}).items():
+        if key.startswith("$"):
+            if key == "$and":
+                for sub in condition:
+                    seed.update(_upsert_seed(sub))
+            continue
+        if isinstance(condition, dict) and any(k.startswith("$") for k in condition):
+            if "$eq" in condition:
+                condition = condition["$eq"]
+            else:
+                continue
+        for parent, k in _targets(seed, key.split("."), seed, None, [], True):
+            parent[k] = _clone(condition)
+    return seed
+
+
+# Aggregation expressions
+def _field_value(value, path: List[str]):
+    """Value of a ``$field`` reference; paths through arrays yield arrays"""
+    for position, part in enumerate(path):
+        if isinstance(value, list):
+            return [v for v in (_field_value(e, path[position:]) for e in value if isinstance(e, dict)) if v is not None]
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def _evaluate(expression, doc):
+    if isinstance(expression, str) and expression.startswith("$"):
+        return _field_value(doc, expression[1:].split("."))
+    if isinstance(expression, list):
+        return [_evaluate(e, doc) for e in expression]
+    if not isinstance(expression, dict):
+        return expression
+    if len(expression) == 1:
+        op, args = next(iter(expression.items()))
+        if op.startswith("$"):
+            return _evaluate_operator(op, args, doc)
+    return {k: _evaluate(v, doc) for k, v in expression.items()}
+
+
+def _evaluate_operator(op: str, args, doc):
+    if op == "$literal":
+        return args
+    values = [_evaluate(a, doc) for a in args] if isinstance(args, list) else [_evaluate(args, doc)]
+    if op == "$add":
+        return sum(v or 0 for v in values)
+    if op == "$subtract":
+        return (values[0] or 0) - (values[1] or 0)
+    if op == "$multiply":
+        result = 1
+        for v in values:
+            result *= v or 0
+        return result
+    if op == "$divide":
+        return (values[0] or 0) / values[1] if values[1] else None
+    if op == "$abs":
+        return abs(values[0]) if values[0] is not None else None
+    if op == "$max":
+        present = [v for v in (values[0] if len(values) == 1 and isinstance(values[0], list) else values) if v is not None]
+        return max(present) if present else None
+    if op == "$min":
+        present = [v for v in (values[0] if len(values) == 1 and isinstance(values[0], list) else values) if v is not None]
+        return min(present) if present else None
+    if op == "$ifNull":
+        return next((v for v in values if v is not None), None)
+    if op == "$substr" or op == "$substrBytes":
+        text, start, length = values
+        text = "" if text is None else str(text)
+        return text[start:] if length < 0 else text[start:start + length]
+    if op == "$concat":
+        return None if any(v is None for v in values) else "".join(values)
+    if op == "$toLower":
+        return (values[0] or "").lower()
+    if op == "$size":
+        return len(values[0] or [])
+    if op == "$cond":
+        if isinstance(args, dict):
+            condition, then, otherwise = args["if"], args["then"], args["else"]
+        else:
+            condition, then, otherwise = args
+        return _evaluate(then, doc) if _evaluate(condition, doc) else _evaluate(otherwise, doc)
+    if op in ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte"):
+        a, b = values
+        if op == "$eq":
+            return a == b
+        if op == "$ne":
+            return a != b
+        return (_SortKey(b) < _SortKey(a) if op == "$gt" else
+                not _SortKey(a) < _SortKey(b) if op == "$gte" else
+                _SortKey(a) < _SortKey(b) if op == "$lt" else
+                not _SortKey(b) < _SortKey(a))
+    if op == "$and":
+        return all(values)
+    if op == "$or":
+        return any(values)
+    if op == "$not":
+        return not values[0]
+    if op == "$in":
+        return values[0] in (values[1] or [])
+    raise NotImplementedError(f"Expression operator {op} is not supported by the memory backend")
+
+
+class _Accumulator:
+    def __init__(self, op: str, expression):
+        self.op = op
+        self.expression = expression
+        self.value = {"$sum": 0, "$push": [], "$addToSet": []}.get(op)
+        self.count = 0
+
+    def add(self, doc) -> None:
+        value = _evaluate(self.expression, doc)
+        if self.op == "$sum":
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                self.value += value
+        elif self.op == "$avg":
+            if isinstance(value, (int, float)):
+                self.value = (self.value or 0) + value
+                self.count += 1
+        elif self.op == "$min":
+            if value is not None and (self.value is None or _SortKey(value) < _SortKey(self.value)):
+                self.value = value
+        elif self.op == "$max":
+            if value is not None and (self.value is None or _SortKey(self.value) < _SortKey(value)):
+                self.value = value
+        elif self.op == "$first":
+            if self.count == 0:
+                self.value = value
+            self.count += 1
+        elif self.op == "$last":
+            self.value = value
+        elif self.op == "$push":
+            self.value.append(value)
+        elif self.op == "$addToSet":
+            if value not in self.value:
+                self.value.append(value)
+        else:
+            raise NotImplementedError(f"Accumulator {self.op} is not supported by the memory backend")
+
+    def result(self):
+        if self.op == "$avg":
+            return self.value / self.count if self.count else None
+        return self.value
+
+
+def _sort_documents(docs: List[dict], sort: List[Tuple[str, int]]) -> List[dict]:
+    for field, direction in reversed(sort):
+        docs.sort(key=lambda d: _SortKey((_resolve(d, field.split(".")) or [None])[0]), reverse=direction < 0)
+    return docs
+
+
+def _normalize_sort(key_or_list, direction=None) -> List[Tuple[str, int]]:
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction if direction is not None else 1)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return [(k, d) for k, d in key_or_list]
+
+
+def _run_pipeline(docs: List[dict], pipeline: List[dict]) -> List[dict]:
+    for stage in pipeline:
+        (name, spec), = stage.items()
+        if name == "$match":
+            docs = [d for d in docs if matches(d, spec)]
+        elif name == "$sort":
+            docs = _sort_documents(list(docs), _normalize_sort(spec))
+        elif name == "$limit":
+            docs = docs[:spec]
+        elif name == "$skip":
+            docs = docs[spec:]
+        elif name == "$count":
+            docs = [{spec: len(docs)}]
+        elif name == "$project" or name == "$addFields" or name == "$set":
+            projected = []
+            for d in docs:
+                if name == "$project" and all(v in (0, False) for k, v in spec.items()):
+                    projected.append(_project(d, spec))
+                    continue
+                out = _clone(d) if name != "$project" else ({"_id": d.get("_id")} if spec.get("_id", 1) else {})
+                for key, expression in spec.items():
+                    if key == "_id" and name == "$project":
+                        if expression not in (0, 1, True, False):
+                            out["_id"] = _evaluate(expression, d)
+                        continue
+                    if expression in (1, True):
+                        values = _resolve(d, key.split("."))
+                        if values:
+                            out[key] = _clone(values[0])
+                    elif expression not in (0, False):
+                        out[key] = _evaluate(expression, d)
+                projected.append(out)
+            docs = projected
+        elif name == "$unwind":
+            path = spec if isinstance(spec, str) else spec["path"]
+            preserve = isinstance(spec, dict) and spec.get("preserveNullAndEmptyArrays", False)
+            field = path[1:]
+            unwound = []
+            for d in docs:
+                values = _resolve(d, field.split("."))
+                array = values[0] if values else None
+                if isinstance(array, list) and array:
+                    for element in array:
+                        copy = _clone(d)
+                        for parent, key in _targets(copy, field.split("."), copy, None, [], True):
+                            parent[key] = _clone(element)
+                        unwound.append(copy)
+                elif array is not None and not isinstance(array, list):
+                    unwound.append(d)
+                elif preserve:
+                    unwound.append(d)
+            docs = unwound
+        elif name == "$group":
+            groups: Dict[Any, Tuple[Any, Dict[str, _Accumulator]]] = {}
+            for d in docs:
+                group_id = _evaluate(spec["_id"], d)
+                key = repr(group_id) if isinstance(group_id, (dict, list)) else group_id
+                if key not in groups:
+                    groups[key] = (group_id, {
+                        field: _Accumulator(*next(iter(acc.items())))
+                        for field, acc in spec.items() if field != "_id"
+                    })
+                for accumulator in groups[key][1].values():
+                    accumulator.add(d)
+            docs = [{"_id": gid, **{f: a.result() for f, a in accs.items()}} for gid, accs in groups.values()]
+        else:
+            raise NotImplementedError(f"Aggregation stage {name} is not supported by the memory backend")
+    return docs
+
+
+# Results
+class InsertOneResult:
+    def __init__(self, inserted_id):
+        self.inserted_id = inserted_id
+        self.acknowledged = True
+
+
+class InsertManyResult:
+    def __init__(self, inserted_ids):
+        self.inserted_ids = inserted_ids
+        self.acknowledged = True
+
+
+class UpdateResult:
+    def __init__(self, matched_count: int, modified_count: int, upserted_id=None):
+        self.matched_count = matched_count
+        self.modified_count = modified_count
+        self.upserted_id = upserted_id
+        self.acknowledged = True
+
+
+class DeleteResult:
+    def __init__(self, deleted_count: int):
+        self.deleted_count = deleted_count
+        self.acknowledged = True
+
+
+class BulkWriteResult:
+    def __init__(self):
+        self.inserted_count = 0
+        self.matched_count = 0
+        self.modified_count = 0
+        self.deleted_count = 0
+        self.upserted_count = 0
+        self.upserted_ids = {}
+        self.acknowledged = True
+
+
+# Indexes
+class _Index:
+    """Hash index on one or more (possibly multikey) fields, with a lazily sorted key list for ranges"""
+
+    def __init__(self, name: str, fields: List[str], unique: bool, sparse: bool = False):
+        self.name = name
+        self.fields = fields
+        self.unique = unique
+        self.sparse = sparse
+        self.entries: Dict[Any, set] = {}
+        self._sorted: Optional[List[tuple]] = None
+        self._sort_keys: List[_SortKey] = []
+        # Ids by leading key prefix, built on first use and then kept up to date
+        self._prefixes: Dict[int, Dict[tuple, set]] = {}
+
+    def keys_for(self, doc: dict) -> List[tuple]:
+        per_field = []
+        for field in self.fields:
+            values = [v for v in _candidates(doc, field) if not isinstance(v, (list, dict))]
+            per_field.append([_hashable(v) for v in values] or [None])
+        if self.sparse and all(values == [None] for values in per_field):
+            return []
+        return list(set(itertools.product(*per_field)))
+
+    def add(self, doc_id, doc: dict) -> None:
+        for key in self.keys_for(doc):
+            if self.unique and self.entries.get(key) and doc_id not in self.entries[key]:
+                raise DuplicateKeyError(f"E11000 duplicate key error index: {self.name} dup key: {key}")
+            self.entries.setdefault(key, set()).add(doc_id)
+            for length, prefixes in self._prefixes.items():
+                prefixes.setdefault(key[:length], set()).add(doc_id)
+        self._sorted = None
+
+    def remove(self, doc_id, doc: dict) -> None:
+        for key in self.keys_for(doc):
+            ids = self.entries.get(key)
+            if ids is not None:
+                ids.discard(doc_id)
+                if not ids:
+                    del self.entries[key]
+            for length, prefixes in self._prefixes.items():
+                ids = prefixes.get(key[:length])
+                if ids is not None:
+                    ids.discard(doc_id)
+                    if not ids:
+                        del prefixes[key[:length]]
+        self._sorted = None
+
+    def prefix(self, length: int) -> Dict[tuple, set]:
+        """Ids keyed by the first `length` indexed values"""
+        prefixes = self._prefixes.get(length)
+        if prefixes is None:
+            prefixes = self._prefixes[length] = {}
+            for key, ids in self.entries.items():
+                prefixes.setdefault(key[:length], set()).update(ids)
+        return prefixes
+
+    def range(self, bounds: dict) -> set:
+        """Ids whose first indexed field falls inside ``$gt``/``$gte``/``$lt``/``$lte`` bounds"""
+        if self._sorted is None:
+            self._sorted = sorted(self.entries, key=lambda k: _SortKey(k[0]))
+            self._sort_keys = [_SortKey(k[0]) for k in self._sorted]
+        keys = self._sort_keys
+        low, high = 0, len(keys)
+        for op, target in bounds.items():
+            probe = _SortKey(target)
+            if op == "$gt":
+                low = max(low, bisect.bisect_right(keys, probe))
+            elif op == "$gte":
+                low = max(low, bisect.bisect_left(keys, probe))
+            elif op == "$lt":
+                high = min(high, bisect.bisect_left(keys, probe))
+            elif op == "$lte":
+                high = min(high, bisect.bisect_right(keys, probe))
+        ids = set()
+        for key in self._sorted[low:high]:
+            if _comparable(key[0], next(iter(bounds.values()))):
+                ids |= self.entries[key]
+        return ids
+
+
+def _hashable(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _hashable(v)) for k, v in value.items()))
+    if isinstance(value, list):
+        return tuple(_hashable(v) for v in value)
+    return value
+
+
+def _equality_values(condition) -> Optional[list]:
+    if isinstance(condition, dict):
+        if set(condition) == {"$eq"}:
+            condition = condition["$eq"]
+        elif set(condition) == {"$in"}:
+            values = condition["$in"]
+            return None if any(isinstance(v, (dict, list, re.Pattern)) for v in values) else list(values)
+        else:
+            return None
+    if isinstance(condition, (list, re.Pattern)):
+        return None
+    return [condition]
+
+
+_RANGE_OPERATORS = {"$gt", "$gte", "$lt", "$lte"}
+
+
+# Command monitoring
+class CommandEvent:
+    """Subset of pymongo's CommandSucceededEvent that metrics listeners read"""
+    __slots__ = ("command_name", "database_name", "duration_micros")
+
+    def __init__(self, command_name: str, database_name: str, duration_micros: int):
+        self.command_name = command_name
+        self.database_name = database_name
+        self.duration_micros = duration_micros
+
+
+def _notify(database: "MemoryDatabase", command_name: str, started: float) -> None:
+    event = CommandEvent(command_name, database.name, int((time.perf_counter() - started) * 1_000_000))
+    for listener in database.client.event_listeners:
+        listener.succeeded(event)
+
+
+async def _round_trip(client: "MemoryClient") -> None:
+    if client.latency_seconds:
+        await asyncio.sleep(client.latency_seconds)
+
+
+def _monitored(command_name: str):
+    def decorate(method):
+        @functools.wraps(method)
+        async def wrapper(self, *args, **kwargs):
+            await _round_trip(self.database.client)
+            if not self.database.client.event_listeners:
+                return await method(self, *args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return await method(self, *args, **kwargs)
+            finally:
+                _notify(self.database, command_name, started)
+        return wrapper
+    return decorate
+
+
+def _bulk_command_name(requests: list) -> str:
+    kinds = {type(r).__name__.replace("One", "").replace("Many", "").replace("Replace", "Update").lower()
+             for r in requests}
+    return kinds.pop() if len(kinds) == 1 else "update"
+
+
+# Collections
+class MemoryCursor:
+    def __init__(self, collection: "MemoryCollection", query, projection):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort: List[Tuple[str, int]] = []
+        self._skip = 0
+        self._limit = 0
+        self._results: Optional[List[dict]] = None
+
+    def sort(self, key_or_list, direction=None) -> "MemoryCursor":
+        self._sort = _normalize_sort(key_or_list, direction)
+        return self
+
+    def skip(self, count: int) -> "MemoryCursor":
+        self._skip = count
+        return self
+
+    def limit(self, count: int) -> "MemoryCursor":
+        self._limit = count
+        return self
+
+    def batch_size(self, size: int) -> "MemoryCursor":
+        return self
+
+    def _materialize(self) -> List[dict]:
+        if self._results is None:
+            started = time.perf_counter()
+            docs = self._collection._find_documents(self._query)
+            if self._sort:
+                docs = _sort_documents(docs, self._sort)
+            docs = docs[self._skip:]
+            if self._limit:
+                docs = docs[:self._limit]
+            self._results = [_project(d, self._projection) for d in docs]
+            if self._collection.database.client.event_listeners:
+                _notify(self._collection.database, "find", started)
+        return self._results
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        await _round_trip(self._collection.database.client)
+        results = self._materialize()
+        return results[:length] if length else list(results)
+
+    def __aiter__(self):
+        self._iterator = None
+        return self
+
+    async def __anext__(self):
+        if self._iterator is None:
+            await _round_trip(self._collection.database.client)
+            self._iterator = iter(self._materialize())
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class MemoryAggregateCursor:
+    def __init__(self, docs: List[dict], client: Optional["MemoryClient"] = None):
+        self._docs = docs
+        self._client = client
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        if self._client is not None:
+            await _round_trip(self._client)
+        return self._docs[:length] if length else list(self._docs)
+
+    def __aiter__(self):
+        self._iterator = iter(self._docs)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class MemoryCollection:
+    def __init__(self, database: "MemoryDatabase", name: str):
+        self.database = database
+        self.name = name
+        self._docs: Dict[Any, dict] = {}
+        self._positions: Dict[Any, int] = {}
+        self._sequence = itertools.count()
+        self._indexes: Dict[str, _Index] = {}
+
+    # Query planning
+    def _candidate_ids(self, query: Optional[dict]) -> Optional[Iterable]:
+        """Ids worth scanning for a query, or None when no index applies"""
+        if not query:
+            return None
+        best = None
+        clauses = query.get("$and")
+        if isinstance(clauses, list):
+            # Every clause must hold, so any one of them narrows the scan
+            rest = {field: condition for field, condition in query.items() if field != "$and"}
+            for clause in clauses:
+                ids = self._candidate_ids({**rest, **clause})
+                if ids is not None and (best is None or len(ids) < len(best)):
+                    best = ids
+        branches = query.get("$or")
+        if isinstance(branches, list) and branches:
+            rest = {field: condition for field, condition in query.items() if field != "$or"}
+            union = set()
+            for branch in branches:
+                ids = self._candidate_ids({**rest, **branch})
+                if ids is None:
+                    union = None
+                    break
+                union |= set(ids)
+            if union is not None and (best is None or len(union) < len(best)):
+                best = union
+        for field, condition in query.items():
+            if isinstance(condition, dict) and isinstance(condition.get("$elemMatch"), dict):
+                # An element matching every condition matches each one, so the dotted paths narrow the scan
+                rest = {other: value for other, value in query.items() if other != field}
+                paths = {f"{field}.{key}": value for key, value in condition["$elemMatch"].items() if not key.startswith("$")}
+                ids = self._candidate_ids({**rest, **paths}) if paths else None
+                if ids is not None and (best is None or len(ids) < len(best)):
+                    best = ids
+        for index in self._indexes.values():
+            if index.sparse and any(None in (_equality_values(query[field]) or ()) for field in index.fields if field in query):
+                # Documents missing the field match null but are not in a sparse index
+                continue
+            per_field = []
+            for field in index.fields:
+                values = _equality_values(query[field]) if field in query else None
+                if values is None:
+                    break
+                per_field.append([_hashable(v) for v in values])
+            if per_field:
+                # Equality on every field, or on a leading prefix of a compound index
+                entries = index.entries if len(per_field) == len(index.fields) else index.prefix(len(per_field))
+                ids = set()
+                for key in itertools.product(*per_field):
+                    ids |= entries.get(key, set())
+                if best is None or len(ids) < len(best):
+                    best = ids
+            else:
+                condition = query.get(index.fields[0])
+                if isinstance(condition, dict) and condition and set(condition) <= _RANGE_OPERATORS:
+                    ids = index.range(condition)
+                    if best is None or len(ids) < len(best):
+                        best = ids
+        return best
+
+    def _find_documents(self, query: Optional[dict], limit: int = 0) -> List[dict]:
+        ids = self._candidate_ids(query)
+        if ids is None:
+            docs = self._docs.values()
+        else:
+            # Keep insertion order so indexed and unindexed scans return the same sequence
+            docs = [self._docs[i] for i in sorted(ids, key=self._positions.__getitem__)]
+        results = []
+        for doc in docs:
+            if matches(doc, query):
+                results.append(doc)
+                if limit and len(results) >= limit:
+                    break
+        return results
+
+    def _index_add(self, doc: dict) -> None:
+        added = []
+        try:
+            for index in self._indexes.values():
+                index.add(doc["_id"], doc)
+                added.append(index)
+        except DuplicateKeyError:
+            for index in added:
+                index.remove(doc["_id"], doc)
+            raise
+
+    def _index_remove(self, doc: dict) -> None:
+        for index in self._indexes.values():
+            index.remove(doc["_id"], doc)
+
+    def _insert(self, document: dict):
+        doc = _clone(document)
+        doc.setdefault("_id", ObjectId())
+        if doc["_id"] in self._docs:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: _id_")
+        self._index_add(doc)
+        self._docs[doc["_id"]] = doc
+        self._positions[doc["_id"]] = next(self._sequence)
+        # Motor sets _id on the caller's document; mirror that
+        document.setdefault("_id", doc["_id"])
+        return doc["_id"]
+
+    def _update(self, query, update, upsert: bool, multi: bool, array_filters=None, targets=None) -> UpdateResult:
+        if targets is None:
+            targets = self._find_documents(query, limit=0 if multi else 1)
+        if not targets:
+            if not upsert:
+                return UpdateResult(0, 0)
+            doc = _upsert_seed(query)
+            if not any(k.startswith("$") for k in update):
+                doc = _clone(update)
+            else:
+                _apply_update(doc, update, query, array_filters, inserting=True)
+            return UpdateResult(0, 0, self._insert(doc))
+        modified = 0
+        for doc in targets:
+            updated = _clone(doc)
+            _apply_update(updated, update, query, array_filters)
+            if updated != doc:
+                self._index_remove(doc)
+                try:
+                    self._index_add(updated)
+                except DuplicateKeyError:
+                    self._index_add(doc)
+                    raise
+                doc.clear()
+                doc.update(updated)
+                modified += 1
+        return UpdateResult(len(targets), modified)
+
+    # Motor-compatible API
+    @_monitored("insert")
+    async def insert_one(self, document: dict, **kwargs) -> InsertOneResult:
+        return InsertOneResult(self._insert(document))
+
+    @_monitored("insert")
+    async def insert_many(self, documents: List[dict], ordered: bool = True, **kwargs) -> InsertManyResult:
+        return InsertManyResult([self._insert(d) for d in documents])
+
+    @_monitored("find")
+    async def find_one(self, filter: Optional[dict] = None, projection: Optional[dict] = None, sort=None, **kwargs):
+        if sort:
+            docs = _sort_documents(self._find_documents(filter), _normalize_sort(sort))
+        else:
+            docs = self._find_documents(filter, limit=1)
+        return _project(docs[0], projection) if docs else None
+
+    def find(self, filter: Optional[dict] = None, projection: Optional[dict] = None, sort=None,
+             skip: int = 0, limit: int = 0, **kwargs) -> MemoryCursor:
+        cursor = MemoryCursor(self, filter, projection)
+        if sort:
+            cursor.sort(sort)
+        return cursor.skip(skip).limit(limit)
+
+    @_monitored("aggregate")
+    async def count_documents(self, filter: Optional[dict] = None, **kwargs) -> int:
+        if not filter:
+            return len(self._docs)
+        return len(self._find_documents(filter))
+
+    @_monitored("count")
+    async def estimated_document_count(self, **kwargs) -> int:
+        return len(self._docs)
+
+    @_monitored("distinct")
+    async def distinct(self, key: str, filter: Optional[dict] = None, **kwargs) -> list:
+        values = []
+        for doc in self._find_documents(filter):
+            for value in _candidates(doc, key):
+                if not isinstance(value, list) and value not in values:
+                    values.append(value)
+        return values
+
+    @_monitored("update")
+    async def update_one(self, filter: dict, update: dict, upsert: bool = False, array_filters=None, **kwargs) -> UpdateResult:
+        return self._update(filter, update, upsert, multi=False, array_filters=array_filters)
+
+    @_monitored("update")
+    async def update_many(self, filter: dict, update: dict, upsert: bool = False, array_filters=None, **kwargs) -> UpdateResult:
+        return self._update(filter, update, upsert, multi=True, array_filters=array_filters)
+
+    @_monitored("update")
+    async def replace_one(self, filter: dict, replacement: dict, upsert: bool = False, **kwargs) -> UpdateResult:
+        return self._update(filter, replacement, upsert, multi=False)
+
+    @_monitored("findAndModify")
+    async def find_one_and_update(self, filter: dict, update: dict, projection: Optional[dict] = None,
+                                  upsert: bool = False, return_document=ReturnDocument.BEFORE,
+                                  array_filters=None, sort=None, **kwargs):
+        docs = self._find_documents(filter, limit=0 if sort else 1)
+        if sort:
+            docs = _sort_documents(docs, _normalize_sort(sort))[:1]
+        if not docs:
+            if not upsert:
+                return None
+            result = self._update(filter, update, True, multi=False, array_filters=array_filters)
+            if return_document == ReturnDocument.AFTER:
+                return _project(self._docs[result.upserted_id], projection)
+            return None
+        before = _clone(docs[0])
+        self._update(filter, update, False, multi=False, array_filters=array_filters, targets=docs)
+        chosen = self._docs[before["_id"]] if return_document == ReturnDocument.AFTER else before
+        return _project(chosen, projection)
+
+    @_monitored("delete")
+    async def delete_one(self, filter: dict, **kwargs) -> DeleteResult:
+        return self._delete(filter, multi=False)
+
+    @_monitored("delete")
+    async def delete_many(self, filter: dict, **kwargs) -> DeleteResult:
+        return self._delete(filter, multi=True)
+
+    def _delete(self, query, multi: bool) -> DeleteResult:
+        docs = self._find_documents(query, limit=0 if multi else 1)
+        for doc in docs:
+            self._index_remove(doc)
+            del self._docs[doc["_id"]]
+            del self._positions[doc["_id"]]
+        return DeleteResult(len(docs))
+
+    async def bulk_write(self, requests: list, ordered: bool = True, **kwargs) -> BulkWriteResult:
+        await _round_trip(self.database.client)
+        started = time.perf_counter()
+        try:
+            return self._bulk_write(requests)
+        finally:
+            if self.database.client.event_listeners and requests:
+                _notify(self.database, _bulk_command_name(requests), started)
+
+    def _bulk_write(self, requests: list) -> BulkWriteResult:
+        result = BulkWriteResult()
+        for position, request in enumerate(requests):
+            kind = type(request).__name__
+            if kind == "InsertOne":
+                self._insert(request._doc)
+                result.inserted_count += 1
+            elif kind in ("UpdateOne", "UpdateMany", "ReplaceOne"):
+                outcome = self._update(request._filter, request._doc, request._upsert, multi=kind == "UpdateMany",
+                                       array_filters=getattr(request, "_array_filters", None))
+                result.matched_count += outcome.matched_count
+                result.modified_count += outcome.modified_count
+                if outcome.upserted_id is not None:
+                    result.upserted_count += 1
+                    result.upserted_ids[position] = outcome.upserted_id
+            elif kind in ("DeleteOne", "DeleteMany"):
+                result.deleted_count += self._delete(request._filter, multi=kind == "DeleteMany").deleted_count
+            else:
+                raise NotImplementedError(f"Bulk operation {kind} is not supported by the memory backend")
+        return result
+
+    def aggregate(self, pipeline: List[dict], **kwargs) -> MemoryAggregateCursor:
+        started = time.perf_counter()
+        docs = list(self._docs.values())
+        if pipeline and "$match" in pipeline[0]:
+            docs = self._find_documents(pipeline[0]["$match"])
+            pipeline = pipeline[1:]
+        cursor = MemoryAggregateCursor([_clone(d) for d in _run_pipeline(docs, pipeline)], self.database.client)
+        if self.database.client.event_listeners:
+            _notify(self.database, "aggregate", started)
+        return cursor
+
+    @_monitored("createIndexes")
+    async def create_index(self, keys, unique: bool = False, name: Optional[str] = None, sparse: bool = False,
+                           **kwargs) -> str:
+        fields = [k for k, _ in _normalize_sort(keys)]
+        name = name or "_".join(f"{k}_{d}" for k, d in _normalize_sort(keys))
+        if name not in self._indexes:
+            index = _Index(name, fields, unique, sparse)
+            for doc_id, doc in self._docs.items():
+                index.add(doc_id, doc)
+            self._indexes[name] = index
+        return name
+
+    async def create_indexes(self, models: list, **kwargs) -> List[str]:
+        names = []
+        for model in models:
+            document = model.document
+            names.append(await self.create_index(list(document["key"].items()), unique=document.get("unique", False),
+                                                 name=document.get("name"), sparse=document.get("sparse", False)))
+        return names
+
+    async def index_information(self) -> dict:
+        info = {"_id_": {"key": [("_id", 1)]}}
+        for name, index in self._indexes.items():
+            info[name] = {"key": [(f, 1) for f in index.fields], "unique": index.unique}
+        return info
+
+    async def drop(self) -> None:
+        await self.database.drop_collection(self.name)
+
+
+class MemoryDatabase:
+    def __init__(self, client: "MemoryClient", name: str):
+        self.client = client
+        self.name = name
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(self, name)
+        return self._collections[name]
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_collection(self, name: str, **kwargs) -> MemoryCollection:
+        return self[name]
+
+    async def list_collection_names(self, **kwargs) -> List[str]:
+        return [name for name, collection in self._collections.items() if collection._docs]
+
+    async def drop_collection(self, name: str) -> None:
+        self._collections.pop(name, None)
+
+    async def command(self, command, **kwargs) -> dict:
+        if command == "ping" or command == {"ping": 1}:
+            return {"ok": 1.0}
+        raise NotImplementedError(f"Command {command} is not supported by the memory backend")
+
+
+class MemoryClient:
+    """In-process stand-in for ``AsyncIOMotorClient``"""
+
+    def __init__(self, event_listeners: Optional[list] = None, latency_seconds: float = 0.0):
+        self._databases: Dict[str, MemoryDatabase] = {}
+        self.latency_seconds = latency_seconds
+        # There is no connection pool to report on
+        self.event_listeners = [listener for listener in event_listeners or [] if isinstance(listener, monitoring.CommandListener)]
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        if name not in self._databases:
+            self._databases[name] = MemoryDatabase(self, name)
+        return self._databases[name]
+
+    def get_database(self, name: str, **kwargs) -> MemoryDatabase:
+        return self[name]
+
+    def close(self) -> None:
+        pass
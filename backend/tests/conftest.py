@@ -0,0 +1,78 @@
+"""Shared setup: the API running on the in-process memory backend with the demo data.
+
+Tests are plain functions that hand a coroutine to the ``run`` fixture; each
+run starts the app's lifespan on a fresh memory database.
+"""
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+os.environ.update(
+    STORAGE_BACKEND="memory",
+    DB_NAME="clothpos_test",
+    JWT_SECRET="test-secret",
+    SEED_DEMO_DATA="true",
+    ANALYTICS_EXPORT_INTERVAL_MINUTES="0",
+    BILL_ARCHIVE_INTERVAL_HOURS="0",
+    RECONCILE_INTERVAL_HOURS="0",
+)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import httpx  # noqa: E402
+import pytest  # noqa: E402
+
+PASSWORDS = {"admin": "admin123", "john": "demo123", "jane": "demo123"}
+
+
+class Api:
+    def __init__(self, server, client: httpx.AsyncClient):
+        self.server = server
+        self.db = server.db
+        self.client = client
+        self._headers = {}
+
+    async def headers(self, username: str) -> dict:
+        if username not in self._headers:
+            response = await self.client.post("/api/auth/login", json={"username": username, "password": PASSWORDS[username]})
+            self._headers[username] = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        return self._headers[username]
+
+    async def get(self, path: str, user: str = "admin", **kwargs) -> httpx.Response:
+        return await self.client.get(path, headers=await self.headers(user), **kwargs)
+
+    async def post(self, path: str, user: str = "admin", **kwargs) -> httpx.Response:
+        return await self.client.post(path, headers=await self.headers(user), **kwargs)
+
+    async def sell(self, items: list, user: str = "john") -> dict:
+        response = await self.post("/api/billing", user, json={
+            "customerPhoneNumber": "+15550001111", "items": items, "paymentMethod": "cash"
+        })
+        assert response.status_code == 200, response.text
+        return response.json()
+
+    async def stock(self, sku: str, branch_id: str = "branch-1") -> int:
+        level = await self.db.inventory.find_one({"sku": sku, "branchId": branch_id}, {"_id": 0, "quantity": 1})
+        return level["quantity"] if level else 0
+
+
+@pytest.fixture
+def run(tmp_path):
+    import server
+
+    server.columnar.root = tmp_path / "analytics_data"
+
+    def run_scenario(scenario):
+        async def main():
+            # Caches keyed by version stamps outlive the database between runs,
+            # and the background queues are bound to the previous run's event loop
+            server.sales_report_cache.clear()
+            server.cache_bus.stamps.clear()
+            server.commission_pipeline.queue = asyncio.Queue()
+            server.sales_counters.queue = asyncio.Queue()
+            async with server.app.router.lifespan_context(server.app):
+                async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test") as client:
+                    await scenario(Api(server, client))
+        asyncio.run(main())
+
+    return run_scenario
@@ -0,0 +1,49 @@
+import pytest
+
+import archive
+
+
+def test_sales_analytics_before_the_first_export_are_empty(run):
+    async def scenario(api):
+        response = await api.get("/api/analytics/sales")
+        assert response.status_code == 200, response.text
+        body = response.json()
+        assert body["totals"] == {"bills": 0, "returns": 0, "netRevenue": 0, "totalDiscount": 0}
+        assert body["rows"] == []
+
+        # An export with no bills leaves the directories without data files
+        await api.server.columnar.run()
+        assert (await api.get("/api/analytics/sales", params={"group_by": "sku"})).status_code == 200
+
+    run(scenario)
+
+
+def test_sales_analytics_read_the_export(run, monkeypatch):
+    async def scenario(api):
+        monkeypatch.setattr(api.server.columnar, "settle_seconds", 0)
+        bill = await api.sell([{"sku": "TSH-RED-S", "quantity": 2}, {"sku": "TSH-RED-M", "quantity": 1}])
+        await api.post("/api/billing/return", "john", json={"originalBillId": bill["id"], "items": [{"sku": "TSH-RED-M", "quantity": 1}]})
+        await api.server.columnar.run()
+
+        body = (await api.get("/api/analytics/sales", params={"group_by": "sku"})).json()
+        assert (body["totals"]["bills"], body["totals"]["returns"]) == (1, 1)
+        assert body["totals"]["netRevenue"] == pytest.approx(bill["totalAmount"] - 29.99)
+        assert {row["sku"]: row["quantity"] for row in body["rows"]} == {"TSH-RED-S": 2, "TSH-RED-M": 0}
+
+    run(scenario)
+
+
+def test_a_bill_caught_mid_archive_is_exported_once(run, monkeypatch):
+    async def scenario(api):
+        monkeypatch.setattr(api.server.columnar, "settle_seconds", 0)
+        bill = await api.sell([{"sku": "TSH-RED-S", "quantity": 2}])
+        # Copied into its archive month, not yet deleted from the hot collection
+        stored = await api.db.bills.find_one({"id": bill["id"]}, {"_id": 0})
+        await api.db[archive.collection_name(archive.month_of(stored["createdAt"]))].insert_one(stored)
+        await api.server.columnar.run()
+
+        body = (await api.get("/api/analytics/sales", params={"group_by": "sku"})).json()
+        assert body["totals"]["bills"] == 1
+        assert {row["sku"]: row["quantity"] for row in body["rows"]} == {"TSH-RED-S": 2}
+
+    run(scenario)
@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+
+async def balance(api, employee_id: str = "emp-1") -> dict:
+    return await api.db.commission_balances.find_one({"employeeId": employee_id}, {"_id": 0}) or {}
+
+
+def test_a_full_return_cancels_the_sale_commission_exactly(run):
+    async def scenario(api):
+        bill = await api.sell([{"sku": "TSH-RED-S", "quantity": 3}, {"sku": "TSH-RED-M", "quantity": 1}])
+        await api.server.commission_pipeline.flush()
+        assert (await balance(api))["pending"] > 0
+
+        response = await api.post("/api/billing/return", "john", json={"originalBillId": bill["id"], "items": [
+            {"sku": "TSH-RED-S", "quantity": 3}, {"sku": "TSH-RED-M", "quantity": 1}
+        ]})
+        assert response.status_code == 200
+        await api.server.commission_pipeline.flush()
+        assert (await balance(api))["pending"] == 0
+        summary = (await api.get("/api/commissions/all", params={"view": "summary"})).json()
+        assert summary["pending"] == 0
+
+    run(scenario)
+
+
+def test_finishing_an_interrupted_batch_does_not_apply_it_twice(run):
+    async def scenario(api):
+        pipeline = api.server.commission_pipeline
+        await api.sell([{"sku": "TSH-RED-S", "quantity": 1}])
+        await pipeline.flush()
+        applied = await balance(api)
+        assert applied["count"] == 1
+
+        # Crash after the balance moved but before the rows were flagged
+        await api.db.commissions.update_many({}, {"$set": {"balanced": False}})
+        assert await pipeline.finish_claimed() == 1
+        assert (await balance(api))["pending"] == applied["pending"]
+        assert await api.db.commissions.count_documents({"balanced": False}) == 0
+
+    run(scenario)
+
+
+def test_a_batch_claimed_before_a_crash_is_applied_on_replay(run, monkeypatch):
+    async def scenario(api):
+        pipeline = api.server.commission_pipeline
+        bill = await api.sell([{"sku": "TSH-RED-S", "quantity": 1}])
+        await pipeline.flush()
+        before = await balance(api)
+
+        # The next batch is claimed, then the worker dies before touching the balances
+        async def crash(batch_id):
+            raise RuntimeError("worker died")
+        second = await api.sell([{"sku": "TSH-RED-M", "quantity": 2}])
+        with monkeypatch.context() as patch:
+            patch.setattr(pipeline, "_apply", crash)
+            await pipeline.flush()
+        row = await api.db.commissions.find_one({"billId": second["id"]}, {"_id": 0})
+        assert row["batchId"] and not row["balanced"]
+
+        await api.db.bills.update_many({"id": second["id"]}, {"$set": {"createdAt": "2024-01-01T00:00:00+00:00"}})
+        assert await pipeline.replay() == 1
+        after = await balance(api)
+        assert after["count"] == before["count"] + 1
+        assert after["pending"] == pytest.approx(before["pending"] + row["commissionAmount"])
+        assert bill["id"] != second["id"]
+
+    run(scenario)
+
+
+def test_concurrent_accruals_of_the_same_bills_apply_once(run):
+    async def scenario(api):
+        pipeline = api.server.commission_pipeline
+        bill = await api.sell([{"sku": "TSH-RED-S", "quantity": 2}])
+        await pipeline.flush()
+        before = await balance(api)
+        stored = await api.db.bills.find_one({"id": bill["id"]}, {"_id": 0})
+
+        # The same unaccrued bill picked up by a live worker and a replay at once
+        await api.db.commissions.delete_many({})
+        await api.db.commission_balances.delete_many({})
+        await asyncio.gather(pipeline.accrue([stored]), pipeline.accrue([stored]), pipeline.accrue([stored]))
+        after = await balance(api)
+        assert (after["count"], after["pending"]) == (1, before["pending"])
+
+    run(scenario)
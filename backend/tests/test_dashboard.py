@@ -0,0 +1,27 @@
+import asyncio
+
+
+def test_a_request_after_a_sale_does_not_join_an_older_computation(run, monkeypatch):
+    import server
+
+    computed = server.compute_dashboard_stats
+    release = asyncio.Event()
+
+    async def held(current_user):
+        stats = await computed(current_user)
+        await release.wait()
+        return stats
+
+    monkeypatch.setattr(server, "compute_dashboard_stats", held)
+
+    async def scenario(api):
+        before = asyncio.ensure_future(api.get("/api/dashboard/stats"))
+        await asyncio.sleep(0.05)
+        await api.sell([{"sku": "TSH-RED-S", "quantity": 1}])
+        after = asyncio.ensure_future(api.get("/api/dashboard/stats"))
+        await asyncio.sleep(0.05)
+        release.set()
+        before, after = (await before).json(), (await after).json()
+        assert after["totalTransactions"] == before["totalTransactions"] + 1
+
+    run(scenario)
@@ -0,0 +1,31 @@
+async def etag(api, **params) -> str:
+    response = await api.get("/api/products", params=params)
+    assert response.status_code == 200
+    return response.headers["etag"]
+
+
+def test_sales_only_revalidate_stock_bearing_product_lists(run):
+    async def scenario(api):
+        full, names = await etag(api), await etag(api, fields="id,name")
+        await api.sell([{"sku": "TSH-RED-S", "quantity": 1}])
+
+        assert await etag(api, fields="id,name") == names
+        assert await etag(api) != full
+        headers = {**await api.headers("admin"), "If-None-Match": names}
+        response = await api.client.get("/api/products", params={"fields": "id,name"}, headers=headers)
+        assert response.status_code == 304
+
+    run(scenario)
+
+
+def test_low_stock_sees_a_sale_immediately(run):
+    async def scenario(api):
+        def quantity(rows):
+            return next(row["currentStock"] for row in rows if row["sku"] == "TSH-RED-S")
+
+        before = (await api.get("/api/inventory/low-stock", params={"threshold": 10000})).json()
+        await api.sell([{"sku": "TSH-RED-S", "quantity": 1}])
+        after = (await api.get("/api/inventory/low-stock", params={"threshold": 10000})).json()
+        assert quantity(after) == quantity(before) - 1
+
+    run(scenario)
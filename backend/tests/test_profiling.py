@@ -0,0 +1,22 @@
+import uuid
+
+
+def test_coalesced_work_is_sampled_for_the_profiled_request(run):
+    async def scenario(api):
+        bill = await api.sell([{"sku": "TSH-RED-S", "quantity": 1}])
+        bill.pop("_id", None)
+        await api.db.bills.insert_many([{**bill, "id": str(uuid.uuid4())} for _ in range(3000)])
+
+        response = await api.post("/api/admin/profiling", json={"route": "/api/reports/sales", "fraction": 1, "intervalMs": 1})
+        assert response.status_code == 200
+        try:
+            for day in range(1, 4):
+                # A new range each time, so every request renders
+                response = await api.get("/api/reports/sales", params={"start_date": f"2000-01-0{day}"})
+                assert response.status_code == 200
+            stacks = (await api.get("/api/admin/profiling/stacks", params={"route": "/api/reports/sales"})).text
+        finally:
+            await api.client.delete("/api/admin/profiling", headers=await api.headers("admin"))
+        assert ":render_sales_report:" in stacks
+
+    run(scenario)
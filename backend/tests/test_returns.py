@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+
+def test_partial_returns_accumulate_until_the_bill_is_fully_returned(run):
+    async def scenario(api):
+        bill = await api.sell([{"sku": "TSH-RED-S", "quantity": 3}])
+        before = await api.stock("TSH-RED-S")
+
+        response = await api.post("/api/billing/return", "john", json={"originalBillId": bill["id"], "items": [{"sku": "TSH-RED-S", "quantity": 1}]})
+        assert response.status_code == 200
+        assert response.json()["refundAmount"] == pytest.approx(29.99)
+        stored = await api.db.bills.find_one({"id": bill["id"]}, {"_id": 0})
+        assert stored["status"] == "partial-return"
+        assert stored["returnedQuantities"] == [{"sku": "TSH-RED-S", "quantity": 1}]
+
+        response = await api.post("/api/billing/return", "john", json={"originalBillId": bill["id"], "items": [{"sku": "TSH-RED-S", "quantity": 3}]})
+        assert response.status_code == 400
+
+        response = await api.post("/api/billing/return", "john", json={"originalBillId": bill["id"], "items": [{"sku": "TSH-RED-S", "quantity": 2}]})
+        assert response.status_code == 200
+        stored = await api.db.bills.find_one({"id": bill["id"]}, {"_id": 0})
+        assert stored["status"] == "returned"
+        assert await api.stock("TSH-RED-S") == before + 3
+
+    run(scenario)
+
+
+def test_duplicate_sku_lines_are_returned_together_at_their_own_prices(run):
+    async def scenario(api):
+        bill = await api.sell([{"sku": "TSH-RED-S", "quantity": 2}, {"sku": "TSH-RED-M", "quantity": 1}, {"sku": "TSH-RED-S", "quantity": 1}])
+        # A price change between the two lines of a bill
+        await api.db.bills.update_one({"id": bill["id"]}, {"$set": {"items.2.unitPrice": 20.0, "items.2.lineTotal": 20.0}})
+
+        response = await api.post("/api/billing/return", "john", json={"originalBillId": bill["id"], "items": [{"sku": "TSH-RED-S", "quantity": 3}]})
+        assert response.status_code == 200
+        assert response.json()["refundAmount"] == pytest.approx(2 * 29.99 + 20.0)
+        return_bill = await api.db.bills.find_one({"id": response.json()["returnBillId"]}, {"_id": 0})
+        assert [(item["quantity"], item["unitPrice"]) for item in return_bill["items"]] == [(2, 29.99), (1, 20.0)]
+
+        stored = await api.db.bills.find_one({"id": bill["id"]}, {"_id": 0})
+        assert stored["status"] == "partial-return"
+        response = await api.post("/api/billing/return", "john", json={"originalBillId": bill["id"], "items": [{"sku": "TSH-RED-M", "quantity": 1}]})
+        assert response.status_code == 200
+        assert (await api.db.bills.find_one({"id": bill["id"]}, {"_id": 0}))["status"] == "returned"
+
+    run(scenario)
+
+
+def test_concurrent_returns_cannot_exceed_the_sold_quantity(run):
+    async def scenario(api):
+        bill = await api.sell([{"sku": "TSH-RED-S", "quantity": 2}])
+        before = await api.stock("TSH-RED-S")
+        user = await api.db.employees.find_one({"username": "john"}, {"_id": 0})
+        request = api.server.ReturnRequest(originalBillId=bill["id"], items=[{"sku": "TSH-RED-S", "quantity": 2}])
+
+        outcomes = await asyncio.gather(
+            api.server.process_return(request, user), api.server.process_return(request, user), return_exceptions=True
+        )
+        assert sum(1 for outcome in outcomes if isinstance(outcome, dict)) == 1
+        assert [outcome.status_code for outcome in outcomes if isinstance(outcome, HTTPException)] in ([409], [400])
+        assert await api.stock("TSH-RED-S") == before + 2
+
+    run(scenario)
+
+
+def test_bills_returned_before_the_list_form_still_validate_and_cap_returns(run):
+    async def scenario(api):
+        bill = await api.sell([{"sku": "TSH-RED-S", "quantity": 2}])
+        await api.db.bills.update_one({"id": bill["id"]}, {"$set": {"status": "partial-return", "returnedQuantities": {"TSH-RED-S": 1}}})
+
+        response = await api.post("/api/billing/return", "john", json={"originalBillId": bill["id"], "items": [{"sku": "TSH-RED-S", "quantity": 2}]})
+        assert response.status_code == 400
+        listed = (await api.get("/api/billing", "john", params={"fields": "returnedQuantities"})).json()
+        assert {"sku": "TSH-RED-S", "quantity": 1} in next(row for row in listed if row["id"] == bill["id"])["returnedQuantities"]
+        response = await api.post("/api/billing/return", "john", json={"originalBillId": bill["id"], "items": [{"sku": "TSH-RED-S", "quantity": 1}]})
+        assert response.status_code == 200
+        stored = await api.db.bills.find_one({"id": bill["id"]}, {"_id": 0})
+        assert (stored["status"], stored["returnedQuantities"]) == ("returned", [{"sku": "TSH-RED-S", "quantity": 2}])
+
+    run(scenario)
+
+
+def test_archived_bills_take_partial_returns(run):
+    async def scenario(api):
+        bill = await api.sell([{"sku": "TSH-RED-S", "quantity": 2}])
+        await api.server.sales_counters.flush()
+        await api.db.bills.update_one({"id": bill["id"]}, {"$set": {"createdAt": "2024-01-15T10:00:00+00:00", "commissionAccrued": True}})
+        await api.server.bill_archive.run(180)
+        assert await api.db.bills.find_one({"id": bill["id"]}) is None
+
+        for expected in ("partial-return", "returned"):
+            response = await api.post("/api/billing/return", "john", json={"originalBillId": bill["id"], "items": [{"sku": "TSH-RED-S", "quantity": 1}]})
+            assert response.status_code == 200
+            assert (await api.server.bill_archive.get_bill(bill["id"]))["status"] == expected
+
+    run(scenario)
@@ -0,0 +1,77 @@
+import pytest
+
+import sales_analytics
+
+
+async def sold(api, sku: str = "TSH-RED-S") -> int:
+    rows = (await api.get("/api/analytics/top-products", params={"by": "sku", "limit": 100})).json()
+    return next((row["quantity"] for row in rows if row["sku"] == sku), 0)
+
+
+def test_checkout_counts_sales_in_the_background(run):
+    async def scenario(api):
+        before = await sold(api)
+        bill = await api.sell([{"sku": "TSH-RED-S", "quantity": 2}, {"sku": "TSH-RED-S", "quantity": 1}])
+        await api.server.sales_counters.flush()
+        assert await sold(api) == before + 3
+        assert (await api.db.bills.find_one({"id": bill["id"]}))["countersRecorded"] is True
+
+        response = await api.post("/api/billing/return", "john", json={"originalBillId": bill["id"], "items": [{"sku": "TSH-RED-S", "quantity": 1}]})
+        assert response.status_code == 200
+        await api.server.sales_counters.flush()
+        assert await sold(api) == before + 2
+
+    run(scenario)
+
+
+def test_replay_counts_bills_left_unrecorded_once(run):
+    async def scenario(api):
+        counters = api.server.sales_counters
+        before = await sold(api)
+        bill = await api.sell([{"sku": "TSH-RED-S", "quantity": 2}])
+        await counters.flush()
+
+        # Crash after the bill was saved but before its batch ran
+        await api.db.bills.update_one({"id": bill["id"]}, {"$set": {"countersRecorded": False}})
+        await api.db.sales_counters.update_many({"key": "TSH-RED-S"}, {"$inc": {"quantity": -2}})
+        assert await counters.replay(settle_seconds=0) == 1
+        assert await counters.replay(settle_seconds=0) == 0
+        assert await sold(api) == before + 2
+
+    run(scenario)
+
+
+def test_a_rebuild_does_not_count_queued_bills_twice(run):
+    async def scenario(api):
+        counters = api.server.sales_counters
+        before = await sold(api)
+        await api.sell([{"sku": "TSH-RED-S", "quantity": 2}])
+        await counters.rebuild()
+        await counters.flush()
+        assert await sold(api) == before + 2
+
+    run(scenario)
+
+
+def test_a_failed_batch_is_released_for_replay(run, monkeypatch):
+    async def scenario(api):
+        counters = api.server.sales_counters
+        before = await sold(api)
+        bill = await api.sell([{"sku": "TSH-RED-S", "quantity": 2}])
+        await counters.flush()
+        await api.db.bills.update_one({"id": bill["id"]}, {"$set": {"countersRecorded": False}})
+        await api.db.sales_counters.update_many({"key": "TSH-RED-S"}, {"$inc": {"quantity": -2}})
+
+        def unavailable(*args, **kwargs):
+            raise ConnectionError("counter write failed")
+
+        monkeypatch.setattr(sales_analytics, "UpdateOne", unavailable)
+        with pytest.raises(ConnectionError):
+            await counters.record([bill])
+        assert (await api.db.bills.find_one({"id": bill["id"]}))["countersRecorded"] is False
+
+        monkeypatch.undo()
+        assert await counters.replay(settle_seconds=0) == 1
+        assert await sold(api) == before + 2
+
+    run(scenario)
@@ -0,0 +1,57 @@
+import storage
+
+
+def test_cached_reports_are_not_rendered_from_a_lagging_secondary(run, monkeypatch):
+    import server
+
+    # A secondary that has not replicated anything yet
+    secondary = storage.create_client("memory")["clothpos_test"]
+    monkeypatch.setattr(server, "analytics_db", secondary)
+    monkeypatch.setattr(server.bill_archive, "read_db", secondary)
+    monkeypatch.setattr(server.sales_counters, "read_db", secondary)
+
+    async def scenario(api):
+        bill = await api.sell([{"sku": "TSH-RED-S", "quantity": 2}])
+        await api.server.sales_counters.flush()
+        for _ in range(2):
+            report = (await api.get("/api/reports/sales")).json()
+            assert bill["id"] in [row["id"] for row in report["bills"]]
+            assert report["topProducts"]
+        assert api.server.sales_report_cache.size() == 1
+
+    run(scenario)
+
+
+def test_an_archive_run_drops_reports_cached_while_it_moved_bills(run):
+    async def scenario(api):
+        bill = await api.sell([{"sku": "TSH-RED-S", "quantity": 2}])
+        await api.server.commission_pipeline.flush()
+        await api.server.sales_counters.flush()
+        await api.db.bills.update_one({"id": bill["id"]}, {"$set": {"createdAt": "2024-01-15T10:00:00+00:00"}})
+        params = {"start_date": "2024-01-01T00:00:00+00:00", "end_date": "2024-01-31T23:59:59+00:00"}
+        before = (await api.get("/api/reports/sales", params=params)).json()
+        key = api.server.report_cache.report_key(params["start_date"], params["end_date"], None, None)
+        assert api.server.sales_report_cache.get(key) is not None
+
+        assert (await api.server.bill_archive.run(180))["moved"] == 1
+        assert api.server.sales_report_cache.get(key) is None
+        after = (await api.get("/api/reports/sales", params=params)).json()
+        assert (after["totalTransactions"], after["totalSales"]) == (before["totalTransactions"], before["totalSales"])
+
+    run(scenario)
+
+
+def test_branch_and_employee_filters_apply_to_the_counters_too(run):
+    async def scenario(api):
+        await api.sell([{"sku": "TSH-RED-S", "quantity": 2}])
+        await api.server.sales_counters.flush()
+
+        elsewhere = (await api.get("/api/reports/sales", params={"branch_id": "branch-2", "employee_id": "emp-1"})).json()
+        assert elsewhere["totalTransactions"] == 0
+        assert elsewhere["topProducts"] == elsewhere["salesByCategory"] == []
+        here = (await api.get("/api/reports/sales", params={"branch_id": "branch-1", "employee_id": "emp-1"})).json()
+        assert sum(row["quantity"] for row in here["topProducts"]) == sum(
+            item["quantity"] for bill in here["bills"] for item in bill["items"]
+        )
+
+    run(scenario)
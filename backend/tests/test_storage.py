@@ -0,0 +1,145 @@
+"""Query, update and aggregation semantics of the in-memory engine, with and without indexes"""
+import asyncio
+
+import pytest
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+import storage
+
+DOCS = [
+    {"id": "a", "sku": "S1", "qty": 5, "tags": ["red", "sale"], "items": [{"sku": "S1", "quantity": 2}], "batchId": "b1"},
+    {"id": "b", "sku": "S2", "qty": 0, "tags": ["blue"], "items": [{"sku": "S2", "quantity": 1}, {"sku": "S3", "quantity": 4}]},
+    {"id": "c", "sku": "S3", "qty": 12, "tags": [], "items": [], "batchId": None},
+]
+INDEXES = [("id", {"unique": True}), ("sku", {}), ("batchId", {"sparse": True}), ("items.sku", {}), ([("sku", 1), ("qty", 1)], {})]
+
+
+def scenario(indexed: bool):
+    def decorate(test):
+        def run():
+            async def main():
+                collection = storage.create_client("memory")["test"]["docs"]
+                if indexed:
+                    for keys, options in INDEXES:
+                        await collection.create_index(keys, **options)
+                await collection.insert_many([dict(doc) for doc in DOCS])
+                await test(collection)
+            asyncio.run(main())
+        return run
+    return decorate
+
+
+@pytest.mark.parametrize("indexed", [False, True])
+@pytest.mark.parametrize("query, expected", [
+    ({"sku": "S1"}, ["a"]),
+    ({"sku": {"$in": ["S1", "S3"]}}, ["a", "c"]),
+    ({"sku": {"$nin": ["S1", "S3"]}}, ["b"]),
+    ({"qty": {"$ne": 0}}, ["a", "c"]),
+    ({"qty": {"$gt": 0, "$lte": 5}}, ["a"]),
+    ({"sku": {"$gte": "S2", "$lt": "S3"}}, ["b"]),
+    ({"batchId": None}, ["b", "c"]),
+    ({"batchId": {"$exists": False}}, ["b"]),
+    ({"batchId": {"$in": [None, "b1"]}}, ["a", "b", "c"]),
+    ({"tags": "sale"}, ["a"]),
+    ({"tags": ["blue"]}, ["b"]),
+    ({"tags": []}, ["c"]),
+    ({"items.sku": "S3"}, ["b"]),
+    ({"items": {"$elemMatch": {"sku": "S3", "quantity": {"$gte": 4}}}}, ["b"]),
+    ({"items": {"$elemMatch": {"sku": "S2", "quantity": {"$gte": 4}}}}, []),
+    ({"items": {"$elemMatch": {"sku": {"$gte": "S3", "$lt": "S4"}}}}, ["b"]),
+    ({"$or": [{"sku": "S1"}, {"qty": 12}]}, ["a", "c"]),
+    ({"$and": [{"sku": {"$in": ["S1", "S2"]}}, {"qty": {"$lt": 1}}]}, ["b"]),
+    ({"sku": "S1", "qty": 5}, ["a"]),
+    ({"sku": "S1", "qty": 6}, []),
+])
+def test_find_filters(indexed, query, expected):
+    @scenario(indexed)
+    async def check(collection):
+        assert [doc["id"] async for doc in collection.find(query, {"_id": 0, "id": 1})] == expected
+        assert await collection.count_documents(query) == len(expected)
+    check()
+
+
+@pytest.mark.parametrize("indexed", [False, True])
+def test_updates(indexed):
+    @scenario(indexed)
+    async def check(collection):
+        result = await collection.update_many({"batchId": None}, {"$set": {"batchId": "b2"}})
+        assert result.matched_count == 2
+        assert await collection.count_documents({"batchId": "b2"}) == 2
+
+        await collection.update_one({"id": "a"}, {"$inc": {"qty": -2, "stats.sold": 2}, "$push": {"tags": {"$each": ["x", "y"], "$slice": -3}}})
+        doc = await collection.find_one({"id": "a"}, {"_id": 0})
+        assert (doc["qty"], doc["stats"], doc["tags"]) == (3, {"sold": 2}, ["sale", "x", "y"])
+
+        await collection.update_one({"id": "a"}, {"$addToSet": {"tags": {"$each": ["x", "z"]}}, "$unset": {"batchId": ""}})
+        doc = await collection.find_one({"id": "a"}, {"_id": 0})
+        assert doc["tags"] == ["sale", "x", "y", "z"] and "batchId" not in doc
+
+        # Guarded updates only apply while the guard holds
+        assert (await collection.update_one({"id": "a", "tags": {"$ne": "z"}}, {"$inc": {"qty": 1}})).matched_count == 0
+
+        result = await collection.update_one({"id": "d"}, {"$set": {"sku": "S4"}, "$setOnInsert": {"qty": 1}}, upsert=True)
+        assert result.upserted_id is not None
+        await collection.update_one({"id": "d"}, {"$set": {"sku": "S4"}, "$setOnInsert": {"qty": 99}}, upsert=True)
+        assert (await collection.find_one({"id": "d"}, {"_id": 0}))["qty"] == 1
+
+        after = await collection.find_one_and_update({"id": "c"}, {"$inc": {"qty": 1}}, return_document=ReturnDocument.AFTER)
+        assert after["qty"] == 13
+    check()
+
+
+def test_unique_and_sparse_indexes():
+    @scenario(indexed=True)
+    async def check(collection):
+        with pytest.raises(DuplicateKeyError):
+            await collection.insert_one({"id": "a"})
+        # A failed insert leaves no trace in the other indexes
+        assert await collection.count_documents({"sku": "S1"}) == 1
+        await collection.insert_one({"id": "e", "sku": "S9"})
+        assert sorted([doc["id"] async for doc in collection.find({"batchId": None})]) == ["b", "c", "e"]
+    check()
+
+
+@pytest.mark.parametrize("indexed", [False, True])
+def test_sort_skip_limit_and_projection(indexed):
+    @scenario(indexed)
+    async def check(collection):
+        docs = await collection.find({}, {"_id": 0, "id": 1, "items.sku": 1}).sort([("qty", -1)]).skip(1).limit(1).to_list(None)
+        assert docs == [{"id": "a", "items": [{"sku": "S1"}]}]
+        excluded = await collection.find_one({"id": "b"}, {"_id": 0, "items": 0, "tags": 0})
+        assert set(excluded) == {"id", "sku", "qty"}
+    check()
+
+
+@pytest.mark.parametrize("indexed", [False, True])
+def test_aggregation_and_distinct(indexed):
+    @scenario(indexed)
+    async def check(collection):
+        groups = await collection.aggregate([
+            {"$match": {"qty": {"$gte": 0}}},
+            {"$group": {
+                "_id": {"$gt": ["$qty", 1]},
+                "total": {"$sum": "$qty"},
+                "positive": {"$sum": {"$cond": [{"$gt": ["$qty", 0]}, 1, 0]}},
+                "count": {"$sum": 1},
+            }},
+            {"$sort": {"total": 1}},
+        ]).to_list(None)
+        assert [(group["_id"], group["total"], group["positive"], group["count"]) for group in groups] == [(False, 0, 0, 1), (True, 17, 2, 2)]
+        assert sorted(await collection.distinct("items.sku")) == ["S1", "S2", "S3"]
+        assert await collection.distinct("batchId", {"batchId": {"$ne": None}}) == ["b1"]
+    check()
+
+
+def test_bulk_write_reports_every_operation():
+    @scenario(indexed=True)
+    async def check(collection):
+        result = await collection.bulk_write([
+            UpdateOne({"id": "a"}, {"$inc": {"qty": 1}}),
+            UpdateOne({"id": "z"}, {"$setOnInsert": {"qty": 0}}, upsert=True),
+        ], ordered=False)
+        assert (result.matched_count, result.upserted_count) == (1, 1)
+        assert await collection.count_documents({}) == 4
+    check()
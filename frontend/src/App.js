@@ -1214,6 +1214,7 @@ const CustomersTab = () => {
   const [searchPhone, setSearchPhone] = useState("");
   const [selectedCustomer, setSelectedCustomer] = useState(null);
   const [customerBills, setCustomerBills] = useState([]);
+  const [billsCursor, setBillsCursor] = useState(null);
 
   const handleSearch = async () => {
     try {
@@ -1228,10 +1229,15 @@ const CustomersTab = () => {
     }
   };
 
-  const fetchCustomerBills = async (customerId) => {
+  const fetchCustomerBills = async (customerId, cursor = null) => {
     try {
-      const response = await axios.get(`${API}/customers/${customerId}/bills`);
-      setCustomerBills(response.data);
+      const response = await axios.get(`${API}/customers/${customerId}/bills`, {
+        params: cursor ? { cursor } : {},
+      });
+      setCustomerBills((previous) =>
+        cursor ? [...previous, ...response.data.bills] : response.data.bills
+      );
+      setBillsCursor(response.data.nextCursor);
     } catch (error) {
       toast.error("Failed to fetch customer bills");
     }
@@ -1277,7 +1283,29 @@ const CustomersTab = () => {
                       <div className="text-sm text-gray-600">
                         Loyalty Points
                       </div>
-                      <div className="font-bold">{customer.loyaltyPoints}</div>
+                      <div className="font-bold">
+                        {Math.floor(customer.loyaltyPoints)}
+                      </div>
+                    </div>
+                  </div>
+                  <div className="grid grid-cols-3 gap-2 mt-3 text-sm">
+                    <div>
+                      <div className="text-gray-600">Lifetime Value</div>
+                      <div className="font-medium">
+                        ${(customer.lifetimeValue || 0).toFixed(2)}
+                      </div>
+                    </div>
+                    <div>
+                      <div className="text-gray-600">Visits</div>
+                      <div className="font-medium">{customer.visitCount || 0}</div>
+                    </div>
+                    <div>
+                      <div className="text-gray-600">Last Visit</div>
+                      <div className="font-medium">
+                        {customer.lastVisit
+                          ? new Date(customer.lastVisit).toLocaleDateString()
+                          : "N/A"}
+                      </div>
                     </div>
                   </div>
                 </div>
@@ -1329,6 +1357,16 @@ const CustomersTab = () => {
               ))
             )}
           </div>
+          {billsCursor && (
+            <Button
+              variant="outline"
+              className="w-full mt-4"
+              onClick={() => fetchCustomerBills(selectedCustomer.id, billsCursor)}
+              data-testid="load-more-customer-bills"
+            >
+              Load more
+            </Button>
+          )}
         </CardContent>
       </Card>
     </div>
@@ -1532,30 +1570,36 @@ const EmployeesTab = () => {
 
 const CommissionsTab = ({ user }) => {
   const [commissions, setCommissions] = useState([]);
+  const [totals, setTotals] = useState({ pending: 0, paid: 0 });
+  const [nextCursor, setNextCursor] = useState(null);
 
   useEffect(() => {
     fetchCommissions();
   }, []);
 
-  const fetchCommissions = async () => {
+  const fetchCommissions = async (cursor = null) => {
     try {
       const endpoint =
         user?.role === "admin"
           ? `${API}/commissions/all`
           : `${API}/commissions/my`;
-      const response = await axios.get(endpoint);
-      setCommissions(response.data);
+      const response = await axios.get(endpoint, {
+        params: cursor ? { cursor } : {},
+      });
+      setCommissions((previous) =>
+        cursor
+          ? [...previous, ...response.data.commissions]
+          : response.data.commissions
+      );
+      setTotals({ pending: response.data.pending, paid: response.data.paid });
+      setNextCursor(response.data.nextCursor);
     } catch (error) {
       toast.error("Failed to fetch commissions");
     }
   };
 
-  const totalPending = commissions
-    .filter((c) => c.status === "pending")
-    .reduce((sum, c) => sum + c.commissionAmount, 0);
-  const totalPaid = commissions
-    .filter((c) => c.status === "paid")
-    .reduce((sum, c) => sum + c.commissionAmount, 0);
+  const totalPending = totals.pending;
+  const totalPaid = totals.paid;
 
   return (
     <div className="space-y-6">
@@ -1625,6 +1669,16 @@ const CommissionsTab = ({ user }) => {
               </div>
             ))}
           </div>
+          {nextCursor && (
+            <Button
+              variant="outline"
+              className="w-full mt-4"
+              onClick={() => fetchCommissions(nextCursor)}
+              data-testid="load-more-commissions"
+            >
+              Load more
+            </Button>
+          )}
         </CardContent>
       </Card>
     </div>